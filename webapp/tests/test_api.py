@@ -0,0 +1,317 @@
+import json
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from tests.test_views import TestCaseRandomApp
+from utils.models import *
+
+
+class ChildrenApiTests(TestCaseRandomApp):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.get(username=self.example_user)
+        self.parent = Directory.objects.create(name='rodzic', owner=self.owner)
+        self.dirs = [Directory.objects.create(name='dir%d' % i, owner=self.owner, parent_dir=self.parent) for i in range(3)]
+        self.files = [File.objects.create(name='file%d' % i, owner=self.owner, parent_dir=self.parent, content='users_files/test.txt') for i in range(2)]
+        Directory.objects.create(name='wnuk', owner=self.owner, parent_dir=self.dirs[0])
+
+    def get_children(self, id, **params):
+        return self.client.get(reverse('children', args=[id]), params)
+
+    def test_not_logged_in(self):
+        response = self.get_children(self.parent.id)
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_one_level(self):
+        self.login()
+        page = self.get_children(self.parent.id).json()
+
+        self.assertEqual([dir['name'] for dir in page['directories']], ['dir0', 'dir1', 'dir2'])
+        self.assertEqual([file['name'] for file in page['files']], ['file0', 'file1'])
+        self.assertEqual(page['files'][0]['url'], '/users_files/users_files/test.txt')
+        self.assertIsNone(page['next'])
+
+    def test_rows_read_once(self):
+        self.login()
+        with CaptureQueriesContext(connection) as queries:
+            page = self.get_children(self.parent.id).json()
+
+        self.assertEqual(page['files'][0]['size'], 0)
+        self.assertEqual(page['directories'][0]['direct_dirs'], 1)
+        self.assertEqual(len([query for query in queries if 'FROM "utils_file"' in query['sql']]), 1)
+        self.assertEqual(len([query for query in queries if 'FROM "utils_directory"' in query['sql']]), 2)
+
+    def test_aggregates(self):
+        self.login()
+        page = self.client.get(reverse('root_children')).json()
+
+        self.assertEqual(page['directories'][0]['direct_dirs'], 3)
+        self.assertEqual(page['directories'][0]['total_dirs'], 4)
+        self.assertEqual(page['directories'][0]['total_files'], 2)
+        self.assertEqual(page['directories'][0]['total_bytes'], 2 * File.objects.get(id=self.files[0].id).size)
+
+    def test_root(self):
+        self.login()
+        page = self.client.get(reverse('root_children')).json()
+
+        self.assertEqual([dir['name'] for dir in page['directories']], ['rodzic'])
+        self.assertEqual(page['files'], [])
+
+    def test_keyset_pagination(self):
+        self.login()
+        names = []
+        after = ''
+
+        while after is not None:
+            page = self.get_children(self.parent.id, limit=2, after=after).json()
+            names += [dir['name'] for dir in page['directories']] + [file['name'] for file in page['files']]
+            after = page['next']
+
+        self.assertEqual(names, ['dir0', 'dir1', 'dir2', 'file0', 'file1'])
+
+    def test_bad_cursor(self):
+        self.login()
+
+        self.assertEqual(self.get_children(self.parent.id, after='x1').status_code, 400)
+        self.assertEqual(self.get_children(self.parent.id, limit='abc').status_code, 400)
+
+    def test_other_users_directory(self):
+        self.login2()
+
+        self.assertEqual(self.get_children(self.parent.id).status_code, 404)
+
+    def test_deleted_directory(self):
+        self.parent.availability_flag = False
+        self.parent.save()
+        self.login()
+
+        self.assertEqual(self.get_children(self.parent.id).status_code, 404)
+
+
+class LazyIndexTests(TestCaseRandomApp):
+    @override_settings(TREE_EAGER_NODES=3, TREE_PAGE_SIZE=2)
+    def test_large_tree_renders_first_level(self):
+        owner = User.objects.get(username=self.example_user)
+        top = [Directory.objects.create(name='top%d' % i, owner=owner) for i in range(3)]
+        Directory.objects.create(name='nested', owner=owner, parent_dir=top[0])
+
+        self.login()
+        response = self.client.get(self.url, {'nojs' : 1})
+
+        self.assertContains(response, 'top0/')
+        self.assertContains(response, 'top1/')
+        self.assertNotContains(response, 'top2/')
+        self.assertNotContains(response, 'nested')
+        self.assertContains(response, 'data-lazy="true"')
+        self.assertContains(response, 'data-after="d%d"' % top[1].id)
+
+    def test_small_tree_renders_everything(self):
+        owner = User.objects.get(username=self.example_user)
+        top = Directory.objects.create(name='top', owner=owner)
+        Directory.objects.create(name='nested', owner=owner, parent_dir=top)
+
+        self.login()
+        response = self.client.get(self.url, {'nojs' : 1})
+
+        self.assertContains(response, 'nested')
+        self.assertNotContains(response, 'data-lazy')
+
+
+class SearchApiTests(TestCaseRandomApp):
+    def setUp(self):
+        super().setUp()
+        owner = User.objects.get(username=self.example_user)
+        self.alpha = Directory.objects.create(name='alpha', owner=owner)
+        self.alps = File.objects.create(name='alps.txt', owner=owner, parent_dir=self.alpha, content='users_files/test.txt')
+        Directory.objects.create(name='beta', owner=owner)
+        Directory.objects.create(name='alpine', owner=User.objects.get(username=self.example_user_2))
+        Directory.objects.create(name='aldead', owner=owner, availability_flag=False)
+
+    def search(self, **params):
+        response = self.client.get(reverse('search'), params)
+        self.assertEqual(response.status_code, 200)
+        return [(node['kind'], node['name']) for node in response.json()['results']]
+
+    def test_prefix(self):
+        self.login()
+
+        self.assertEqual(self.search(q='al'), [('dir', 'alpha'), ('file', 'alps.txt')])
+        self.assertEqual(self.search(q='al', kind='dir'), [('dir', 'alpha')])
+        self.assertEqual(self.search(q='al', kind='file'), [('file', 'alps.txt')])
+        self.assertEqual(self.search(q='zzz'), [])
+
+    def test_limit(self):
+        self.login()
+
+        self.assertEqual(self.search(limit=2), [('dir', 'alpha'), ('file', 'alps.txt')])
+        self.assertEqual(len(self.search(limit=1000)), 3)
+
+    def test_bad_params(self):
+        self.login()
+
+        self.assertEqual(self.client.get(reverse('search'), {'kind': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('search'), {'limit': 'x'}).status_code, 400)
+
+    def test_not_logged_in(self):
+        self.assertEqual(self.client.get(reverse('search')).status_code, 403)
+
+    def test_index_has_no_option_lists(self):
+        self.login()
+        response = self.client.get(self.url)
+
+        self.assertNotContains(response, '<option value="%d"' % self.alpha.id)
+        self.assertContains(response, 'data-kind="dir"')
+
+
+class ChangesApiTests(TestCaseRandomApp):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.get(username=self.example_user)
+        self.login()
+        self.since = self.client.get(reverse('tree')).json()['cursor']
+
+    def get_changes(self, since=None):
+        return self.client.get(reverse('changes'), {'since' : self.since if since is None else since})
+
+    def test_not_logged_in(self):
+        self.logout()
+
+        self.assertEqual(self.get_changes().status_code, 403)
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.get_changes('abc').status_code, 400)
+        self.assertEqual(self.get_changes(-1).status_code, 400)
+
+    def test_only_changes_after_cursor(self):
+        dir = Directory.objects.create(name='katalog', owner=self.owner)
+        file = File.objects.create(name='plik', owner=self.owner, parent_dir=dir, content='users_files/test.txt')
+        dir.name = 'nowa'
+        dir.save()
+
+        page = self.get_changes().json()
+
+        self.assertEqual([(change['op'], change['kind'], change['id']) for change in page['changes']], [
+            ('create', 'd', dir.id), ('create', 'f', file.id), ('modify', 'd', dir.id),
+        ])
+        self.assertEqual(page['changes'][1]['parent'], dir.id)
+        self.assertEqual(page['changes'][1]['url'], '/users_files/users_files/test.txt')
+        self.assertEqual(dir.id, file.id)
+        self.assertNotIn('url', page['changes'][0])
+        self.assertEqual(page['changes'][2]['name'], 'nowa')
+        self.assertFalse(page['more'])
+        self.assertEqual(self.get_changes(page['cursor']).json()['changes'], [])
+
+    def test_subtree_delete_is_one_change(self):
+        dir = Directory.objects.create(name='katalog', owner=self.owner)
+        Directory.objects.create(name='dziecko', owner=self.owner, parent_dir=dir)
+        since = self.get_changes().json()['cursor']
+
+        self.client.post(reverse('delete'), {'to_delete' : 'd:%d' % dir.id})
+        changes = self.get_changes(since).json()['changes']
+
+        self.assertEqual([(change['op'], change['id']) for change in changes], [('delete', dir.id)])
+
+    def test_other_users_changes(self):
+        Directory.objects.create(name='cudzy', owner=User.objects.get(username=self.example_user_2))
+
+        self.assertEqual(self.get_changes().json()['changes'], [])
+
+    @override_settings(TREE_CHANGES_PAGE=2)
+    def test_pages(self):
+        for i in range(3):
+            Directory.objects.create(name='dir%d' % i, owner=self.owner)
+
+        first = self.get_changes().json()
+        second = self.get_changes(first['cursor']).json()
+
+        self.assertTrue(first['more'])
+        self.assertEqual(len(first['changes']), 2)
+        self.assertFalse(second['more'])
+        self.assertEqual([change['name'] for change in second['changes']], ['dir2'])
+
+
+class BatchApiTests(TestCaseRandomApp):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.get(username=self.example_user)
+        self.dir = Directory.objects.create(name='katalog', owner=self.owner)
+        self.file = File.objects.create(name='plik', owner=self.owner, parent_dir=self.dir, content='users_files/test.txt')
+        self.login()
+
+    def post(self, ops):
+        return self.client.post(reverse('batch'), json.dumps({'ops' : ops}), content_type='application/json')
+
+    def test_not_logged_in(self):
+        self.logout()
+
+        self.assertEqual(self.post([]).status_code, 403)
+
+    def test_get(self):
+        self.assertEqual(self.client.get(reverse('batch')).status_code, 405)
+
+    def test_bad_body(self):
+        response = self.client.post(reverse('batch'), 'nie json', content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_operations(self):
+        version = TreeState.current(self.owner.id)
+
+        response = self.post([
+            {'op' : 'mkdir', 'name' : 'nowy', 'ref' : 'nowy'},
+            {'op' : 'mkdir', 'name' : 'dziecko', 'parent' : 'nowy'},
+            {'op' : 'move', 'kind' : 'f', 'id' : self.file.id, 'parent' : 'nowy'},
+            {'op' : 'rename', 'id' : self.dir.id, 'name' : 'stary'},
+            {'op' : 'move', 'id' : self.dir.id, 'parent' : 'nowy'},
+            {'op' : 'delete', 'id' : 'nowy'},
+        ])
+        body = response.json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(all(result['ok'] for result in body['results']))
+        self.assertEqual(body['results'][5]['count'], 4)
+        self.assertGreater(body['version'], version)
+
+        new = Directory.objects.get(name='nowy')
+        self.assertEqual(File.objects.get(id=self.file.id).parent_dir_id, new.id)
+        self.assertEqual(Directory.objects.get(id=self.dir.id).name, 'stary')
+        self.assertEqual(Directory.objects.get(id=self.dir.id).path, '%s%d/' % (new.path, self.dir.id))
+        self.assertFalse(Directory.objects.live().exists())
+
+    def test_failure_rolls_back(self):
+        response = self.post([
+            {'op' : 'mkdir', 'name' : 'nowy'},
+            {'op' : 'rename', 'kind' : 'f', 'id' : self.file.id, 'name' : 'zmieniony'},
+            {'op' : 'delete', 'id' : 12345},
+        ])
+        body = response.json()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(body['results'][2], {'ok' : False, 'error' : "No such node"})
+        self.assertFalse(Directory.objects.filter(name='nowy').exists())
+        self.assertEqual(File.objects.get(id=self.file.id).name, 'plik')
+
+    def test_move_into_itself(self):
+        child = Directory.objects.create(name='dziecko', owner=self.owner, parent_dir=self.dir)
+
+        response = self.post([{'op' : 'move', 'id' : self.dir.id, 'parent' : child.id}])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['results'][0]['error'], "Cannot move a directory into itself")
+
+    def test_other_users_nodes(self):
+        self.logout()
+        self.login2()
+
+        response = self.post([{'op' : 'rename', 'id' : self.dir.id, 'name' : 'cudzy'}])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Directory.objects.get(id=self.dir.id).name, 'katalog')
+
+    @override_settings(BATCH_MAX_OPS=2)
+    def test_too_many(self):
+        self.assertEqual(self.post([{'op' : 'mkdir', 'name' : 'x'}] * 3).status_code, 400)
@@ -0,0 +1,182 @@
+import io
+import tarfile
+import time
+import zipfile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.urls import reverse
+
+from tests.test_storage import stored_files
+from tests.test_views import TestCaseRandomApp
+from utils.aggregates import recompute_aggregates
+from utils.ancestry import rebuild_closure
+from utils.models import *
+
+
+def zip_bytes(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members:
+            if data is None:
+                archive.writestr(zipfile.ZipInfo(name + '/'), b'')
+            else:
+                archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def tar_bytes(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            if data is None:
+                info.type = tarfile.DIRTYPE
+                archive.addfile(info)
+            else:
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+class ArchiveUploadTests(TestCaseRandomApp):
+    members = [
+        ('projekt/main.c', b'int main() {}\n'),
+        ('projekt/src/a.c', b'int a;\n'),
+        ('projekt/src/b.c', b'int b;\nint c;\n'),
+        ('projekt/src/lib/util.h', b'#pragma once\n'),
+        ('projekt/docs', None),
+        ('projekt/kopia.c', b'int a;\n'),
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.get(username=self.example_user)
+        self.parent = Directory.objects.create(name='cel', owner=self.owner)
+        self.login()
+
+    def post(self, *files, extract=True, name='paczka'):
+        data = {"file_name" : name, "file_desc" : '', "dest_for_file" : str(self.parent.id), "file_file" : list(files)}
+        if extract:
+            data['extract'] = 'on'
+        return self.client.post(reverse("add_file"), data=data)
+
+    def tree(self, dir):
+        names = lambda node: [ancestor.name for ancestor in node.ancestors()] + [node.name]
+        return sorted(
+            ['/'.join(names(node)) + '/' for node in dir.subdirs()] + ['/'.join(names(node)) for node in dir.subfiles()]
+        )
+
+    def check_extracted(self):
+        top = Directory.objects.get(parent_dir=self.parent)
+        self.assertEqual(top.name, 'paczka')
+        self.assertEqual(self.tree(top), [
+            'cel/paczka/projekt/',
+            'cel/paczka/projekt/docs/',
+            'cel/paczka/projekt/kopia.c',
+            'cel/paczka/projekt/main.c',
+            'cel/paczka/projekt/src/',
+            'cel/paczka/projekt/src/a.c',
+            'cel/paczka/projekt/src/b.c',
+            'cel/paczka/projekt/src/lib/',
+            'cel/paczka/projekt/src/lib/util.h',
+        ])
+
+        self.assertEqual(recompute_aggregates(fix=False), [])
+        parent = Directory.objects.get(id=self.parent.id)
+        self.assertEqual((parent.total_dirs, parent.total_files), (5, 5))
+
+        b = File.objects.get(name='b.c')
+        self.assertEqual((b.size, b.lines), (14, 2))
+        with b.content.open('rb') as content:
+            self.assertEqual(content.read(), b'int b;\nint c;\n')
+        self.assertEqual(Blob.objects.get(digest=File.objects.get(name='a.c').sha256).refs, 2)
+
+        changes = TreeChange.objects.filter(owner=self.owner).order_by('id')
+        self.assertEqual(changes.filter(op='create', kind='d').count(), 6)
+        self.assertEqual(changes.filter(op='create', kind='f').count(), 5)
+
+    def test_zip(self):
+        response = self.post(SimpleUploadedFile('paczka.zip', zip_bytes(self.members)))
+
+        self.assertEqual(response.status_code, 302)
+        self.check_extracted()
+
+    def test_tar_gz(self):
+        response = self.post(SimpleUploadedFile('paczka.tar.gz', tar_bytes(self.members)))
+
+        self.assertEqual(response.status_code, 302)
+        self.check_extracted()
+
+    @override_settings(TREE_CLOSURE_TABLE=True)
+    def test_closure_rows(self):
+        rebuild_closure()
+        self.post(SimpleUploadedFile('paczka.zip', zip_bytes(self.members)))
+
+        rows = set(DirectoryClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+        rebuild_closure()
+        self.assertEqual(rows, set(DirectoryClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth')))
+
+    def test_unsafe_paths_skipped(self):
+        self.post(SimpleUploadedFile('paczka.zip', zip_bytes([('../evil.c', b'x'), ('/etc/passwd', b'root'), ('ok.c', b'y')])))
+
+        self.assertEqual(sorted(File.objects.values_list('name', flat=True)), ['ok.c', 'passwd'])
+        self.assertEqual(File.objects.get(name='passwd').parent_dir.name, 'etc')
+
+    @override_settings(ARCHIVE_MAX_ENTRIES=3)
+    def test_entry_limit(self):
+        response = self.post(SimpleUploadedFile('paczka.zip', zip_bytes(self.members)))
+
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        self.assertEqual(self.messages(response), ["Archive has more than 3 entries"])
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(Directory.objects.exclude(id=self.parent.id).exists())
+
+    @override_settings(ARCHIVE_MAX_SIZE=1000)
+    def test_expanded_size_limit(self):
+        response = self.post(SimpleUploadedFile('bomba.zip', zip_bytes([('zera', b'\0' * 100000)])))
+
+        self.assertEqual(self.messages(response), ["Archive expands to more than 1000 bytes"])
+        self.assertFalse(File.objects.exists())
+
+    def test_bad_archive(self):
+        response = self.post(SimpleUploadedFile('zepsute.tar.gz', b'not really'))
+
+        self.assertEqual(self.messages(response), ["Not a valid archive"])
+
+    def test_bad_archive_after_a_file(self):
+        response = self.post(SimpleUploadedFile('a.c', b'int a;\n'), SimpleUploadedFile('b.zip', b'not really'))
+
+        self.assertEqual(self.messages(response), ["Not a valid archive"])
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(stored_files(self.media), [])
+
+    def test_not_extracted(self):
+        self.post(SimpleUploadedFile('paczka.zip', zip_bytes(self.members)), extract=False)
+
+        self.assertEqual(list(File.objects.values_list('name', flat=True)), ['paczka'])
+        self.assertFalse(Directory.objects.exclude(id=self.parent.id).exists())
+
+    def test_several_files(self):
+        self.post(
+            SimpleUploadedFile('a.c', b'int a;\n'),
+            SimpleUploadedFile('b.c', b'int b;\n'),
+            SimpleUploadedFile('lib.zip', zip_bytes([('util.h', b'#pragma once\n')])),
+        )
+
+        self.assertEqual(sorted(File.objects.values_list('name', flat=True)), ['a.c', 'b.c', 'util.h'])
+        self.assertEqual(File.objects.get(name='util.h').parent_dir.name, 'lib')
+        self.assertEqual(recompute_aggregates(fix=False), [])
+
+    def test_large_project(self):
+        members = [('src/mod%d/file%d.c' % (i // 50, i), b'int x%d;\n' % i) for i in range(5000)]
+        upload = SimpleUploadedFile('projekt.zip', zip_bytes(members))
+
+        start = time.perf_counter()
+        self.post(upload)
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(File.objects.count(), 5000)
+        self.assertEqual(Directory.objects.get(id=self.parent.id).total_dirs, 102)
+        self.assertLess(elapsed, 20)
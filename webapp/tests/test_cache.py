@@ -0,0 +1,167 @@
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+
+from tests.test_views import TestCaseRandomApp
+from utils.models import *
+from utils.treecache import stats
+
+
+class TreeCacheTests(TestCaseRandomApp):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.get(username=self.example_user)
+        self.dir = Directory.objects.create(name='katalog', owner=self.owner)
+        self.login()
+
+    def test_second_request_is_a_hit(self):
+        first = self.client.get(self.url)
+        second = self.client.get(self.url)
+
+        self.assertIn('desc="miss"', first['Server-Timing'])
+        self.assertIn('desc="hit"', second['Server-Timing'])
+        self.assertContains(second, '"katalog"')
+        self.assertEqual(stats()['hits'], 1)
+        self.assertEqual(stats()['misses'], 1)
+        self.assertEqual(stats()['hit_ratio'], 0.5)
+
+    def test_hit_skips_tree_queries(self):
+        self.client.get(self.url)
+
+        with self.assertNumQueries(3):
+            self.client.get(self.url)
+
+    def test_add_dir_invalidates(self):
+        self.client.get(self.url)
+
+        response = self.client.post(reverse("add_dir"), data={
+            "dir_name": 'nowy',
+            "dir_desc": '',
+            "dest_for_dir": self.dir.id
+        }, follow=True)
+
+        self.assertContains(response, '"nowy"')
+        self.assertIn('desc="miss"', response['Server-Timing'])
+
+    def test_delete_invalidates(self):
+        self.client.get(self.url)
+
+        response = self.client.post(reverse("delete"), data={"to_delete": 'd:%d' % self.dir.id}, follow=True)
+
+        self.assertNotContains(response, 'katalog/')
+
+    def test_versions_are_per_user(self):
+        self.client.get(self.url)
+        Directory.objects.create(name='cudzy', owner=User.objects.get(username=self.example_user_2))
+
+        response = self.client.get(self.url)
+
+        self.assertIn('desc="hit"', response['Server-Timing'])
+
+    def test_json_form(self):
+        File.objects.create(name='plik', owner=self.owner, parent_dir=self.dir, content='users_files/test.txt')
+
+        tree = self.client.get(reverse("tree")).json()
+
+        self.assertEqual(tree['version'], TreeState.current(self.owner.id))
+        self.assertEqual(tree['directories'], [[self.dir.id, None, 'katalog', False]])
+        self.assertEqual(tree['files'][0][:3], [File.objects.get().id, self.dir.id, 'plik'])
+
+
+class TreeCacheBackendsTests(TestCaseRandomApp):
+    def check_backend(self):
+        cache.clear()
+        owner = User.objects.get(username=self.example_user)
+        Directory.objects.create(name='pierwszy', owner=owner)
+        self.login()
+
+        self.assertIn('desc="miss"', self.client.get(self.url)['Server-Timing'])
+        response = self.client.get(self.url)
+        self.assertIn('desc="hit"', response['Server-Timing'])
+        self.assertContains(response, '"pierwszy"')
+
+        Directory.objects.create(name='drugi', owner=owner)
+        response = self.client.get(self.url)
+        self.assertIn('desc="miss"', response['Server-Timing'])
+        self.assertContains(response, '"drugi"')
+        self.assertEqual(stats()['hits'], 1)
+
+    def test_locmem(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tree-test'}}):
+            self.check_backend()
+
+    def test_file(self):
+        location = tempfile.mkdtemp()
+        try:
+            with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}):
+                self.check_backend()
+        finally:
+            shutil.rmtree(location)
+
+    def test_database(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'tree_test_cache'}}):
+            call_command('createcachetable', verbosity=0)
+            self.check_backend()
+
+
+class ETagTests(TestCaseRandomApp):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.get(username=self.example_user)
+        self.dir = Directory.objects.create(name='katalog', owner=self.owner)
+        self.login()
+
+    def test_not_modified(self):
+        self.client.get(self.url)
+        etag = self.client.get(self.url)['ETag']
+
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(etag.startswith('W/'))
+
+    def test_change_gives_new_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        Directory.objects.create(name='nowy', owner=self.owner)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, '"nowy"')
+
+    def test_etag_is_per_user(self):
+        etag = self.client.get(self.url)['ETag']
+        self.logout()
+        self.login2()
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_no_etag_for_anonymous(self):
+        self.logout()
+
+        self.assertFalse(self.client.get(self.url).has_header('ETag'))
+
+    def test_no_match_while_messages_pending(self):
+        etag = self.client.get(self.url)['ETag']
+        other = Directory.objects.create(name='inny', owner=self.owner)
+        self.client.post(reverse("delete"), data={"to_delete": 'd:%d' % other.id})
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertContains(response, 'Deleted 1 item')
+
+    def test_json_endpoints(self):
+        for url in (reverse("tree"), reverse("children", args=[self.dir.id]), reverse("root_children")):
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.assertNotEqual(
+            self.client.get(reverse("root_children"))['ETag'],
+            self.client.get(reverse("root_children"), {'limit': 1})['ETag']
+        )
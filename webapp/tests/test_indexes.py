@@ -0,0 +1,77 @@
+import unittest
+
+from django.db import connection
+
+from tests.test_views import TestCaseRandomApp
+from utils.models import *
+from utils.tree import load_children
+
+
+def query_plan(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return ' '.join(row[-1] for row in cursor.fetchall())
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'query plans are checked on SQLite')
+class LiveIndexTests(TestCaseRandomApp):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.get(username=self.example_user)
+        self.parent = Directory.objects.create(name='rodzic', owner=self.owner)
+
+    def assertUsesIndex(self, queryset, index):
+        plan = query_plan(queryset)
+        self.assertRegex(plan, r'USING (COVERING )?INDEX %s\b' % index)
+        self.assertNotIn('USE TEMP B-TREE', plan)
+
+    def test_live_manager(self):
+        dir = Directory.objects.create(name='usuniety', owner=self.owner, parent_dir=self.parent)
+        dir.soft_delete()
+
+        self.assertEqual(list(Directory.objects.live()), [self.parent])
+        self.assertEqual(Directory.objects.count(), 2)
+
+    def test_whole_tree(self):
+        for model, index in ((Directory, 'utils_dir_live_owner_idx'), (File, 'utils_file_live_owner_idx')):
+            self.assertUsesIndex(
+                model.objects.live().filter(owner=self.owner).order_by('id').values_list('id', 'parent_dir_id', 'name'),
+                index
+            )
+
+    def test_children_page(self):
+        for model, index in ((Directory, 'utils_dir_live_parent_idx'), (File, 'utils_file_live_parent_idx')):
+            for parent_id in (self.parent.id, None):
+                self.assertUsesIndex(
+                    model.objects.live().filter(owner=self.owner, parent_dir_id=parent_id, id__gt=10).order_by('id'),
+                    index
+                )
+
+    def test_search(self):
+        for model, index in ((Directory, 'utils_dir_live_name_idx'), (File, 'utils_file_live_name_idx')):
+            self.assertUsesIndex(
+                model.objects.live().filter(owner=self.owner, name__startswith='ro').order_by('name', 'id').values_list('id', 'name'),
+                index
+            )
+
+    def test_path_order(self):
+        self.assertUsesIndex(
+            Directory.objects.live().filter(owner=self.owner).order_by('path').values_list('path', 'id', 'name'),
+            'utils_dir_live_path_idx'
+        )
+        self.assertUsesIndex(
+            File.objects.live().filter(owner=self.owner).order_by('path', 'id').values_list('path', 'id', 'name', 'content'),
+            'utils_file_live_path_idx'
+        )
+
+    def test_subtree(self):
+        plan = query_plan(Directory.objects.live().filter(subtree_filter(self.parent.path)))
+
+        self.assertIn('utils_directory_path', plan)
+
+    def test_deleted_rows_not_returned(self):
+        File.objects.create(name='plik', owner=self.owner, parent_dir=self.parent, content='users_files/test.txt').soft_delete()
+        dir_rows, file_rows, cursor = load_children(self.owner, self.parent.id)
+
+        self.assertEqual(file_rows, [])
@@ -1,13 +1,16 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.db import IntegrityError
 from django.utils.crypto import get_random_string
 from django.core.exceptions import ValidationError
 from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
 
 import random
 import mock
 
 from utils.models import *
+from utils import ancestry
+from utils.aggregates import recompute_aggregates
 
 #tests for models
 
@@ -94,4 +97,222 @@ class FileTests(TestCase):
         self.assertEqual(file.description, description)
         self.assertEqual(file.owner, self.user)
         self.assertEqual(file.parent_dir, parent_dir)
-        self.assertEqual(file.content, file_mock)
\ No newline at end of file
+        self.assertEqual(file.content, file_mock)
+
+class PathTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.a = Directory.objects.create(name='a', owner=self.user)
+        self.b = Directory.objects.create(name='b', owner=self.user, parent_dir=self.a)
+        self.c = Directory.objects.create(name='c', owner=self.user, parent_dir=self.b)
+        self.other = Directory.objects.create(name='other', owner=self.user)
+        self.file = File.objects.create(name='f', owner=self.user, parent_dir=self.c, content='users_files/test.txt')
+
+    def test_paths_on_create(self):
+        self.assertEqual(self.a.path, '/%d/' % self.a.id)
+        self.assertEqual(self.c.path, '/%d/%d/%d/' % (self.a.id, self.b.id, self.c.id))
+        self.assertEqual(Directory.objects.get(id=self.c.id).path, self.c.path)
+        self.assertEqual(self.file.path, self.c.path)
+        self.assertEqual(File.objects.create(name='g', owner=self.user, content='users_files/test.txt').path, '/')
+
+    def test_depth(self):
+        self.assertEqual(self.a.depth, 0)
+        self.assertEqual(self.c.depth, 2)
+        self.assertEqual(self.file.depth, 3)
+
+    def test_ancestors(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(list(self.c.ancestors()), [self.a, self.b])
+        self.assertEqual(list(self.file.ancestors()), [self.a, self.b, self.c])
+        self.assertEqual(list(self.a.ancestors()), [])
+
+    def test_subtree(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(set(self.a.subdirs()), {self.b, self.c})
+        with self.assertNumQueries(1):
+            self.assertEqual(list(self.a.subfiles()), [self.file])
+        self.assertEqual(list(self.other.subfiles()), [])
+
+    def test_move(self):
+        self.b.parent_dir = self.other
+        self.b.save()
+
+        c = Directory.objects.get(id=self.c.id)
+        self.assertEqual(c.path, '/%d/%d/%d/' % (self.other.id, self.b.id, self.c.id))
+        self.assertEqual(File.objects.get(id=self.file.id).path, c.path)
+        self.assertEqual(list(self.a.subdirs()), [])
+        self.assertEqual(set(self.other.subdirs()), {self.b, c})
+
+    def test_move_into_itself(self):
+        self.a.parent_dir = Directory.objects.get(id=self.c.id)
+
+        with self.assertRaises(ValidationError):
+            self.a.save()
+
+    def test_move_with_stale_instances(self):
+        self.b.parent_dir = self.other
+        self.b.save()
+
+        # self.c still holds its path from before b moved
+        d = Directory.objects.create(name='d', owner=self.user, parent_dir=self.c)
+        self.c.name = 'nowa'
+        self.c.save()
+
+        c = Directory.objects.get(id=self.c.id)
+        self.assertEqual(c.path, '/%d/%d/%d/' % (self.other.id, self.b.id, self.c.id))
+        self.assertEqual(d.path, c.path + '%d/' % d.id)
+        self.assertEqual(recompute_aggregates(fix=False), [])
+
+    def test_file_under_stale_parent(self):
+        self.b.parent_dir = self.other
+        self.b.save()
+
+        # self.c still holds its path from before b moved
+        file = File.objects.create(name='g', owner=self.user, parent_dir=self.c, content='users_files/test.txt', size=5)
+
+        self.assertEqual(file.path, Directory.objects.get(id=self.c.id).path)
+        self.assertEqual(recompute_aggregates(fix=False), [])
+
+    def test_failed_move_leaves_nothing(self):
+        self.b.parent_dir = self.other
+        with mock.patch('utils.models.move_subtree', side_effect=RuntimeError('przerwane')):
+            with self.assertRaises(RuntimeError):
+                self.b.save()
+
+        self.assertEqual(Directory.objects.get(id=self.b.id).path, '/%d/%d/' % (self.a.id, self.b.id))
+        self.assertEqual(Directory.objects.get(id=self.other.id).total_dirs, 0)
+        self.assertEqual(recompute_aggregates(fix=False), [])
+
+
+class AncestryTestsMixin:
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.a = Directory.objects.create(name='a', owner=self.user)
+        self.b = Directory.objects.create(name='b', owner=self.user, parent_dir=self.a)
+        self.c = Directory.objects.create(name='c', owner=self.user, parent_dir=self.b)
+        self.other = Directory.objects.create(name='other', owner=self.user)
+        self.file = File.objects.create(name='f', owner=self.user, parent_dir=self.c, content='users_files/test.txt')
+
+    def test_descendants(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(set(ancestry.descendant_dirs(self.a)), {self.b, self.c})
+        with self.assertNumQueries(1):
+            self.assertEqual(list(ancestry.descendant_files(self.b)), [self.file])
+        self.assertEqual(list(ancestry.descendant_dirs(self.c)), [])
+
+    def test_ancestors(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(list(ancestry.ancestor_dirs(self.c)), [self.a, self.b])
+        self.assertEqual(list(ancestry.ancestor_dirs(self.file)), [self.a, self.b, self.c])
+        self.assertEqual(list(ancestry.ancestor_dirs(self.a)), [])
+
+    def test_is_under(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(ancestry.is_under(self.c, self.a))
+        self.assertTrue(ancestry.is_under(self.file, self.a))
+        self.assertFalse(ancestry.is_under(self.a, self.c))
+        self.assertFalse(ancestry.is_under(self.a, self.a))
+        self.assertFalse(ancestry.is_under(self.file, self.other))
+
+    def test_move(self):
+        self.b.parent_dir = self.other
+        self.b.save()
+
+        self.assertTrue(ancestry.is_under(self.c, self.other))
+        self.assertFalse(ancestry.is_under(self.c, self.a))
+        self.assertEqual(list(ancestry.ancestor_dirs(self.file)), [self.other, self.b, self.c])
+        self.assertEqual(list(ancestry.descendant_dirs(self.a)), [])
+
+
+@override_settings(TREE_CLOSURE_TABLE=True)
+class ClosureAncestryTests(AncestryTestsMixin, TestCase):
+    def test_rebuild(self):
+        rows = set(DirectoryClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+        DirectoryClosure.objects.all().delete()
+
+        ancestry.rebuild_closure()
+
+        self.assertEqual(set(DirectoryClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth')), rows)
+
+
+@override_settings(TREE_CLOSURE_TABLE=False)
+class CteAncestryTests(AncestryTestsMixin, TestCase):
+    def test_closure_not_maintained(self):
+        self.assertFalse(DirectoryClosure.objects.exists())
+
+
+class SingleTableTests(TestCase):
+    def test_no_parent_tables(self):
+        self.assertEqual(Directory._meta.parents, {})
+        self.assertEqual(File._meta.parents, {})
+
+    def test_reads_do_not_join(self):
+        self.assertNotIn('JOIN', str(Directory.objects.all().query))
+        self.assertNotIn('JOIN', str(File.objects.all().query))
+
+
+class AggregateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.a = Directory.objects.create(name='a', owner=self.user)
+        self.b = Directory.objects.create(name='b', owner=self.user, parent_dir=self.a)
+        self.c = Directory.objects.create(name='c', owner=self.user, parent_dir=self.b)
+        self.other = Directory.objects.create(name='other', owner=self.user)
+        File.objects.create(name='f', owner=self.user, parent_dir=self.b, content='users_files/test.txt', size=10)
+        self.file = File.objects.create(name='g', owner=self.user, parent_dir=self.c, content='users_files/test.txt', size=5)
+
+    def aggregates(self, dir):
+        return Directory.objects.filter(id=dir.id).values_list(*Directory.AGGREGATES).get()
+
+    def assertConsistent(self):
+        self.assertEqual(recompute_aggregates(fix=False), [])
+
+    def test_add(self):
+        self.assertEqual(self.aggregates(self.a), (1, 0, 2, 2, 15))
+        self.assertEqual(self.aggregates(self.b), (1, 1, 1, 2, 15))
+        self.assertEqual(self.aggregates(self.c), (0, 1, 0, 1, 5))
+        self.assertConsistent()
+
+    def test_size_from_upload(self):
+        file = File.objects.create(name='h', owner=self.user, parent_dir=self.c, content=SimpleUploadedFile('h.txt', b'12345678'))
+        file.content.delete(save=False)
+
+        self.assertEqual(file.size, 8)
+        self.assertEqual(self.aggregates(self.a)[4], 23)
+
+    def test_soft_delete(self):
+        self.file.soft_delete()
+        self.assertEqual(self.aggregates(self.a), (1, 0, 2, 1, 10))
+
+        self.b.soft_delete()
+        self.assertEqual(self.aggregates(self.a), (0, 0, 0, 0, 0))
+        self.assertConsistent()
+
+    def test_move(self):
+        self.b.parent_dir = self.other
+        self.b.save()
+
+        self.assertEqual(self.aggregates(self.a), (0, 0, 0, 0, 0))
+        self.assertEqual(self.aggregates(self.other), (1, 0, 2, 2, 15))
+        self.assertConsistent()
+
+    def test_move_file(self):
+        self.file.parent_dir = self.other
+        self.file.save()
+
+        self.assertEqual(self.aggregates(self.c), (0, 0, 0, 0, 0))
+        self.assertEqual(self.aggregates(self.other), (0, 1, 0, 1, 5))
+        self.assertConsistent()
+
+    def test_stale_instance_save(self):
+        self.a.name = 'renamed'
+        self.a.save()
+
+        self.assertEqual(self.aggregates(self.a), (1, 0, 2, 2, 15))
+
+    def test_recompute(self):
+        Directory.objects.update(total_bytes=0)
+
+        self.assertEqual(set(recompute_aggregates(fix=False)), {self.a.id, self.b.id, self.c.id})
+        self.assertEqual(len(recompute_aggregates()), 3)
+        self.assertConsistent()
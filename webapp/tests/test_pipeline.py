@@ -0,0 +1,114 @@
+import io
+from datetime import timedelta
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from unittest import mock
+
+from tests.test_archives import zip_bytes
+from tests.test_views import TestCaseRandomApp
+from utils.models import *
+from utils.pipeline import build_preview, detect_encoding, drain, in_thread, requeue_stale
+
+
+def broken(file):
+    raise ValueError('broken stage')
+
+
+@override_settings(PIPELINE_EXECUTOR='inline')
+class PipelineTests(TestCaseRandomApp):
+    text = b''.join(b'int line%d = %d;\n' % (i, i) for i in range(100))
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+
+    def add_file(self, *files, extract=False):
+        data = {"file_name" : 'prog', "file_desc" : '', "dest_for_file" : '-1', "file_file" : list(files)}
+        if extract:
+            data['extract'] = 'on'
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse("add_file"), data=data)
+
+    def stages(self, file):
+        return self.client.get(reverse("file_stages", args=[file.id])).json()['stages']
+
+    def test_stages_run_after_commit(self):
+        self.assertEqual(self.add_file(SimpleUploadedFile('prog.c', self.text)).status_code, 302)
+
+        stages = self.stages(File.objects.get())
+        self.assertEqual({name: stage['status'] for name, stage in stages.items()}, {'encoding' : 'done', 'preview' : 'done'})
+        self.assertEqual(stages['encoding']['result'], {'encoding' : 'ascii'})
+        self.assertEqual(stages['preview']['result']['preview'].splitlines(), [
+            'int line%d = %d;' % (i, i) for i in range(20)
+        ])
+
+        # not in the children listing, whose ETag only follows tree changes
+        files = self.client.get(reverse("root_children")).json()['files']
+        self.assertNotIn('stages', files[0])
+
+    def test_archive_members_queued(self):
+        self.add_file(SimpleUploadedFile('paczka.zip', zip_bytes([('a.c', b'int a;\n'), ('b.bin', b'\0\1')])), extract=True)
+
+        self.assertEqual(FileStage.objects.filter(status='done').count(), 4)
+        self.assertEqual(self.stages(File.objects.get(name='b.bin'))['encoding']['result'], {'encoding' : 'binary'})
+
+    @override_settings(PIPELINE_EXECUTOR='queue')
+    def test_queue_worked_off_by_command(self):
+        self.add_file(SimpleUploadedFile('prog.c', self.text))
+        self.assertEqual(set(FileStage.objects.values_list('status', flat=True)), {'pending'})
+
+        out = io.StringIO()
+        call_command('runpipeline', stdout=out)
+
+        self.assertIn('0 stale stages requeued, 2 stages run', out.getvalue())
+        self.assertEqual(set(FileStage.objects.values_list('status', flat=True)), {'done'})
+
+    @override_settings(UPLOAD_STAGES={'broken' : 'tests.test_pipeline.broken'}, PIPELINE_MAX_ATTEMPTS=2)
+    def test_failing_stage_retried(self):
+        self.add_file(SimpleUploadedFile('prog.c', self.text))
+        stage = FileStage.objects.get()
+        self.assertEqual((stage.status, stage.attempts), ('pending', 1))
+
+        drain()
+
+        stage.refresh_from_db()
+        self.assertEqual((stage.status, stage.attempts), ('failed', 2))
+        self.assertIn('broken stage', stage.error)
+
+    @override_settings(PIPELINE_EXECUTOR='queue', UPLOAD_STAGES={'broken' : 'tests.test_pipeline.broken'}, PIPELINE_RETRY_SECONDS=5)
+    def test_thread_retries_with_backoff(self):
+        self.add_file(SimpleUploadedFile('prog.c', self.text))
+        stage = FileStage.objects.get()
+
+        with mock.patch('utils.pipeline.threading.Timer') as timer:
+            in_thread(stage.id)
+            in_thread(stage.id)
+            in_thread(stage.id)
+
+        self.assertEqual([call.args[0] for call in timer.call_args_list], [5, 10])
+        self.assertEqual(FileStage.objects.get().status, 'failed')
+
+    @override_settings(PIPELINE_PREVIEW_BYTES=100)
+    def test_preview_of_a_long_line(self):
+        owner = User.objects.get(username=self.example_user)
+        file = File.objects.create(name='plik', owner=owner, content=SimpleUploadedFile('plik', b'x' * 10000))
+
+        self.assertEqual(build_preview(file), {'preview' : 'x' * 100})
+
+    @override_settings(PIPELINE_EXECUTOR='queue')
+    def test_stale_stage_requeued(self):
+        self.add_file(SimpleUploadedFile('prog.c', self.text))
+        FileStage.objects.update(status='running', updated=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(requeue_stale(), 2)
+        self.assertEqual(drain(), 2)
+
+    def test_detect_encoding(self):
+        owner = User.objects.get(username=self.example_user)
+        for data, encoding in ((b'abc', 'ascii'), ('zażółć'.encode(), 'utf-8'), ('zażółć'.encode('iso8859-2'), 'latin-1')):
+            file = File.objects.create(name='plik', owner=owner, content=SimpleUploadedFile('plik', data))
+            self.assertEqual(detect_encoding(file), {'encoding' : encoding})
@@ -0,0 +1,91 @@
+import io
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from tests.test_views import TempMediaMixin
+from utils.models import *
+from utils.purge import purge
+
+
+class PurgeTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = File.content.field.storage
+
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.dir = Directory.objects.create(name='a', owner=self.user)
+        self.sub = Directory.objects.create(name='b', owner=self.user, parent_dir=self.dir)
+        self.file = self.upload('plik', self.sub, b'12345')
+        self.live = self.upload('zywy', None, b'abc')
+
+    def upload(self, name, parent, data):
+        return File.objects.create(name=name, owner=self.user, parent_dir=parent, content=SimpleUploadedFile(name + '.txt', data))
+
+    def age(self, days):
+        for model in (Directory, File):
+            model.objects.filter(availability_flag=False).update(deleted_at=timezone.now() - timedelta(days=days))
+
+    def test_soft_delete_stamps_time(self):
+        self.dir.soft_delete()
+
+        self.assertIsNotNone(File.objects.get(id=self.file.id).deleted_at)
+        self.assertIsNotNone(Directory.objects.get(id=self.sub.id).deleted_at)
+        self.assertIsNone(File.objects.get(id=self.live.id).deleted_at)
+
+    def test_purges_expired_subtree(self):
+        self.dir.soft_delete()
+        self.age(31)
+
+        report = purge(timezone.now() - timedelta(days=30))
+
+        self.assertEqual((report['dirs'], report['files'], report['bytes']), (2, 1, 5))
+        self.assertFalse(Directory.objects.exists())
+        self.assertEqual(list(File.objects.all()), [self.live])
+        self.assertFalse(self.storage.exists(self.file.content.name))
+        self.assertTrue(self.storage.exists(self.live.content.name))
+
+    def test_keeps_recent_deletes(self):
+        self.dir.soft_delete()
+
+        report = purge(timezone.now() - timedelta(days=30))
+
+        self.assertEqual(report['batches'], 0)
+        self.assertTrue(self.storage.exists(self.file.content.name))
+
+    def test_keeps_shared_blob(self):
+        File.objects.create(name='kopia', owner=self.user, content=self.file.content.name)
+        self.file.soft_delete()
+        self.age(31)
+
+        report = purge(timezone.now())
+
+        self.assertEqual(report['bytes'], 0)
+        self.assertTrue(self.storage.exists(self.file.content.name))
+
+    def test_batches_are_resumable(self):
+        deep = self.sub
+        for i in range(4):
+            deep = Directory.objects.create(name='d%d' % i, owner=self.user, parent_dir=deep)
+        self.dir.soft_delete()
+        self.age(31)
+
+        first = purge(timezone.now(), batch_size=1, max_batches=2)
+        rest = purge(timezone.now(), batch_size=1)
+
+        self.assertEqual(first['batches'], 2)
+        self.assertEqual(first['dirs'] + first['files'] + rest['dirs'] + rest['files'], 7)
+        self.assertFalse(Directory.objects.exists())
+
+    def test_command(self):
+        self.dir.soft_delete()
+        self.age(8)
+        out = io.StringIO()
+
+        call_command('purge', days=7, sleep=0, stdout=out)
+
+        self.assertIn('purged 2 directories and 1 files, 5 bytes reclaimed', out.getvalue())
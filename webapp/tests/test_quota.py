@@ -0,0 +1,110 @@
+import io
+import json
+from datetime import timedelta
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from tests.test_archives import zip_bytes
+from tests.test_storage import stored_files
+from tests.test_views import TestCaseRandomApp
+from utils.models import *
+from utils.purge import purge
+
+
+@override_settings(STORAGE_QUOTA_BYTES=20, STORAGE_QUOTA_FILES=3)
+class StorageQuotaTests(TestCaseRandomApp):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.get(username=self.example_user)
+        self.login()
+
+    def add_file(self, *files, extract=False):
+        data = {"file_name" : 'plik', "file_desc" : '', "dest_for_file" : '-1', "file_file" : list(files)}
+        if extract:
+            data['extract'] = 'on'
+        return self.client.post(reverse("add_file"), data=data)
+
+    def usage(self):
+        return StorageUsage.objects.filter(owner=self.owner).values_list('bytes', 'files').first()
+
+    def test_upload_charges_usage(self):
+        self.assertEqual(self.add_file(SimpleUploadedFile('a.c', b'0123456789')).status_code, 302)
+        self.assertEqual(self.add_file(SimpleUploadedFile('b.c', b'0123456789')).status_code, 302)
+
+        self.assertEqual(self.usage(), (20, 2))
+
+    def test_over_byte_quota(self):
+        self.add_file(SimpleUploadedFile('a.c', b'0123456789'))
+        response = self.add_file(SimpleUploadedFile('b.c', b'0123456789x'))
+
+        self.assertEqual(self.messages(response), ["Storage quota exceeded"])
+        self.assertEqual(File.objects.count(), 1)
+        self.assertEqual(self.usage(), (10, 1))
+        self.assertEqual(stored_files(self.media), [File.objects.get().content.name])
+
+    def test_over_file_quota(self):
+        response = self.add_file(*[SimpleUploadedFile('%d.c' % i, b'x') for i in range(4)])
+
+        self.assertEqual(self.messages(response), ["Storage quota exceeded"])
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(self.usage() or (0, 0), (0, 0))
+
+    def test_over_quota_after_an_archive(self):
+        archive = zip_bytes([('a.c', b'0123456789')])
+        response = self.add_file(SimpleUploadedFile('paczka.zip', archive), SimpleUploadedFile('b.c', b'0123456789x'), extract=True)
+
+        self.assertEqual(self.messages(response), ["Storage quota exceeded"])
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(stored_files(self.media), [])
+
+    def test_per_user_quota(self):
+        with override_settings(STORAGE_QUOTA_BYTES_BY_USER={self.example_user: None}):
+            self.assertEqual(self.add_file(SimpleUploadedFile('a.c', b'x' * 100)).status_code, 302)
+        with override_settings(STORAGE_QUOTA_FILES_BY_USER={self.example_user: 1}):
+            self.assertEqual(self.messages(self.add_file(SimpleUploadedFile('b.c', b''))), ["Storage quota exceeded"])
+
+    def test_archive_over_quota(self):
+        archive = zip_bytes([('a.c', b'0123456789'), ('b.c', b'0123456789'), ('c.c', b'x')])
+        response = self.add_file(SimpleUploadedFile('paczka.zip', archive), extract=True)
+
+        self.assertEqual(self.messages(response), ["Storage quota exceeded"])
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(Directory.objects.exists())
+        self.assertEqual(stored_files(self.media), [])
+
+    def test_chunked_upload_over_quota(self):
+        start = lambda size: self.client.post(reverse('start_upload'), json.dumps({'name' : 'duzy', 'size' : size}), content_type='application/json')
+        self.assertEqual(start(21).status_code, 507)
+
+        id = start(10).json()['id']
+        self.client.put(reverse('upload_chunk', args=[id, 0]), b'0123456789', content_type='application/octet-stream')
+        self.add_file(SimpleUploadedFile('a.c', b'0123456789x'))
+
+        response = self.client.post(reverse('complete_upload', args=[id]))
+        self.assertEqual(response.status_code, 507)
+        self.assertEqual(response.json()['missing'], [])
+
+    def test_purge_releases_usage(self):
+        self.add_file(SimpleUploadedFile('a.c', b'0123456789'))
+        self.add_file(SimpleUploadedFile('b.c', b'0123456789'))
+
+        File.objects.order_by('id').first().soft_delete()
+        self.assertEqual(self.usage(), (20, 2))
+        purge(timezone.now() + timedelta(days=1))
+        self.assertEqual(self.usage(), (10, 1))
+
+    def test_reconcile_command(self):
+        self.add_file(SimpleUploadedFile('a.c', b'0123456789'))
+        StorageUsage.objects.filter(owner=self.owner).update(bytes=999, files=7)
+
+        with self.assertRaises(CommandError):
+            call_command('reconcileusage', verify=True, stdout=io.StringIO())
+
+        out = io.StringIO()
+        call_command('reconcileusage', stdout=out)
+        self.assertIn('1 users fixed', out.getvalue())
+        self.assertEqual(self.usage(), (10, 1))
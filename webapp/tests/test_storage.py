@@ -0,0 +1,283 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from unittest import mock
+
+from tests.test_views import TempMediaMixin, TestCaseRandomApp
+from utils.models import *
+from utils.purge import purge
+from utils.storage import ContentDigest, blob_name
+from utils.tree import FileNode
+
+
+def stored_files(media):
+    return sorted(
+        os.path.relpath(os.path.join(root, name), media)
+        for root, dirs, names in os.walk(os.path.join(media, 'users_files')) for name in names
+    )
+
+
+class BlobStorageTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = File.content.field.storage
+        self.user = User.objects.create_user(username='testuser', password='12345')
+
+    def upload(self, name, data):
+        return File.objects.create(name=name, owner=self.user, content=SimpleUploadedFile(name + '.txt', data))
+
+    def stored(self):
+        return stored_files(self.media)
+
+    def test_identical_uploads_share_a_blob(self):
+        first = self.upload('a', b'int main() {}\n')
+        second = self.upload('b', b'int main() {}\n')
+        other = self.upload('c', b'other')
+
+        digest = hashlib.sha256(b'int main() {}\n').hexdigest()
+        self.assertEqual(first.content.name, 'users_files/%s/%s/%s' % (digest[:2], digest[2:4], digest))
+        self.assertEqual(second.content.name, first.content.name)
+        self.assertNotEqual(other.content.name, first.content.name)
+        self.assertEqual(len(self.stored()), 2)
+        self.assertEqual(Blob.objects.get(digest=digest).refs, 2)
+        with second.content.open('rb') as content:
+            self.assertEqual(content.read(), b'int main() {}\n')
+
+    def test_row_copy_takes_a_reference(self):
+        file = self.upload('a', b'data')
+        File.objects.create(name='kopia', owner=self.user, content=file.content.name, size=file.size)
+
+        self.assertEqual(Blob.objects.get().refs, 2)
+
+    def test_purge_releases_references(self):
+        first = self.upload('a', b'data')
+        second = self.upload('b', b'data')
+        cutoff = timezone.now() + timedelta(days=1)
+
+        first.soft_delete()
+        self.assertEqual(purge(cutoff)['bytes'], 0)
+        self.assertEqual(Blob.objects.get().refs, 1)
+        self.assertTrue(self.storage.exists(second.content.name))
+
+        second.soft_delete()
+        self.assertEqual(purge(cutoff)['bytes'], 4)
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(self.stored(), [])
+
+        third = self.upload('c', b'data')
+        self.assertEqual(Blob.objects.get().refs, 1)
+        self.assertTrue(self.storage.exists(third.content.name))
+
+    def test_dedup_command(self):
+        os.makedirs(os.path.join(self.media, 'users_files'))
+        for name in ('test.txt', 'test_abc.txt', 'inny.txt', 'sierota.txt'):
+            with open(os.path.join(self.media, 'users_files', name), 'wb') as out:
+                out.write(b'inny' if name == 'inny.txt' else b'test')
+        for i, name in enumerate(('test.txt', 'test_abc.txt', 'inny.txt', 'test.txt')):
+            File.objects.create(name='plik%d' % i, owner=self.user, content='users_files/' + name, size=4)
+
+        version = TreeState.current(self.user.id)
+        out = io.StringIO()
+        call_command('dedupblobs', stdout=out)
+
+        digest = hashlib.sha256(b'test').hexdigest()
+        self.assertGreater(TreeState.current(self.user.id), version)
+        self.assertIn('files (inodes): 4 -> 3, saved 1', out.getvalue())
+        self.assertEqual(File.objects.filter(content=blob_name('users_files', digest)).count(), 3)
+        self.assertEqual(Blob.objects.get(digest=digest).refs, 3)
+        self.assertEqual(len(self.stored()), 3)
+
+        call_command('dedupblobs', delete_orphans=True, stdout=out)
+        self.assertEqual(len(self.stored()), 2)
+
+    def test_shard_command(self):
+        digest = hashlib.sha256(b'flat').hexdigest()
+        os.makedirs(os.path.join(self.media, 'users_files'))
+        with open(os.path.join(self.media, 'users_files', digest), 'wb') as out:
+            out.write(b'flat')
+        for i in range(3):
+            File.objects.create(name='plik%d' % i, owner=self.user, content='users_files/' + digest, size=4)
+        File.objects.create(name='zgubiony', owner=self.user, content='users_files/' + 'f' * 64, size=4)
+        flat_url = FileNode(0, 'plik.txt', 'users_files/' + digest).url
+        version = TreeState.current(self.user.id)
+
+        out = io.StringIO()
+        call_command('shardblobs', batch=1, sleep=0, stdout=out)
+
+        self.assertIn('moved 1 blobs in 2 batches, 1 missing', out.getvalue())
+        self.assertEqual(self.stored(), [blob_name('users_files', digest)])
+        self.assertEqual(File.objects.filter(content=blob_name('users_files', digest)).count(), 3)
+        with File.objects.first().content.open('rb') as content:
+            self.assertEqual(content.read(), b'flat')
+        # cached trees are invalidated; links from before still resolve
+        self.assertGreater(TreeState.current(self.user.id), version)
+        self.assertEqual(b''.join(self.client.get(flat_url).streaming_content), b'flat')
+
+
+class HashingUploadHandlerTests(TestCaseRandomApp):
+    data = b'#include <stdio.h>\nint main() {}\nreturn'
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+
+    def add_file(self, data):
+        return self.client.post(reverse("add_file"), data={
+            "file_name" : 'prog',
+            "file_desc" : '',
+            "file_file" : SimpleUploadedFile('prog.c', data),
+            "dest_for_file" : '-1',
+        })
+
+    def test_metadata_computed_while_streaming(self):
+        with mock.patch('utils.storage.hash_file', side_effect=AssertionError('re-read')):
+            self.assertEqual(self.add_file(self.data).status_code, 302)
+
+        file = File.objects.get()
+        self.assertEqual(file.sha256, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(file.size, len(self.data))
+        self.assertEqual(file.lines, 3)
+        self.assertEqual(stored_files(self.media), [file.content.name])
+
+    def test_over_limit(self):
+        with override_settings(UPLOAD_MAX_SIZE=10):
+            response = self.add_file(self.data)
+
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        self.assertEqual(self.messages(response), ["File larger than 10 bytes"])
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(stored_files(self.media), [])
+
+    def test_per_user_limit(self):
+        with override_settings(UPLOAD_MAX_SIZE=10, UPLOAD_MAX_SIZE_BY_USER={self.example_user: 100}):
+            self.assertEqual(self.add_file(self.data).status_code, 302)
+        with override_settings(UPLOAD_MAX_SIZE_BY_USER={self.example_user: 10}):
+            self.assertEqual(self.messages(self.add_file(self.data)), ["File larger than 10 bytes"])
+
+    def test_chunked_upload_limit(self):
+        with override_settings(UPLOAD_MAX_SIZE=10):
+            response = self.client.post(reverse('start_upload'), json.dumps({'name' : 'duzy', 'size' : 11}), content_type='application/json')
+
+        self.assertEqual(response.status_code, 413)
+
+    def test_line_count(self):
+        for pieces, lines in (([], 0), ([b'a'], 1), ([b'a\n'], 1), ([b'a\n', b'b'], 2), ([b'a', b'\n\n'], 2)):
+            digest = ContentDigest()
+            for piece in pieces:
+                digest.update(piece)
+            self.assertEqual(digest.lines, lines)
+
+
+class CompressionTests(TestCaseRandomApp):
+    text = b''.join(b'int line%d = %d;\n' % (i, i * i) for i in range(200))
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.get(username=self.example_user)
+
+    def upload(self, data, name='prog.c'):
+        return File.objects.create(name=name, owner=self.owner, content=SimpleUploadedFile(name, data))
+
+    def test_text_stored_gzipped(self):
+        file = self.upload(self.text)
+
+        self.assertTrue(file.content.name.endswith('.gz'))
+        self.assertEqual(Blob.objects.get().encoding, 'gzip')
+        self.assertLess(os.path.getsize(file.content.path), len(self.text) / 3)
+        self.assertEqual(file.content.size, len(self.text))
+        with file.content.open('rb') as content:
+            self.assertEqual(content.read(), self.text)
+
+    def test_binary_and_small_stored_raw(self):
+        binary = self.upload(b'\0\1\2' * 1000, 'a.out')
+        small = self.upload(b'int x;\n')
+
+        self.assertEqual(stored_files(self.media), sorted([binary.content.name, small.content.name]))
+        self.assertEqual(set(Blob.objects.values_list('encoding', flat=True)), {''})
+
+    def test_serves_gzip_as_stored(self):
+        url = self.upload(self.text).content.url
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        body = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertEqual(gzip.decompress(body), self.text)
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), self.text)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_gzip_has_its_own_etag(self):
+        url = self.upload(self.text).content.url
+        plain = self.client.get(url)['ETag']
+        gzipped = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')['ETag']
+
+        self.assertNotEqual(plain, gzipped)
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=plain).status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=gzipped).status_code, 200)
+
+    def test_gzip_refused_with_zero_quality(self):
+        url = self.upload(self.text).content.url
+
+        for header in ('gzip;q=0', 'gzip; q=0.0, deflate', '*;q=0', 'identity'):
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING=header)
+            self.assertFalse(response.has_header('Content-Encoding'), header)
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT_ENCODING='deflate, *;q=0.5')['Content-Encoding'], 'gzip')
+
+    def test_served_under_file_name(self):
+        file = self.upload(self.text)
+        url = FileNode(file.id, 'notatki.txt', file.content.name).url
+
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertEqual(response['Content-Disposition'], 'inline; filename="notatki.txt"')
+
+        response = self.client.get(FileNode(file.id, 'strona.html', file.content.name).url)
+        self.assertEqual(response['Content-Type'], 'text/html')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="strona.html"')
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+    def test_cold_blobs_to_xz(self):
+        file = self.upload(self.text)
+        url = file.content.url
+
+        call_command('compressblobs', xz_days=0, sleep=0, stdout=io.StringIO())
+
+        file.refresh_from_db()
+        self.assertTrue(file.content.name.endswith('.xz'))
+        self.assertEqual(Blob.objects.get().encoding, 'xz')
+        with file.content.open('rb') as content:
+            self.assertEqual(content.read(), self.text)
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(b''.join(response.streaming_content), self.text)
+
+        file.soft_delete()
+        purge(timezone.now() + timedelta(days=1))
+        self.assertEqual(stored_files(self.media), [])
+
+    def test_compress_existing_blobs(self):
+        with override_settings(BLOB_COMPRESS=False):
+            file = self.upload(self.text)
+
+        out = io.StringIO()
+        call_command('compressblobs', sleep=0, stdout=out)
+
+        self.assertIn('1 blobs compressed', out.getvalue())
+        file.refresh_from_db()
+        self.assertEqual(stored_files(self.media), [file.content.name])
+        self.assertTrue(file.content.name.endswith('.gz'))
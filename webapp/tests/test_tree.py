@@ -0,0 +1,108 @@
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from utils.models import Directory, File
+from utils.tree import build_tree, load_tree, stream_tree, walk
+
+
+class BuildTreeTests(SimpleTestCase):
+    def test_nesting(self):
+        root = build_tree(
+            [(1, None, 'a'), (2, 1, 'b'), (3, None, 'c')],
+            [(10, 2, 'f', 'users_files/f'), (11, None, 'g', 'users_files/g')]
+        )
+
+        self.assertEqual([dir.name for dir in root.subdirs], ['a', 'c'])
+        self.assertEqual([dir.name for dir in root.subdirs[0].subdirs], ['b'])
+        self.assertEqual([file.name for file in root.subdirs[0].subdirs[0].files], ['f'])
+        self.assertEqual([file.name for file in root.files], ['g'])
+
+    def test_orphans_are_dropped(self):
+        root = build_tree([(2, 1, 'b')], [(10, 2, 'f', 'users_files/f'), (11, 7, 'g', 'users_files/g')])
+
+        self.assertEqual(root.subdirs, [])
+        self.assertEqual(list(walk(root)), [])
+
+    def test_walk_order(self):
+        root = build_tree(
+            [(1, None, 'a'), (2, 1, 'b'), (3, None, 'c')],
+            [(10, 1, 'f', 'users_files/f'), (11, None, 'g', 'users_files/g')]
+        )
+
+        events = [(event, node.name) for event, node in walk(root)]
+
+        self.assertEqual(events, [
+            ('dir', 'a'), ('dir', 'b'), ('end', 'b'), ('file', 'f'), ('end', 'a'),
+            ('dir', 'c'), ('end', 'c'),
+            ('file', 'g'),
+        ])
+
+    def test_deep_tree(self):
+        depth = 20000
+        root = build_tree([(i, i - 1 if i > 1 else None, 'd%d' % i) for i in range(1, depth + 1)], [])
+
+        events = list(walk(root))
+
+        self.assertEqual(len(events), 2 * depth)
+        self.assertEqual(events[-1], ('end', root.subdirs[0]))
+
+    def test_file_url(self):
+        root = build_tree([], [(1, None, 'f', 'users_files/test.txt')])
+
+        self.assertEqual(root.files[0].url, '/users_files/users_files/test.txt')
+
+
+def shape(events):
+    # (kind, id, parent id) of every node, checking the dir/end events balance
+    nodes = set()
+    parents = [None]
+    for event, node in events:
+        if event == 'end':
+            assert parents.pop() == node.id
+        else:
+            nodes.add((event, node.id, parents[-1]))
+            if event == 'dir':
+                parents.append(node.id)
+    assert parents == [None]
+    return nodes
+
+
+class StreamTreeTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='testuser', password='12345')
+        parents = [None]
+        for layer in range(3):
+            parents = [
+                Directory.objects.create(name='d%d_%d' % (layer, i), owner=self.owner, parent_dir=parent)
+                for parent in parents for i in range(4)
+            ]
+            for dir in parents:
+                File.objects.create(name='f', owner=self.owner, parent_dir=dir, content='users_files/test.txt')
+        File.objects.create(name='g', owner=self.owner, content='users_files/test.txt')
+
+    @override_settings(TREE_EAGER_NODES=1000)
+    def test_same_tree_as_load_tree(self):
+        tree, more = load_tree(self.owner)
+
+        self.assertEqual(shape(stream_tree(self.owner, chunk_size=7)), shape(tree))
+
+    def test_files_before_subdirs(self):
+        events = [event for event, node in stream_tree(self.owner) if event != 'end']
+
+        self.assertEqual(events[:4], ['file', 'dir', 'file', 'dir'])
+
+    def test_deleted_subtree_is_skipped(self):
+        dir = Directory.objects.get(name='d0_0')
+        dir.soft_delete()
+        Directory.objects.filter(parent_dir=dir).update(availability_flag=True)
+
+        ids = {id for kind, id, parent in shape(stream_tree(self.owner))}
+
+        self.assertNotIn(dir.id, ids)
+        self.assertFalse(ids & set(dir.subdirs().values_list('id', flat=True)))
+
+    def test_generator_is_lazy(self):
+        with self.assertNumQueries(0):
+            events = stream_tree(self.owner)
+        with self.assertNumQueries(2):
+            next(events)
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+from datetime import timedelta
+
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from unittest import mock
+
+from tests.test_storage import stored_files
+from tests.test_views import TestCaseRandomApp
+from utils.aggregates import recompute_aggregates
+from utils.models import *
+from utils.purge import purge, purge_uploads
+
+
+@override_settings(UPLOAD_CHUNK_SIZE=8)
+class ChunkedUploadTests(TestCaseRandomApp):
+    data = b'0123456789abcdefghij-'
+    text = b'int main() {\n}'
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.get(username=self.example_user)
+        self.dir = Directory.objects.create(name='cel', owner=self.owner)
+
+    def start(self, **data):
+        data = dict({'name' : 'duzy', 'filename' : 'duzy.bin', 'size' : len(self.data), 'parent' : self.dir.id}, **data)
+        return self.client.post(reverse('start_upload'), json.dumps(data), content_type='application/json')
+
+    def put(self, id, offset, data=None):
+        if data is None:
+            data = self.data[offset:offset + 8]
+        return self.client.put(reverse('upload_chunk', args=[id, offset]), data, content_type='application/octet-stream')
+
+    def complete(self, id):
+        return self.client.post(reverse('complete_upload', args=[id]))
+
+    def test_not_logged_in(self):
+        self.assertEqual(self.start().status_code, 403)
+
+    def test_out_of_order_and_repeated_chunks(self):
+        self.login()
+        session = self.start().json()
+
+        self.assertEqual(session['missing'], [0, 8, 16])
+        for offset in (16, 0, 16):
+            self.assertEqual(self.put(session['id'], offset).status_code, 204)
+        status = self.client.get(reverse('upload', args=[session['id']])).json()
+        self.assertEqual(status['missing'], [8])
+        self.assertEqual(status['offset'], 8)
+
+        self.assertEqual(self.complete(session['id']).status_code, 409)
+        self.put(session['id'], 8)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.complete(session['id'])
+
+        self.assertEqual(response.status_code, 200)
+        file = File.objects.get(id=response.json()['file'])
+        self.assertEqual(file.parent_dir, self.dir)
+        self.assertEqual(file.size, len(self.data))
+        with file.content.open('rb') as content:
+            self.assertEqual(content.read(), self.data)
+        self.assertFalse(os.path.exists(UploadSession.objects.get().part_path))
+        self.assertEqual(Directory.objects.get(id=self.dir.id).total_bytes, len(self.data))
+
+    def test_complete_is_idempotent(self):
+        self.login()
+        id = self.start().json()['id']
+        for offset in (0, 8, 16):
+            self.put(id, offset)
+
+        first = self.complete(id).json()
+        second = self.complete(id).json()
+
+        self.assertEqual(first, second)
+        self.assertEqual(File.objects.count(), 1)
+        self.assertEqual(self.put(id, 0).status_code, 409)
+
+    def test_bad_chunks(self):
+        self.login()
+        id = self.start().json()['id']
+
+        self.assertEqual(self.put(id, 0, b'short').status_code, 400)
+        self.assertEqual(self.put(id, 0, b'far too long chunk').status_code, 400)
+        self.assertEqual(self.put(id, 16, b'tail').status_code, 400)
+        self.assertEqual(self.put(id, 4).status_code, 400)
+        self.assertEqual(self.put(id, 24).status_code, 400)
+        self.assertEqual(UploadSession.objects.get().missing(), [0, 1, 2])
+
+    def test_bad_start(self):
+        self.login()
+
+        self.assertEqual(self.start(size=-1).status_code, 400)
+        self.assertEqual(self.start(name='').status_code, 400)
+        self.assertEqual(self.start(parent=self.dir.id + 100).status_code, 404)
+
+    def test_empty_file(self):
+        self.login()
+        id = self.start(size=0).json()['id']
+
+        self.assertEqual(self.put(id, 0, b'').status_code, 204)
+        self.assertEqual(File.objects.get(id=self.complete(id).json()['file']).size, 0)
+
+    def test_other_user(self):
+        self.login()
+        id = self.start().json()['id']
+        self.logout()
+        self.login2()
+
+        self.assertEqual(self.put(id, 0).status_code, 404)
+        self.assertEqual(self.complete(id).status_code, 404)
+        self.assertEqual(self.client.get(reverse('upload', args=[id])).status_code, 404)
+
+    def test_content_metadata(self):
+        self.login()
+        id = self.start(size=len(self.text)).json()['id']
+        for offset in range(0, len(self.text), 8):
+            self.put(id, offset, self.text[offset:offset + 8])
+
+        file = File.objects.get(id=self.complete(id).json()['file'])
+
+        self.assertEqual((file.size, file.sha256, file.lines), (len(self.text), hashlib.sha256(self.text).hexdigest(), 2))
+
+    def test_blob_released_by_purge(self):
+        self.login()
+        id = self.start().json()['id']
+        for offset in (0, 8, 16):
+            self.put(id, offset)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.complete(id)
+
+        self.assertEqual(Blob.objects.get().refs, 1)
+        File.objects.get().soft_delete()
+        purge(timezone.now() + timedelta(days=1))
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(stored_files(self.media), [])
+
+    def test_directory_deleted_before_completion(self):
+        self.login()
+        id = self.start().json()['id']
+        for offset in (0, 8, 16):
+            self.put(id, offset)
+        self.dir.soft_delete()
+
+        response = self.complete(id)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(recompute_aggregates(fix=False), [])
+
+    def test_failed_completion_keeps_the_part(self):
+        self.login()
+        id = self.start().json()['id']
+        for offset in (0, 8, 16):
+            self.put(id, offset)
+
+        with mock.patch('utils.uploads.enqueue', side_effect=RuntimeError('queue down')):
+            with self.assertRaises(RuntimeError):
+                self.complete(id)
+
+        self.assertTrue(os.path.exists(UploadSession.objects.get().part_path))
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(stored_files(self.media), [])
+        self.assertEqual(self.complete(id).status_code, 200)
+
+    def test_discard(self):
+        self.login()
+        id = self.start().json()['id']
+        part_path = UploadSession.objects.get().part_path
+
+        self.assertEqual(self.client.delete(reverse('upload', args=[id])).status_code, 204)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(part_path))
+
+    def test_purge_stale_sessions(self):
+        self.login()
+        self.start()
+        fresh = self.start().json()['id']
+        UploadSession.objects.exclude(id=fresh).update(created=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(purge_uploads(timezone.now() - timedelta(days=1)), 1)
+        self.assertEqual(list(UploadSession.objects.values_list('id', flat=True)), [fresh])
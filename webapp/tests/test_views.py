@@ -1,14 +1,32 @@
 from django.test.client import Client
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.utils.crypto import get_random_string
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.contrib.messages import get_messages
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+import os
 import random
+import shutil
+import tempfile
 import mock
 
 from utils.models import *
 
-class TestCaseRandomApp(TestCase):
+class TempMediaMixin:
+    # Uploads and upload sessions go to a fresh directory, removed after the test.
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.media = os.path.join(self.tmp, 'media')
+        media_settings = override_settings(MEDIA_ROOT=self.media, UPLOAD_SESSION_DIR=os.path.join(self.tmp, 'sessions'))
+        media_settings.enable()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.addCleanup(media_settings.disable)
+
+class TestCaseRandomApp(TempMediaMixin, TestCase):
     url = reverse("index")
     client: Client = None
 
@@ -32,7 +50,11 @@ class TestCaseRandomApp(TestCase):
     def logout(self):
         self.client.logout()
 
+    def messages(self, response):
+        return [str(message) for message in get_messages(response.wsgi_request)]
+
     def setUp(self):
+        super().setUp()
         self.example_user = 'User'
         self.example_user_password = 'haslo123testowe'
 
@@ -52,6 +74,7 @@ class TestCaseRandomApp(TestCase):
         user2.save()
 
         self.client = Client()
+        cache.clear()
 
 class IndexTests(TestCaseRandomApp):
     def test_accessible(self):
@@ -166,6 +189,20 @@ class FilesViewsTests(TestCaseRandomApp):
 
         self.assertNotContains(response, name)
 
+    def test_add_file_into_foreign_dir(self):
+        other = Directory.objects.create(name='cudzy', owner=User.objects.get(username=self.example_user_2))
+
+        self.login()
+        self.client.post(reverse("add_file"), data={
+            "file_name" : 'plik',
+            "file_desc" : '',
+            "dest_for_file": other.id,
+            "file_file": SimpleUploadedFile("a.c", b'int a;')
+        })
+
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(Directory.objects.get(id=other.id).total_files, 0)
+
 class DirectoryViewTests(TestCaseRandomApp):
     def test_dir_views(self):
         name = 'katalog'
@@ -294,7 +331,7 @@ class DeleteViewTest(TestCaseRandomApp):
         self.assertContains(response, name)
 
         response = self.client.post(reverse("delete"), data={
-            "to_delete": 1
+            "to_delete": 'd:%d' % dir.id
         }, follow=True)
 
         self.assertNotContains(response, name)
@@ -316,7 +353,7 @@ class DeleteViewTest(TestCaseRandomApp):
         self.assertContains(response, name)
 
         response = self.client.get(reverse("delete"), data={
-            "to_delete": 1
+            "to_delete": 'd:%d' % dir.id
         }, follow=True)
 
         self.assertContains(response, name)
@@ -342,7 +379,7 @@ class DeleteViewTest(TestCaseRandomApp):
         self.assertContains(response, name)
 
         response = self.client.post(reverse("delete"), data={
-            "to_delete": 1
+            "to_delete": 'f:%d' % file.id
         }, follow=True)
 
         self.assertNotContains(response, name)
@@ -368,7 +405,7 @@ class DeleteViewTest(TestCaseRandomApp):
         self.assertContains(response, name)
 
         response = self.client.get(reverse("delete"), data={
-            "to_delete": 1
+            "to_delete": 'f:%d' % file.id
         }, follow=True)
 
         self.assertContains(response, name)
@@ -399,4 +436,243 @@ class NoAccessToOtherUsersFilesTest(TestCaseRandomApp):
         response = self.client.get(self.url)
 
         self.assertContains(response, name)
-        self.assertNotContains(response, name2)
\ No newline at end of file
+        self.assertNotContains(response, name2)
+
+class IndexQueryCountTests(TestCaseRandomApp):
+    def create_tree(self, owner, depth, width):
+        parents = [None]
+        for layer in range(depth):
+            children = []
+            for parent in parents:
+                for i in range(width):
+                    dir = Directory.objects.create(
+                        name = 'folder%d_%d' % (layer, i),
+                        owner = owner,
+                        parent_dir = parent
+                    )
+                    File.objects.create(
+                        name = 'plik%d_%d' % (layer, i),
+                        owner = owner,
+                        parent_dir = dir,
+                        content = 'users_files/test.txt'
+                    )
+                    children.append(dir)
+            parents = children
+
+    def count_index_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_queries_do_not_grow_with_tree(self):
+        owner = User.objects.get(username=self.example_user)
+        self.login()
+
+        self.create_tree(owner, 1, 1)
+        small = self.count_index_queries()
+
+        self.create_tree(owner, 3, 3)
+        large = self.count_index_queries()
+
+        self.assertEqual(small, large)
+
+    def test_other_users_nodes_are_not_loaded(self):
+        other = User.objects.get(username=self.example_user_2)
+        self.create_tree(other, 2, 2)
+
+        self.login()
+        response = self.client.get(self.url)
+
+        self.assertNotContains(response, 'folder0_0')
+        self.assertNotContains(response, 'plik0_0')
+
+    def test_deleted_nodes_are_not_loaded(self):
+        owner = User.objects.get(username=self.example_user)
+        self.create_tree(owner, 2, 1)
+        Directory.objects.filter(parent_dir=None).update(availability_flag=False)
+
+        self.login()
+        response = self.client.get(self.url)
+
+        self.assertNotContains(response, 'folder0_0')
+        self.assertNotContains(response, 'folder1_0')
+
+
+class StreamingIndexTests(TestCaseRandomApp):
+    create_tree = IndexQueryCountTests.create_tree
+
+    def stream(self):
+        response = self.client.get(self.url, {'stream' : 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_page_around_tree(self):
+        owner = User.objects.get(username=self.example_user)
+        self.create_tree(owner, 2, 2)
+        self.login()
+
+        page = self.stream()
+
+        self.assertIn('<!DOCTYPE html>', page[:100])
+        self.assertTrue(page.rstrip().endswith('</html>'))
+        self.assertIn('folder1_1', page)
+        self.assertIn('plik1_1', page)
+        self.assertEqual(page.count('<ul>'), page.count('</ul>'))
+        self.assertIn('csrfmiddlewaretoken', page)
+
+    def count_stream_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.stream()
+        return len(queries)
+
+    @override_settings(TREE_STREAM_CHUNK=3)
+    def test_queries_do_not_grow_with_tree(self):
+        owner = User.objects.get(username=self.example_user)
+        self.login()
+
+        self.create_tree(owner, 1, 1)
+        small = self.count_stream_queries()
+
+        self.create_tree(owner, 3, 3)
+        large = self.count_stream_queries()
+
+        self.assertEqual(small, large)
+
+    def test_not_logged_in(self):
+        response = self.client.get(self.url, {'stream' : 1})
+
+        self.assertFalse(response.streaming)
+
+
+class VirtualTreeTests(TestCaseRandomApp):
+    def test_model_in_page(self):
+        owner = User.objects.get(username=self.example_user)
+        dir = Directory.objects.create(name='katalog', owner=owner)
+        file = File.objects.create(name='plik', owner=owner, parent_dir=dir, content='users_files/test.txt')
+        self.login()
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.context['tree_model']['directories'], [[dir.id, None, 'katalog', False]])
+        self.assertEqual(response.context['tree_model']['files'], [[file.id, dir.id, 'plik', '/users_files/users_files/test.txt']])
+        self.assertContains(response, '<script id="tree-model" type="application/json">')
+        self.assertContains(response, 'class="tree-viewport"')
+        self.assertContains(response, '<noscript><a href="?nojs=1">')
+        self.assertNotContains(response, 'id="d%d"' % dir.id)
+
+    def test_tree_html_without_scripts(self):
+        owner = User.objects.get(username=self.example_user)
+        Directory.objects.create(name='katalog', owner=owner)
+        self.login()
+
+        response = self.client.get(self.url, {'nojs' : 1})
+
+        self.assertNotContains(response, 'tree-model')
+        self.assertNotContains(response, '<noscript>')
+        self.assertContains(response, 'katalog/</span>')
+
+    def test_names_are_escaped(self):
+        owner = User.objects.get(username=self.example_user)
+        Directory.objects.create(name='</script><b>', owner=owner)
+        self.login()
+
+        response = self.client.get(self.url)
+
+        self.assertNotContains(response, '</script><b>')
+
+    def test_stream_has_no_model(self):
+        self.login()
+
+        page = b''.join(self.client.get(self.url, {'stream' : 1}).streaming_content).decode()
+
+        self.assertNotIn('tree-model', page)
+        self.assertNotIn('<noscript>', page)
+
+
+class SubtreeDeleteTests(TestCaseRandomApp):
+    def create_subtree(self, parent, owner, depth, width):
+        for i in range(width):
+            dir = Directory.objects.create(name='sub%d' % i, owner=owner, parent_dir=parent)
+            File.objects.create(name='plik%d' % i, owner=owner, parent_dir=dir, content='users_files/test.txt')
+            if depth > 1:
+                self.create_subtree(dir, owner, depth - 1, width)
+
+    def delete(self, node):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse("delete"), data={"to_delete": 'd:%d' % node.id})
+        self.assertEqual(response.status_code, 302)
+        return len(queries)
+
+    def test_whole_subtree_is_deleted(self):
+        owner = User.objects.get(username=self.example_user)
+        root = Directory.objects.create(name='korzen', owner=owner)
+        self.create_subtree(root, owner, 3, 2)
+        kept = Directory.objects.create(name='zostaje', owner=owner)
+
+        self.login()
+        self.client.post(reverse("delete"), data={"to_delete": 'd:%d' % root.id})
+
+        self.assertFalse(Directory.objects.filter(availability_flag=True).exclude(id=kept.id).exists())
+        self.assertFalse(File.objects.filter(availability_flag=True).exists())
+        self.assertTrue(Directory.objects.get(id=kept.id).availability_flag)
+
+    def test_reports_affected_nodes(self):
+        owner = User.objects.get(username=self.example_user)
+        root = Directory.objects.create(name='korzen', owner=owner)
+        self.create_subtree(root, owner, 2, 2)
+
+        self.login()
+        response = self.client.post(reverse("delete"), data={"to_delete": 'd:%d' % root.id}, follow=True)
+
+        self.assertContains(response, 'Deleted 13 items')
+
+    def test_queries_do_not_grow_with_subtree(self):
+        owner = User.objects.get(username=self.example_user)
+        small = Directory.objects.create(name='maly', owner=owner)
+        large = Directory.objects.create(name='duzy', owner=owner)
+        self.create_subtree(large, owner, 3, 3)
+
+        self.login()
+
+        self.assertEqual(self.delete(small), self.delete(large))
+
+    def test_other_users_node(self):
+        dir = Directory.objects.create(name='cudzy', owner=User.objects.get(username=self.example_user_2))
+
+        self.login()
+        self.client.post(reverse("delete"), data={"to_delete": 'd:%d' % dir.id})
+
+        self.assertTrue(Directory.objects.get(id=dir.id).availability_flag)
+
+
+class DeleteKindTests(TestCaseRandomApp):
+    def test_kind_prefix_picks_the_model(self):
+        owner = User.objects.get(username=self.example_user)
+        dir = Directory.objects.create(name='katalog', owner=owner)
+        file = File.objects.create(name='plik', owner=owner, content='users_files/test.txt')
+
+        self.login()
+        self.client.post(reverse("delete"), data={"to_delete": 'f:%d' % file.id})
+
+        self.assertFalse(File.objects.get(id=file.id).availability_flag)
+        self.assertTrue(Directory.objects.get(id=dir.id).availability_flag)
+
+    def test_garbage(self):
+        self.login()
+        response = self.client.post(reverse("delete"), data={"to_delete": 'x:abc'})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_bare_id_refused(self):
+        owner = User.objects.get(username=self.example_user)
+        dir = Directory.objects.create(name='katalog', owner=owner)
+        file = File.objects.create(name='plik', owner=owner, content='users_files/test.txt')
+
+        self.login()
+        response = self.client.post(reverse("delete"), data={"to_delete": file.id})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(Directory.objects.get(id=dir.id).availability_flag)
+        self.assertTrue(File.objects.get(id=file.id).availability_flag)
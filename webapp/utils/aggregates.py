@@ -0,0 +1,49 @@
+from collections import defaultdict
+
+from .models import Directory, File
+
+
+def compute_aggregates(directory_model=Directory, file_model=File):
+    # {dir id: {aggregate: value}} for every live directory, from scratch. Takes
+    # the models so migrations can pass their historical versions.
+    aggregates = defaultdict(lambda: dict.fromkeys(Directory.AGGREGATES, 0))
+    dirs = list(directory_model.objects.filter(availability_flag=True).values_list('id', 'parent_dir_id', 'path'))
+
+    for parent_id, size in file_model.objects.filter(availability_flag=True).values_list('parent_dir_id', 'size').iterator():
+        if parent_id is not None:
+            row = aggregates[parent_id]
+            row['direct_files'] += 1
+            row['total_files'] += 1
+            row['total_bytes'] += size
+
+    # deepest first, so every directory is complete before it is added to its parent
+    dirs.sort(key=lambda dir: dir[2].count('/'), reverse=True)
+    for id, parent_id, path in dirs:
+        row = aggregates[id]
+        if parent_id is not None:
+            parent = aggregates[parent_id]
+            parent['direct_dirs'] += 1
+            parent['total_dirs'] += row['total_dirs'] + 1
+            parent['total_files'] += row['total_files']
+            parent['total_bytes'] += row['total_bytes']
+
+    return {id: aggregates[id] for id, parent_id, path in dirs}
+
+
+def recompute_aggregates(fix=True, directory_model=Directory, file_model=File):
+    # Compares the stored aggregates of live directories with computed ones and
+    # returns the ids that differed, rewriting them unless fix is False.
+    expected = compute_aggregates(directory_model, file_model)
+    stale = []
+
+    fields = ('id',) + Directory.AGGREGATES
+    for row in directory_model.objects.filter(id__in=list(expected)).values_list(*fields).iterator():
+        if dict(zip(Directory.AGGREGATES, row[1:])) != expected[row[0]]:
+            stale.append(row[0])
+
+    if fix:
+        directory_model.objects.bulk_update([
+            directory_model(id=id, **expected[id]) for id in stale
+        ], Directory.AGGREGATES, batch_size=500)
+
+    return stale
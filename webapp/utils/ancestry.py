@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.db.models.expressions import RawSQL
+
+from .models import Directory, DirectoryClosure, File
+
+
+# Recursive CTEs over parent_dir, used when the closure table is disabled.
+# Both select directory ids only, so they can be embedded as an IN subquery.
+
+def descendants_cte(dir_id):
+    table = Directory._meta.db_table
+    pk = Directory._meta.pk.column
+    return RawSQL(
+        'WITH RECURSIVE sub(id) AS ('
+        'SELECT %s UNION ALL '
+        'SELECT d.{pk} FROM {table} d JOIN sub ON d.parent_dir_id = sub.id'
+        ') SELECT id FROM sub'.format(table=table, pk=pk),
+        (dir_id,)
+    )
+
+def ancestors_cte(dir_id):
+    table = Directory._meta.db_table
+    pk = Directory._meta.pk.column
+    return RawSQL(
+        'WITH RECURSIVE anc(id, parent_id) AS ('
+        'SELECT {pk}, parent_dir_id FROM {table} WHERE {pk} = %s UNION ALL '
+        'SELECT d.{pk}, d.parent_dir_id FROM {table} d JOIN anc ON d.{pk} = anc.parent_id'
+        ') SELECT id FROM anc'.format(table=table, pk=pk),
+        (dir_id,)
+    )
+
+def subtree_ids(dir):
+    # Ids of dir and every directory below it, as a subquery.
+    if settings.TREE_CLOSURE_TABLE:
+        return DirectoryClosure.objects.filter(ancestor_id=dir.id).values('descendant_id')
+    return descendants_cte(dir.id)
+
+def descendant_dirs(dir):
+    return Directory.objects.filter(id__in=subtree_ids(dir)).exclude(id=dir.id)
+
+def descendant_files(dir):
+    return File.objects.filter(parent_dir_id__in=subtree_ids(dir))
+
+def ancestor_dirs(node):
+    # Directories above a Directory or File, outermost first.
+    if isinstance(node, File):
+        if node.parent_dir_id is None:
+            return Directory.objects.none()
+        start, skip = node.parent_dir_id, None
+    else:
+        start, skip = node.id, node.id
+
+    if settings.TREE_CLOSURE_TABLE:
+        return Directory.objects.filter(
+            id__in=DirectoryClosure.objects.filter(descendant_id=start).values('ancestor_id')
+        ).exclude(id=skip).order_by('path')
+    return Directory.objects.filter(id__in=ancestors_cte(start)).exclude(id=skip).order_by('path')
+
+def is_under(node, dir):
+    # Whether a Directory or File lies strictly below dir.
+    if isinstance(node, File):
+        if node.parent_dir_id is None:
+            return False
+        if node.parent_dir_id == dir.id:
+            return True
+        node_id = node.parent_dir_id
+    elif node.id == dir.id:
+        return False
+    else:
+        node_id = node.id
+
+    if settings.TREE_CLOSURE_TABLE:
+        return DirectoryClosure.objects.filter(ancestor_id=dir.id, descendant_id=node_id).exists()
+    return Directory.objects.filter(id=dir.id).filter(id__in=ancestors_cte(node_id)).exists()
+
+def rebuild_closure():
+    # Recreate the closure table from parent_dir, e.g. after enabling it.
+    parents = dict(Directory.objects.values_list('id', 'parent_dir_id'))
+    DirectoryClosure.objects.all().delete()
+
+    rows = []
+    for id in parents:
+        ancestor_id, depth = id, 0
+        while ancestor_id is not None:
+            rows.append(DirectoryClosure(ancestor_id=ancestor_id, descendant_id=id, depth=depth))
+            ancestor_id, depth = parents.get(ancestor_id), depth + 1
+        if len(rows) >= 5000:
+            DirectoryClosure.objects.bulk_create(rows)
+            rows = []
+    DirectoryClosure.objects.bulk_create(rows)
@@ -0,0 +1,227 @@
+import os
+import tarfile
+import tempfile
+import uuid
+import zipfile
+import zlib
+
+from django.conf import settings
+from django.db.models import F
+
+from .models import Directory, DirectoryClosure, File, QuotaExceeded, StorageUsage, TreeChange, subtree_filter
+from .storage import ContentDigest, blob_name
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar.gz', '.tgz')
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def archive_stem(filename):
+    # The name without its archive suffix, or None if it is not an archive.
+    for suffix in ARCHIVE_SUFFIXES:
+        if filename.lower().endswith(suffix) and len(filename) > len(suffix):
+            return filename[:-len(suffix)]
+    return None
+
+
+def clean_parts(name):
+    # Path components of an archive member, or None for ones that would
+    # leave the extracted directory.
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or '..' in parts:
+        return None
+    return tuple(part[:50] for part in parts)
+
+
+def members(upload):
+    # (parts, stream) for the regular files of a zip or tar.gz upload and
+    # (parts, None) for its directories, in archive order. Tar archives are
+    # read as a stream; zip needs the central directory at the end, which is
+    # fine as uploads are on disk.
+    upload.seek(0)
+    if upload.name.lower().endswith('.zip'):
+        with zipfile.ZipFile(upload) as archive:
+            for info in archive.infolist():
+                parts = clean_parts(info.filename)
+                if parts is None:
+                    continue
+                if info.is_dir():
+                    yield parts, None
+                else:
+                    with archive.open(info) as stream:
+                        yield parts, stream
+    else:
+        with tarfile.open(fileobj=upload, mode='r|gz') as archive:
+            for member in archive:
+                parts = clean_parts(member.name)
+                if parts is None or not (member.isfile() or member.isdir()):
+                    continue
+                yield parts, archive.extractfile(member) if member.isfile() else None
+
+
+class Extraction:
+    # One archive unpacked below a new directory. extract() hashes the members
+    # into temporary files as they stream in and needs no transaction, so a
+    # large archive does not hold the database; create() then stores their
+    # blobs and inserts the whole subtree in bulk, in the transaction that
+    # creates the directory. discard() drops what was not created.
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.storage = File.content.field.storage
+        self.prefix = os.path.dirname(File.content.field.upload_to)
+        # parts below top -> its aggregates, () being top itself
+        self.dirs = {(): dict.fromkeys(Directory.AGGREGATES, 0)}
+        self.files = []
+        # of the created files, once create() ran
+        self.file_ids = []
+        self.entries = 0
+        self.bytes = 0
+        # bytes the owner has left, to stop early; create() charges for real
+        self.room = StorageUsage.room(owner)[0]
+
+    def extract(self, upload):
+        try:
+            for parts, stream in members(upload):
+                self.entries += 1
+                if self.entries > settings.ARCHIVE_MAX_ENTRIES:
+                    raise ArchiveError("Archive has more than %d entries" % settings.ARCHIVE_MAX_ENTRIES)
+                if stream is None:
+                    self.add_dir(parts)
+                else:
+                    self.add_file(parts, stream)
+        except (zipfile.BadZipFile, zipfile.LargeZipFile, tarfile.TarError, zlib.error, EOFError, NotImplementedError):
+            self.discard()
+            raise ArchiveError("Not a valid archive")
+        except BaseException:
+            self.discard()
+            raise
+
+    def discard(self):
+        # create() moved or removed the ones it got to
+        for parts, file, temp in self.files:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def add_dir(self, parts):
+        if parts not in self.dirs:
+            self.add_dir(parts[:-1])
+            self.dirs[parts] = dict.fromkeys(Directory.AGGREGATES, 0)
+            self.dirs[parts[:-1]]['direct_dirs'] += 1
+            for depth in range(len(parts)):
+                self.dirs[parts[:depth]]['total_dirs'] += 1
+
+    def add_file(self, parts, stream):
+        temp, digest = self.receive(stream)
+        self.add_dir(parts[:-1])
+        self.dirs[parts[:-1]]['direct_files'] += 1
+        for depth in range(len(parts)):
+            self.dirs[parts[:depth]]['total_files'] += 1
+            self.dirs[parts[:depth]]['total_bytes'] += digest.size
+        self.files.append((parts, File(
+            name=parts[-1], owner_id=self.owner.id,
+            size=digest.size, sha256=digest.hexdigest(), lines=digest.lines,
+        ), temp))
+
+    def receive(self, stream):
+        # Writes one member to a temporary file next to the blobs, hashing it
+        # on the way; all of them are stored together by create(). The
+        # expanded size is counted as the bytes come, not taken from the
+        # headers, so a zip bomb stops at the limit.
+        directory = self.storage.path(self.prefix)
+        os.makedirs(directory, exist_ok=True)
+        digest = ContentDigest()
+        fd, temp = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for piece in iter(lambda: stream.read(64 * 1024), b''):
+                    self.bytes += len(piece)
+                    if self.bytes > settings.ARCHIVE_MAX_SIZE:
+                        raise ArchiveError("Archive expands to more than %d bytes" % settings.ARCHIVE_MAX_SIZE)
+                    if self.room is not None and self.bytes > self.room:
+                        raise QuotaExceeded("Storage quota exceeded")
+                    digest.update(piece)
+                    out.write(piece)
+        except BaseException:
+            os.remove(temp)
+            raise
+        return temp, digest
+
+    def create(self, top):
+        # Inserts the directories below top level by level, as bulk_create
+        # does not hand back ids here: each level goes in under placeholder
+        # paths, which are then read back for the ids and replaced by the real
+        # paths. The quota is taken before any blob is stored.
+        self.top = top
+        owner_id = self.owner.id
+        StorageUsage.charge(self.owner, self.dirs[()]['total_bytes'], len(self.files))
+        token = '?%s/' % uuid.uuid4().hex
+        nodes = {(): self.top}
+        levels = {}
+        for parts in self.dirs:
+            if parts:
+                levels.setdefault(len(parts), []).append(parts)
+
+        for depth in sorted(levels):
+            level = [Directory(
+                name=parts[-1], owner_id=owner_id, parent_dir_id=nodes[parts[:-1]].id,
+                path='%s%d' % (token, index), **self.dirs[parts]
+            ) for index, parts in enumerate(levels[depth])]
+            Directory.objects.bulk_create(level, batch_size=500)
+
+            ids = dict(Directory.objects.filter(owner_id=owner_id, path__startswith=token).values_list('path', 'id'))
+            for parts, dir in zip(levels[depth], level):
+                dir.id = ids[dir.path]
+                dir.path = '%s%d/' % (nodes[parts[:-1]].path, dir.id)
+                nodes[parts] = dir
+            Directory.objects.bulk_update(level, ['path'], batch_size=500)
+
+        names = self.storage.store_many([
+            (blob_name(self.prefix, file.sha256), temp, file.sha256, file.size) for parts, file, temp in self.files
+        ])
+        for (parts, file, temp), name in zip(self.files, names):
+            parent = nodes[parts[:-1]]
+            file.parent_dir_id, file.path, file.content = parent.id, parent.path, name
+        File.objects.bulk_create([file for parts, file, temp in self.files], batch_size=500)
+
+        totals = self.dirs[()]
+        Directory.objects.filter(id=self.top.id).update(**totals)
+        Directory.objects.filter(id__in=self.top.path.split('/')[1:-2]).update(
+            total_dirs=F('total_dirs') + totals['total_dirs'],
+            total_files=F('total_files') + totals['total_files'],
+            total_bytes=F('total_bytes') + totals['total_bytes'],
+        )
+
+        new_dirs = [dir for parts, dir in sorted(nodes.items(), key=lambda item: len(item[0])) if parts]
+        if settings.TREE_CLOSURE_TABLE:
+            self.link(new_dirs)
+
+        file_rows = list(File.objects.filter(subtree_filter(self.top.path), owner_id=owner_id).values_list('id', 'parent_dir_id', 'name').order_by('id'))
+        self.file_ids = [id for id, parent_id, name in file_rows]
+        TreeChange.objects.bulk_create([
+            TreeChange(owner_id=owner_id, op='create', kind='d', node_id=dir.id, parent_id=dir.parent_dir_id, name=dir.name)
+            for dir in new_dirs
+        ] + [
+            TreeChange(owner_id=owner_id, op='create', kind='f', node_id=id, parent_id=parent_id, name=name)
+            for id, parent_id, name in file_rows
+        ], batch_size=500)
+
+        return len(new_dirs), len(self.files)
+
+    def link(self, new_dirs):
+        # Closure rows for the new directories: their ancestors are top's and
+        # the ones on their own path below it.
+        above = DirectoryClosure.ancestor_rows(self.top.id)
+        rows = []
+        for dir in new_dirs:
+            chain = [int(id) for id in dir.path[len(self.top.path):].split('/')[:-1]]
+            for depth, ancestor_id in enumerate(reversed(chain)):
+                rows.append(DirectoryClosure(ancestor_id=ancestor_id, descendant_id=dir.id, depth=depth))
+            rows.extend(
+                DirectoryClosure(ancestor_id=ancestor_id, descendant_id=dir.id, depth=depth + len(chain))
+                for ancestor_id, depth in above
+            )
+        DirectoryClosure.objects.bulk_create(rows, batch_size=500)
+
@@ -0,0 +1,95 @@
+from django.core.exceptions import ValidationError
+
+from .models import Directory, File
+
+
+class BatchError(Exception):
+    def __init__(self, index, message):
+        super().__init__(message)
+        self.index = index
+        self.message = message
+
+
+def resolve(value, refs, index):
+    # An id, None for root, or the ref of an earlier mkdir in the same batch.
+    if value is None or (isinstance(value, int) and not isinstance(value, bool)):
+        return value
+    if isinstance(value, str) and value in refs:
+        return refs[value]
+    raise BatchError(index, "Bad id %r" % (value,))
+
+
+def live_node(owner, kind, id, index):
+    model = {'d': Directory, 'f': File}.get(kind)
+    if model is None:
+        raise BatchError(index, "Bad kind")
+    node = model.objects.live().filter(id=id, owner=owner).first()
+    if node is None:
+        raise BatchError(index, "No such node")
+    return node
+
+
+def live_parent(owner, id, index):
+    if id is None:
+        return None
+    return live_node(owner, 'd', id, index)
+
+
+def checked_name(op, index):
+    name = op.get('name')
+    if not isinstance(name, str) or not 0 < len(name) <= 50:
+        raise BatchError(index, "Bad name")
+    return name
+
+
+def save(node, index, **kwargs):
+    try:
+        node.save(**kwargs)
+    except ValidationError as error:
+        raise BatchError(index, error.message_dict['error'][0])
+
+
+def apply_ops(owner, ops):
+    # Applies mkdir/delete/rename/move operations in order and returns one
+    # result per operation. Raises BatchError on the first bad one; run it in
+    # a transaction so nothing before it sticks.
+    refs = {}
+    results = []
+
+    for index, op in enumerate(ops):
+        if not isinstance(op, dict):
+            raise BatchError(index, "Bad operation")
+        kind = op.get('kind', 'd')
+
+        if op.get('op') == 'mkdir':
+            dir = Directory(
+                name=checked_name(op, index),
+                description=str(op.get('description', ''))[:255],
+                owner=owner,
+                parent_dir=live_parent(owner, resolve(op.get('parent'), refs, index), index),
+            )
+            save(dir, index)
+            if isinstance(op.get('ref'), str):
+                refs[op['ref']] = dir.id
+            results.append({'ok' : True, 'id' : dir.id})
+
+        elif op.get('op') == 'delete':
+            node = live_node(owner, kind, resolve(op.get('id'), refs, index), index)
+            results.append({'ok' : True, 'id' : node.id, 'count' : node.soft_delete()})
+
+        elif op.get('op') == 'rename':
+            node = live_node(owner, kind, resolve(op.get('id'), refs, index), index)
+            node.name = checked_name(op, index)
+            save(node, index, update_fields=['name'])
+            results.append({'ok' : True, 'id' : node.id})
+
+        elif op.get('op') == 'move':
+            node = live_node(owner, kind, resolve(op.get('id'), refs, index), index)
+            node.parent_dir = live_parent(owner, resolve(op.get('parent'), refs, index), index)
+            save(node, index)
+            results.append({'ok' : True, 'id' : node.id})
+
+        else:
+            raise BatchError(index, "Unknown operation")
+
+    return results
@@ -0,0 +1,87 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from utils.ancestry import ancestor_dirs, descendant_dirs, descendant_files, is_under
+from utils.models import Directory, DirectoryClosure, File
+
+
+def build_deep(owner, depth):
+    dir = None
+    for i in range(depth):
+        dir = Directory.objects.create(name='deep%d' % i, owner=owner, parent_dir=dir)
+        File.objects.create(name='file%d' % i, owner=owner, parent_dir=dir, content='users_files/test.txt')
+    return dir
+
+def build_wide(owner, width, fanout):
+    root = Directory.objects.create(name='wide', owner=owner)
+    for i in range(width):
+        top = Directory.objects.create(name='wide%d' % i, owner=owner, parent_dir=root)
+        for j in range(fanout):
+            dir = Directory.objects.create(name='leaf%d_%d' % (i, j), owner=owner, parent_dir=top)
+            File.objects.create(name='file%d_%d' % (i, j), owner=owner, parent_dir=dir, content='users_files/test.txt')
+    return dir
+
+def ids(queryset):
+    return len(queryset.values_list('id', flat=True))
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+class Command(BaseCommand):
+    help = 'Compare closure-table and recursive-CTE ancestry queries on deep and wide trees (in a throwaway test database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depth', type=int, default=500)
+        parser.add_argument('--width', type=int, default=50)
+        parser.add_argument('--fanout', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, options):
+        owner = User.objects.create(username='bench')
+        shapes = [
+            ('deep %d' % options['depth'], lambda: build_deep(owner, options['depth'])),
+            ('wide %dx%d' % (options['width'], options['fanout']), lambda: build_wide(owner, options['width'], options['fanout'])),
+        ]
+
+        for shape, build in shapes:
+            with override_settings(TREE_CLOSURE_TABLE=True), transaction.atomic():
+                start = time.perf_counter()
+                leaf = build()
+                build_time = time.perf_counter() - start
+            root = leaf.ancestors().first() or leaf
+            self.stdout.write('%s: %d dirs, %d closure rows, built in %.2f s' % (
+                shape, Directory.objects.count(), DirectoryClosure.objects.count(), build_time
+            ))
+
+            for strategy, enabled in (('closure', True), ('cte', False)):
+                with override_settings(TREE_CLOSURE_TABLE=enabled):
+                    self.stdout.write('  %-8s descendants %8.2f ms  files %8.2f ms  ancestors %8.2f ms  is_under %8.2f ms' % (
+                        strategy,
+                        timed(lambda: ids(descendant_dirs(root)), options['repeat']),
+                        timed(lambda: ids(descendant_files(root)), options['repeat']),
+                        timed(lambda: ids(ancestor_dirs(leaf)), options['repeat']),
+                        timed(lambda: is_under(leaf, root), options['repeat']),
+                    ))
+            self.stdout.write('  %-8s descendants %8.2f ms  files %8.2f ms  ancestors %8.2f ms' % (
+                'path',
+                timed(lambda: ids(root.subdirs()), options['repeat']),
+                timed(lambda: ids(root.subfiles()), options['repeat']),
+                timed(lambda: ids(leaf.ancestors()), options['repeat']),
+            ))
+
+            Directory.objects.all().delete()
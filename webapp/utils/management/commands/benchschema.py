@@ -0,0 +1,70 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from utils.models import Directory, File
+from utils.tree import load_tree
+
+
+def query_plan(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class Command(BaseCommand):
+    help = 'Insert throughput, tree query plans and tree load time on a synthetic dataset (in a throwaway test database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dirs', type=int, default=5000)
+        parser.add_argument('--files-per-dir', type=int, default=4)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, options):
+        owner = User.objects.create(username='bench')
+        other = User.objects.create(username='other')
+
+        last = {owner: None, other: None}
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            for i in range(options['dirs']):
+                user = owner if i % 2 else other
+                dir = Directory.objects.create(name='dir%d' % i, owner=user, parent_dir=last[user] if i % 10 > 1 else None)
+                last[user] = dir
+                for j in range(options['files_per_dir']):
+                    File.objects.create(name='file%d_%d' % (i, j), owner=user, parent_dir=dir, content='users_files/test.txt')
+        elapsed = time.perf_counter() - start
+        rows = options['dirs'] * (options['files_per_dir'] + 1)
+        self.stdout.write('inserted %d nodes in %.2f s: %.0f nodes/s' % (rows, elapsed, rows / elapsed))
+
+        for model in (Directory, File):
+            live = model.objects.live().filter(owner=owner)
+            for label, queryset in (('rows', live.values_list('id', 'parent_dir_id', 'name')), ('instances', live)):
+                self.stdout.write('%s %s query plan:' % (model.__name__, label))
+                for line in query_plan(queryset):
+                    self.stdout.write('  ' + line)
+
+            start = time.perf_counter()
+            for i in range(options['repeat']):
+                len(live)
+            elapsed = (time.perf_counter() - start) / options['repeat']
+            self.stdout.write('%s instances: %.1f ms' % (model.__name__, elapsed * 1000))
+
+        with override_settings(TREE_EAGER_NODES=rows):
+            start = time.perf_counter()
+            for i in range(options['repeat']):
+                load_tree(owner)
+            elapsed = (time.perf_counter() - start) / options['repeat']
+        self.stdout.write('load_tree over %d nodes: %.1f ms' % (rows // 2, elapsed * 1000))
@@ -0,0 +1,61 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.tree import build_tree, walk
+
+
+# nodes: (max seconds, max peak MiB) for build_tree + walk over synthetic rows
+TARGETS = {
+    10_000: (0.05, 3),
+    100_000: (0.5, 30),
+    1_000_000: (5.0, 300),
+}
+
+
+def synthetic_rows(size, fanout=8, files_per_dir=4):
+    dirs = size // (files_per_dir + 1)
+    dir_rows = [(i, (i - 1) // fanout if i > fanout else None, 'dir%d' % i) for i in range(1, dirs + 1)]
+    file_rows = [(i, i % dirs + 1, 'file%d' % i, 'users_files/file%d' % i) for i in range(1, size - dirs + 1)]
+    return dir_rows, file_rows
+
+
+def run(dir_rows, file_rows):
+    count = 0
+    for event, node in walk(build_tree(dir_rows, file_rows)):
+        count += 1
+    return count
+
+
+class Command(BaseCommand):
+    help = 'Benchmark building and walking the directory tree for 10k, 100k and 1M nodes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sizes', nargs='*', type=int, default=sorted(TARGETS))
+
+    def handle(self, *args, **options):
+        failed = False
+
+        for size in options['sizes']:
+            dir_rows, file_rows = synthetic_rows(size)
+
+            start = time.perf_counter()
+            run(dir_rows, file_rows)
+            elapsed = time.perf_counter() - start
+
+            tracemalloc.start()
+            run(dir_rows, file_rows)
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+
+            line = '%9d nodes: %8.3f s  %8.1f MiB peak' % (size, elapsed, peak)
+            if size in TARGETS:
+                max_time, max_peak = TARGETS[size]
+                ok = elapsed <= max_time and peak <= max_peak
+                failed = failed or not ok
+                line += '  (target %.2f s, %d MiB) %s' % (max_time, max_peak, 'ok' if ok else 'FAIL')
+            self.stdout.write(line)
+
+        if failed:
+            raise CommandError('tree benchmark missed its targets')
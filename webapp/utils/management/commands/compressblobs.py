@@ -0,0 +1,73 @@
+import os
+import tempfile
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Max, OuterRef, Subquery
+from django.utils import timezone
+
+from utils.models import Blob, File
+from utils.storage import SUFFIXES, blob_name, encode, looks_like_text
+
+
+class Command(BaseCommand):
+    help = 'Compress stored text blobs with gzip, or cold ones with xz, in batches while the site runs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--xz-days', type=float, default=None, help='recompress blobs not uploaded for this many days with xz')
+        parser.add_argument('--batch', type=int, default=100, help='blobs per batch')
+        parser.add_argument('--sleep', type=float, default=0.1, help='seconds between batches')
+
+    def handle(self, *args, **options):
+        storage = File.content.field.storage
+        prefix = os.path.dirname(File.content.field.upload_to)
+        encoding = 'gzip' if options['xz_days'] is None else 'xz'
+
+        blobs = Blob.objects.filter(size__gte=settings.BLOB_COMPRESS_MIN_SIZE)
+        if encoding == 'gzip':
+            blobs = blobs.filter(encoding='')
+        else:
+            last_upload = File.objects.filter(sha256=OuterRef('digest')).values('sha256').annotate(last=Max('creation_date')).values('last')
+            blobs = blobs.exclude(encoding='xz').annotate(last_upload=Subquery(last_upload)).filter(
+                last_upload__lt=timezone.now() - timedelta(days=options['xz_days'])
+            )
+
+        last_id = 0
+        report = {'blobs' : 0, 'before' : 0, 'after' : 0, 'skipped' : 0}
+        while True:
+            batch = list(blobs.filter(id__gt=last_id).order_by('id')[:options['batch']])
+            if not batch:
+                break
+            for blob in batch:
+                self.compress(storage, prefix, blob, encoding, report)
+            last_id = batch[-1].id
+            time.sleep(options['sleep'])
+
+        self.stdout.write('%(blobs)d blobs compressed, %(skipped)d left as they were' % report)
+        self.stdout.write('stored bytes: %(before)d -> %(after)d' % report)
+
+    def compress(self, storage, prefix, blob, encoding, report):
+        old = storage.existing_blob(blob_name(prefix, blob.digest) + SUFFIXES[blob.encoding])
+        if old is None or (not blob.encoding and not looks_like_text(storage.path(old))):
+            report['skipped'] += 1
+            return
+
+        new = blob_name(prefix, blob.digest) + SUFFIXES[encoding]
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(storage.path(new)), suffix='.part')
+        os.close(fd)
+        with storage.open(old) as raw:
+            encode(raw, temp, encoding)
+
+        before, after = os.path.getsize(storage.path(old)), os.path.getsize(temp)
+        if after > min(before, blob.size * 0.9):
+            os.remove(temp)
+            report['skipped'] += 1
+            return
+
+        os.replace(temp, storage.path(new))
+        storage.relocate(old, new, encoding=encoding)
+        report['blobs'] += 1
+        report['before'] += before
+        report['after'] += after
@@ -0,0 +1,77 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from utils.models import File
+from utils.storage import blob_digest, blob_name, hash_file
+
+
+def disk_usage(directory):
+    # (files, bytes, bytes allocated on disk) of the regular files below it
+    files = bytes = allocated = 0
+    for root, dirs, names in os.walk(directory):
+        for name in names:
+            stat = os.lstat(os.path.join(root, name))
+            files += 1
+            bytes += stat.st_size
+            allocated += stat.st_blocks * 512
+    return files, bytes, allocated
+
+
+class Command(BaseCommand):
+    help = 'Move uploads stored before deduplication into the content-addressed blob store, in place'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='only hash the files and report the savings')
+        parser.add_argument('--delete-orphans', action='store_true', help='also delete files no row points at')
+
+    def handle(self, *args, **options):
+        storage = File.content.field.storage
+        prefix = os.path.dirname(File.content.field.upload_to)
+        directory = storage.path(prefix)
+        before = disk_usage(directory)
+
+        names = File.objects.exclude(content='').values_list('content', flat=True).distinct()
+        legacy = sorted(name for name in names if not blob_digest(name))
+        digests = {}
+        missing = stored = 0
+
+        for name in legacy:
+            path = storage.path(name)
+            if not os.path.isfile(path):
+                missing += 1
+                continue
+            digest = hash_file(path)
+            digests.setdefault(digest.hexdigest(), digest.size)
+            stored += digest.size
+            if not options['dry_run']:
+                storage.relocate(name, blob_name(prefix, digest.hexdigest()), digest.hexdigest(), digest.size)
+
+        self.stdout.write('%d old names, %d distinct contents, %d files missing' % (len(legacy), len(digests), missing))
+        if options['dry_run']:
+            self.stdout.write('would save %d files (inodes) and %d bytes' % (
+                len(legacy) - missing - len(digests), stored - sum(digests.values())
+            ))
+            return
+
+        orphans = self.orphans(directory, prefix)
+        if options['delete_orphans']:
+            for path in orphans:
+                os.remove(path)
+        self.stdout.write('%d files no row points at%s' % (len(orphans), ', deleted' if options['delete_orphans'] else ''))
+
+        after = disk_usage(directory)
+        self.stdout.write('files (inodes): %d -> %d, saved %d' % (before[0], after[0], before[0] - after[0]))
+        self.stdout.write('bytes: %d -> %d, saved %d' % (before[1], after[1], before[1] - after[1]))
+        self.stdout.write('on disk: %d -> %d, saved %d' % (before[2], after[2], before[2] - after[2]))
+
+    def orphans(self, directory, prefix):
+        names = set(File.objects.exclude(content='').values_list('content', flat=True).distinct())
+        orphans = []
+        for root, dirs, files in os.walk(directory):
+            for file in files:
+                path = os.path.join(root, file)
+                name = '/'.join([prefix] + os.path.relpath(path, directory).split(os.sep))
+                if not file.endswith('.part') and name not in names:
+                    orphans.append(path)
+        return orphans
@@ -0,0 +1,35 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from utils.purge import purge, purge_uploads
+
+
+class Command(BaseCommand):
+    help = 'Hard-delete nodes soft-deleted longer than the retention window, with their uploaded files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=settings.PURGE_RETENTION_DAYS, help='retention window')
+        parser.add_argument('--batch', type=int, default=settings.PURGE_BATCH_SIZE, help='rows per transaction')
+        parser.add_argument('--sleep', type=float, default=settings.PURGE_SLEEP, help='seconds between batches')
+        parser.add_argument('--max-batches', type=int, default=None, help='stop after this many batches')
+        parser.add_argument('--loop', type=float, default=None, metavar='SECONDS', help='keep running, purging every SECONDS')
+
+    def handle(self, *args, **options):
+        while True:
+            cutoff = timezone.now() - timedelta(days=options['days'])
+            report = purge(
+                cutoff, options['batch'], options['sleep'], options['max_batches'],
+                progress=lambda report: self.stdout.write('  batch %(batches)d: %(dirs)d dirs, %(files)d files, %(bytes)d bytes' % report)
+            )
+            self.stdout.write('purged %(dirs)d directories and %(files)d files, %(bytes)d bytes reclaimed in %(batches)d batches' % report)
+            self.stdout.write('dropped %d stale upload sessions' % purge_uploads(
+                timezone.now() - timedelta(hours=settings.UPLOAD_SESSION_HOURS)
+            ))
+
+            if options['loop'] is None:
+                break
+            time.sleep(options['loop'])
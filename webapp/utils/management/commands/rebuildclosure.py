@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from utils.ancestry import rebuild_closure
+from utils.models import DirectoryClosure
+
+
+class Command(BaseCommand):
+    help = 'Recreate the directory closure table from parent_dir links'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_closure()
+        self.stdout.write('%d closure rows' % DirectoryClosure.objects.count())
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from utils.aggregates import recompute_aggregates
+from utils.models import File
+
+
+class Command(BaseCommand):
+    help = 'Recompute per-directory file/directory counts and sizes, or only verify them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='report stale directories without fixing them')
+        parser.add_argument('--stat', action='store_true', help='refresh file sizes from storage first')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['stat']:
+                self.stdout.write('%d file sizes refreshed' % refresh_sizes())
+            stale = recompute_aggregates(fix=not options['verify'])
+
+        if options['verify'] and stale:
+            raise CommandError('%d directories with stale aggregates, e.g. %s' % (
+                len(stale), ', '.join(str(id) for id in stale[:10])
+            ))
+        self.stdout.write('%d directories %s' % (len(stale), 'stale' if options['verify'] else 'fixed'))
+
+
+def refresh_sizes():
+    storage = File.content.field.storage
+    changed = []
+    for file in File.objects.exclude(content='').only('id', 'content', 'size').iterator():
+        try:
+            size = storage.size(file.content.name)
+        except OSError:
+            continue
+        if size != file.size:
+            file.size = size
+            changed.append(file)
+    File.objects.bulk_update(changed, ['size'], batch_size=500)
+    return len(changed)
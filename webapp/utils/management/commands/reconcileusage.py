@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from utils.usage import reconcile_usage
+
+
+class Command(BaseCommand):
+    help = 'Recompute per-user storage usage from the file rows, or only verify it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='report drifted users without fixing them')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            stale = reconcile_usage(fix=not options['verify'])
+
+        if options['verify'] and stale:
+            raise CommandError('%d users with drifted usage, e.g. %s' % (
+                len(stale), ', '.join(str(id) for id in stale[:10])
+            ))
+        self.stdout.write('%d users %s' % (len(stale), 'drifted' if options['verify'] else 'fixed'))
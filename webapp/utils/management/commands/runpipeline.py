@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from utils.pipeline import drain, requeue_stale
+
+
+class Command(BaseCommand):
+    help = 'Run pending post-upload stages, including ones a stopped worker left behind'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='stop after running this many stages')
+        parser.add_argument('--loop', type=float, default=None, metavar='SECONDS', help='keep running, polling every SECONDS')
+
+    def handle(self, *args, **options):
+        while True:
+            requeued = requeue_stale()
+            ran = drain(options['limit'])
+            if requeued or ran or options['loop'] is None:
+                self.stdout.write('%d stale stages requeued, %d stages run' % (requeued, ran))
+
+            if options['loop'] is None:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,36 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from utils.models import File
+from utils.storage import blob_digest, blob_name
+
+
+class Command(BaseCommand):
+    help = 'Move blobs stored flat in the upload directory into the hash-sharded layout, in batches, while the site runs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=500, help='blobs per batch')
+        parser.add_argument('--sleep', type=float, default=0.1, help='seconds between batches')
+
+    def handle(self, *args, **options):
+        storage = File.content.field.storage
+        prefix = os.path.dirname(File.content.field.upload_to)
+        flat = File.objects.filter(content__regex=r'^%s/[0-9a-f]{64}$' % prefix)
+        moved = missing = batches = 0
+
+        while True:
+            names = list(flat.order_by('content').values_list('content', flat=True).distinct()[:options['batch']])
+            if not names:
+                break
+            for name in names:
+                if storage.relocate(name, blob_name(prefix, blob_digest(name))):
+                    moved += 1
+                else:
+                    missing += 1
+            batches += 1
+            self.stdout.write('  batch %d: %d blobs moved' % (batches, moved))
+            time.sleep(options['sleep'])
+
+        self.stdout.write('moved %d blobs in %d batches, %d missing' % (moved, batches, missing))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from utils.treecache import stats
+
+
+class Command(BaseCommand):
+    help = 'Show hit ratio and render time of the per-user tree cache'
+
+    def handle(self, *args, **options):
+        self.stdout.write('hits %(hits)d  misses %(misses)d  hit ratio %(hit_ratio).1%%  avg render %(avg_render_ms).1f ms' % stats())
@@ -0,0 +1,52 @@
+# Generated by Django 3.2 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+def backfill_paths(apps, schema_editor):
+    Directory = apps.get_model('utils', 'Directory')
+    File = apps.get_model('utils', 'File')
+
+    parents = dict(Directory.objects.values_list('id', 'parent_dir_id'))
+    paths = {}
+
+    for id in parents:
+        chain = []
+        while id is not None and id not in paths:
+            chain.append(id)
+            id = parents.get(id)
+        path = paths[id] if id is not None else '/'
+        for id in reversed(chain):
+            path = '%s%d/' % (path, id)
+            paths[id] = path
+
+    directories = list(Directory.objects.only('id'))
+    for dir in directories:
+        dir.path = paths[dir.id]
+    Directory.objects.bulk_update(directories, ['path'], batch_size=500)
+
+    files = list(File.objects.only('id', 'parent_dir_id'))
+    for file in files:
+        file.path = paths[file.parent_dir_id] if file.parent_dir_id else '/'
+    File.objects.bulk_update(files, ['path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils', '0007_alter_file_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directory',
+            name='path',
+            field=models.CharField(db_index=True, default='', max_length=1024),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='path',
+            field=models.CharField(db_index=True, default='', max_length=1024),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2 on 2026-10-18 12:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils', '0008_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectoryClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='utils.directory')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='utils.directory')),
+            ],
+            options={
+                'unique_together': {('ancestor', 'descendant')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='directoryclosure',
+            index=models.Index(fields=['descendant', 'depth'], name='utils_direc_descend_3188c3_idx'),
+        ),
+    ]
@@ -0,0 +1,116 @@
+# Generated by Django 3.2 on 2026-10-18 13:30
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+FIELDS = ('timestamp', 'validity_flag', 'name', 'description', 'creation_date', 'owner_id', 'availability_flag', 'parent_dir_id', 'path')
+
+
+def copy_rows(old_model, new_model, extra=()):
+    rows = []
+    for row in old_model.objects.values('entity_ptr_id', *FIELDS, *extra).iterator(chunk_size=2000):
+        rows.append(new_model(id=row.pop('entity_ptr_id'), **row))
+        if len(rows) == 2000:
+            new_model.objects.bulk_create(rows)
+            rows = []
+    new_model.objects.bulk_create(rows)
+
+
+def copy_nodes(apps, schema_editor):
+    # Ids are kept, so parent_dir, paths and closure rows stay valid as they are.
+    FlatDirectory = apps.get_model('utils', 'FlatDirectory')
+    FlatFile = apps.get_model('utils', 'FlatFile')
+
+    copy_rows(apps.get_model('utils', 'Directory'), FlatDirectory)
+    copy_rows(apps.get_model('utils', 'File'), FlatFile, ('content',))
+
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [FlatDirectory, FlatFile]):
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('utils', '0010_treestate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlatDirectory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('validity_flag', models.BooleanField(default=True)),
+                ('name', models.CharField(max_length=50)),
+                ('description', models.CharField(blank=True, default='', max_length=255)),
+                ('creation_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('availability_flag', models.BooleanField(default=True)),
+                ('path', models.CharField(db_index=True, default='', max_length=1024)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('parent_dir', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='utils.flatdirectory')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FlatFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('validity_flag', models.BooleanField(default=True)),
+                ('name', models.CharField(max_length=50)),
+                ('description', models.CharField(blank=True, default='', max_length=255)),
+                ('creation_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('availability_flag', models.BooleanField(default=True)),
+                ('content', models.FileField(default='', upload_to='users_files/')),
+                ('path', models.CharField(db_index=True, default='', max_length=1024)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('parent_dir', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='utils.flatdirectory')),
+            ],
+        ),
+        migrations.RunPython(copy_nodes),
+        migrations.AlterField(
+            model_name='directoryclosure',
+            name='ancestor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='utils.flatdirectory'),
+        ),
+        migrations.AlterField(
+            model_name='directoryclosure',
+            name='descendant',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='utils.flatdirectory'),
+        ),
+        migrations.DeleteModel(
+            name='SectionData',
+        ),
+        migrations.DeleteModel(
+            name='SectionCategory',
+        ),
+        migrations.DeleteModel(
+            name='SectionStatus',
+        ),
+        migrations.DeleteModel(
+            name='FileSection',
+        ),
+        migrations.DeleteModel(
+            name='File',
+        ),
+        migrations.DeleteModel(
+            name='Directory',
+        ),
+        migrations.DeleteModel(
+            name='Entity',
+        ),
+        migrations.RenameModel(
+            old_name='FlatDirectory',
+            new_name='Directory',
+        ),
+        migrations.RenameModel(
+            old_name='FlatFile',
+            new_name='File',
+        ),
+    ]
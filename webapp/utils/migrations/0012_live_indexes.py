@@ -0,0 +1,37 @@
+# Generated by Django 3.2 on 2026-10-18 13:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils', '0011_flatten_entity'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='directory',
+            index=models.Index(condition=models.Q(('availability_flag', True)), fields=['owner', 'id'], name='utils_dir_live_owner_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='directory',
+            index=models.Index(condition=models.Q(('availability_flag', True)), fields=['owner', 'parent_dir', 'id'], name='utils_dir_live_parent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='directory',
+            index=models.Index(condition=models.Q(('availability_flag', True)), fields=['owner', 'name'], name='utils_dir_live_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(condition=models.Q(('availability_flag', True)), fields=['owner', 'id'], name='utils_file_live_owner_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(condition=models.Q(('availability_flag', True)), fields=['owner', 'parent_dir', 'id'], name='utils_file_live_parent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(condition=models.Q(('availability_flag', True)), fields=['owner', 'name'], name='utils_file_live_name_idx'),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 3.2 on 2026-10-18 13:40
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+AGGREGATES = ('direct_dirs', 'direct_files', 'total_dirs', 'total_files', 'total_bytes')
+
+
+def backfill_aggregates(apps, schema_editor):
+    # Self-contained, as the app's code may change after this migration.
+    Directory = apps.get_model('utils', 'Directory')
+    File = apps.get_model('utils', 'File')
+
+    files = []
+    for file in File.objects.exclude(content='').only('id', 'content'):
+        try:
+            file.size = default_storage.size(file.content.name)
+        except OSError:
+            continue
+        files.append(file)
+    File.objects.bulk_update(files, ['size'], batch_size=500)
+
+    aggregates = {}
+    dirs = list(Directory.objects.filter(availability_flag=True).values_list('id', 'parent_dir_id', 'path'))
+    for id, parent_id, path in dirs:
+        aggregates[id] = dict.fromkeys(AGGREGATES, 0)
+
+    for parent_id, size in File.objects.filter(availability_flag=True).values_list('parent_dir_id', 'size'):
+        if parent_id in aggregates:
+            row = aggregates[parent_id]
+            row['direct_files'] += 1
+            row['total_files'] += 1
+            row['total_bytes'] += size
+
+    # deepest first, so every directory is complete before it is added to its parent
+    dirs.sort(key=lambda dir: dir[2].count('/'), reverse=True)
+    for id, parent_id, path in dirs:
+        if parent_id in aggregates:
+            row, parent = aggregates[id], aggregates[parent_id]
+            parent['direct_dirs'] += 1
+            parent['total_dirs'] += row['total_dirs'] + 1
+            parent['total_files'] += row['total_files']
+            parent['total_bytes'] += row['total_bytes']
+
+    Directory.objects.bulk_update([
+        Directory(id=id, **row) for id, row in aggregates.items()
+    ], AGGREGATES, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils', '0012_live_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directory',
+            name='direct_dirs',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='directory',
+            name='direct_files',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='directory',
+            name='total_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='directory',
+            name='total_dirs',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='directory',
+            name='total_files',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_aggregates, migrations.RunPython.noop),
+    ]
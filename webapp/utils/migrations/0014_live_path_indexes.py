@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils', '0013_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='directory',
+            index=models.Index(condition=models.Q(('availability_flag', True)), fields=['owner', 'path'], name='utils_dir_live_path_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(condition=models.Q(('availability_flag', True)), fields=['owner', 'path', 'id'], name='utils_file_live_path_idx'),
+        ),
+    ]
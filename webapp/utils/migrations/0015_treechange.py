@@ -0,0 +1,34 @@
+# Generated by Django 3.2 on 2026-10-18 14:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('utils', '0014_live_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TreeChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('op', models.CharField(choices=[('create', 'create'), ('modify', 'modify'), ('delete', 'delete')], max_length=6)),
+                ('kind', models.CharField(max_length=1)),
+                ('node_id', models.BigIntegerField()),
+                ('parent_id', models.BigIntegerField(null=True)),
+                ('name', models.CharField(blank=True, default='', max_length=50)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='treechange',
+            index=models.Index(fields=['owner', 'id'], name='utils_change_owner_idx'),
+        ),
+    ]
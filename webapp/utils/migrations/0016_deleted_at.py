@@ -0,0 +1,40 @@
+# Generated by Django 3.2 on 2026-10-18 15:00
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_deleted_at(apps, schema_editor):
+    # When rows were deleted is unknown; the retention window starts now.
+    now = timezone.now()
+    for name in ('Directory', 'File'):
+        apps.get_model('utils', name).objects.filter(availability_flag=False).update(deleted_at=now)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils', '0015_treechange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directory',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_deleted_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='directory',
+            index=models.Index(condition=models.Q(('availability_flag', False)), fields=['deleted_at'], name='utils_dir_dead_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(condition=models.Q(('availability_flag', False)), fields=['deleted_at'], name='utils_file_dead_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2 on 2026-10-18 16:00
+
+from django.db import migrations, models
+import utils.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils', '0017_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('refs', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='content',
+            field=models.FileField(default='', storage=utils.storage.BlobStorage(), upload_to='users_files/'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 3.2 on 2026-10-18 16:30
+
+import hashlib
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+
+def hash_file(path):
+    # (sha256, lines) of a file; a last line without '\n' counts too.
+    # Self-contained, as the app's code may change after this migration.
+    sha256 = hashlib.sha256()
+    size = newlines = 0
+    last = b''
+    with open(path, 'rb') as source:
+        for piece in iter(lambda: source.read(64 * 1024), b''):
+            sha256.update(piece)
+            size += len(piece)
+            newlines += piece.count(b'\n')
+            last = piece[-1:]
+    return sha256.hexdigest(), newlines + (size > 0 and last != b'\n')
+
+
+def backfill_digests(apps, schema_editor):
+    File = apps.get_model('utils', 'File')
+
+    digests = {}
+    files = []
+    for file in File.objects.exclude(content='').only('id', 'content'):
+        name = file.content.name
+        if name not in digests:
+            try:
+                digests[name] = hash_file(default_storage.path(name))
+            except OSError:
+                digests[name] = None
+        if digests[name] is not None:
+            file.sha256, file.lines = digests[name]
+            files.append(file)
+    File.objects.bulk_update(files, ['sha256', 'lines'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils', '0018_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='lines',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='sha256',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.RunPython(backfill_digests, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2 on 2026-10-18 17:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_usage(apps, schema_editor):
+    # Self-contained, as the app's code may change after this migration.
+    File = apps.get_model('utils', 'File')
+    StorageUsage = apps.get_model('utils', 'StorageUsage')
+
+    rows = File.objects.values('owner_id').annotate(bytes=models.Sum('size'), files=models.Count('id'))
+    StorageUsage.objects.bulk_create([
+        StorageUsage(owner_id=row['owner_id'], bytes=row['bytes'] or 0, files=row['files']) for row in rows
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('utils', '0020_blob_encoding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bytes', models.BigIntegerField(default=0)),
+                ('files', models.BigIntegerField(default=0)),
+                ('owner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(backfill_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2 on 2026-10-18 18:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils', '0021_storageusage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileStage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(max_length=32)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=7)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('result', models.TextField(blank=True, default='')),
+                ('error', models.TextField(blank=True, default='')),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stages', to='utils.file')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='filestage',
+            index=models.Index(fields=['status', 'id'], name='utils_stage_status_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='filestage',
+            unique_together={('file', 'stage')},
+        ),
+    ]
@@ -1,20 +1,112 @@
-from django.db import models
+import os
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat, Substr
 from datetime import datetime
 from django.utils import timezone
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 
+from .storage import BlobStorage, blob_digest, upload_digest
+
+def subtree_filter(path):
+    # Rows whose path starts with the given one. Paths end with '/' and '0' is the
+    # character right after it, so this is a range the path index can serve.
+    return Q(path__gte=path, path__lt=path[:-1] + '0')
+
+def move_subtree(old_path, new_path):
+    prefix_end = len(old_path) + 1
+
+    for model in (Directory, File):
+        model.objects.filter(subtree_filter(old_path)).update(
+            path=Concat(Value(new_path), Substr('path', prefix_end))
+        )
+
+def path_parent(path):
+    # '/1/5/' -> '/1/'; '/' for root-level directories
+    return path[:path.rstrip('/').rfind('/') + 1]
+
+def shift_aggregates(path, node, sign):
+    # Adds (sign 1) or removes (sign -1) a live node, with everything below it,
+    # to the aggregates of the directories on path, using F() deltas so
+    # concurrent changes do not overwrite each other. Does nothing if the node
+    # is not live.
+    ids = path.split('/')[1:-1]
+    if not ids:
+        return
+
+    if isinstance(node, File):
+        size = File.objects.live().filter(id=node.id).values_list('size', flat=True).first()
+        if size is None:
+            return
+        direct, dirs, files, bytes = 'direct_files', 0, 1, size
+    else:
+        totals = Directory.objects.live().filter(id=node.id).values_list('total_dirs', 'total_files', 'total_bytes').first()
+        if totals is None:
+            return
+        direct, (dirs, files, bytes) = 'direct_dirs', totals
+        dirs += 1
+
+    Directory.objects.filter(id__in=ids).update(
+        total_dirs=F('total_dirs') + sign * dirs,
+        total_files=F('total_files') + sign * files,
+        total_bytes=F('total_bytes') + sign * bytes,
+    )
+    Directory.objects.filter(id=ids[-1]).update(**{direct: F(direct) + sign})
+
+def stamp_deletion(node):
+    # Keeps deleted_at in step with availability_flag for saves that flip it.
+    if node.availability_flag:
+        node.deleted_at = None
+    elif node.deleted_at is None:
+        node.deleted_at = timezone.now()
+
+class NodeQuerySet(models.QuerySet):
+    def live(self):
+        # Not soft-deleted; the live_* partial indexes only cover these rows.
+        return self.filter(availability_flag=True)
+
 class Entity(models.Model):
     timestamp = models.DateTimeField(default=timezone.now)
     validity_flag = models.BooleanField(default=True)
 
+    class Meta:
+        abstract = True
+
 class Directory(Entity):
     name = models.CharField(max_length=50)
     description = models.CharField(max_length=255, blank=True, default='')
     creation_date = models.DateTimeField(default=timezone.now)
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     availability_flag = models.BooleanField(default=True)
+    # set when availability_flag is cleared; the purge command goes by it
+    deleted_at = models.DateTimeField(null=True, blank=True)
     parent_dir = models.ForeignKey('Directory', on_delete=models.CASCADE, null=True)
+    # '/<root-level id>/.../<own id>/'
+    path = models.CharField(max_length=1024, default='', db_index=True)
+
+    # Live children and live nodes anywhere below, kept up to date by
+    # shift_aggregates() and checked by the recomputeaggregates command.
+    direct_dirs = models.BigIntegerField(default=0)
+    direct_files = models.BigIntegerField(default=0)
+    total_dirs = models.BigIntegerField(default=0)
+    total_files = models.BigIntegerField(default=0)
+    total_bytes = models.BigIntegerField(default=0)
+
+    AGGREGATES = ('direct_dirs', 'direct_files', 'total_dirs', 'total_files', 'total_bytes')
+
+    objects = NodeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'id'], condition=Q(availability_flag=True), name='utils_dir_live_owner_idx'),
+            models.Index(fields=['owner', 'parent_dir', 'id'], condition=Q(availability_flag=True), name='utils_dir_live_parent_idx'),
+            models.Index(fields=['owner', 'name'], condition=Q(availability_flag=True), name='utils_dir_live_name_idx'),
+            models.Index(fields=['owner', 'path'], condition=Q(availability_flag=True), name='utils_dir_live_path_idx'),
+            models.Index(fields=['deleted_at'], condition=Q(availability_flag=False), name='utils_dir_dead_idx'),
+        ]
 
     def validate(self):
         if self.name == '':
@@ -22,15 +114,143 @@ class Directory(Entity):
         if self.owner == None:
             raise ValidationError({'error': "Missing owner"})
 
+    def save(self, *args, **kwargs):
+        # One transaction: a move rewrites the paths below and the aggregates
+        # above, and neither may be left half done.
+        with transaction.atomic():
+            stamp_deletion(self)
+            # the stored paths; the ones in memory may be stale
+            parent_path = Directory.objects.filter(id=self.parent_dir_id).values_list('path', flat=True).get() if self.parent_dir_id else '/'
+            if not self._state.adding:
+                self.path = Directory.objects.filter(id=self.id).values_list('path', flat=True).first() or ''
+            if self.path and parent_path.startswith(self.path):
+                raise ValidationError({'error': "Cannot move a directory into itself"})
+
+            adding = self._state.adding
+            if not adding and not args and 'update_fields' not in kwargs:
+                # the aggregates are only ever changed with F() deltas
+                kwargs['update_fields'] = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key and field.name not in self.AGGREGATES
+                ]
+            super().save(*args, **kwargs)
+
+            path = '%s%d/' % (parent_path, self.id)
+            if path != self.path:
+                old_path = self.path
+                if old_path:
+                    shift_aggregates(path_parent(old_path), self, -1)
+                self.path = path
+                Directory.objects.filter(id=self.id).update(path=path)
+                if old_path:
+                    move_subtree(old_path, path)
+                    if settings.TREE_CLOSURE_TABLE:
+                        DirectoryClosure.relink(self)
+                shift_aggregates(parent_path, self, 1)
+
+            if adding and settings.TREE_CLOSURE_TABLE:
+                DirectoryClosure.link(self)
+
+            TreeChange.record(self, 'create' if adding else 'modify')
+            TreeState.bump(self.owner_id)
+
+    @property
+    def depth(self):
+        return self.path.count('/') - 2
+
+    def ancestors(self):
+        return Directory.objects.filter(id__in=self.path.split('/')[1:-2]).order_by('path')
+
+    def subdirs(self):
+        return Directory.objects.filter(subtree_filter(self.path)).exclude(id=self.id)
+
+    def subfiles(self):
+        return File.objects.filter(subtree_filter(self.path))
+
+    def soft_delete(self):
+        # Flags the directory and everything below it, returning how many live
+        # nodes that affected. Call inside a transaction.
+        shift_aggregates(path_parent(self.path), self, -1)
+        now = timezone.now()
+        count = (
+            Directory.objects.live().filter(subtree_filter(self.path)).update(availability_flag=False, deleted_at=now)
+            + self.subfiles().live().update(availability_flag=False, deleted_at=now)
+        )
+        if count:
+            TreeChange.record(self, 'delete')
+            TreeState.bump(self.owner_id)
+        return count
+
+class DirectoryClosure(models.Model):
+    # Optional (settings.TREE_CLOSURE_TABLE) ancestor/descendant pairs of
+    # directories, including (dir, dir, 0). Files hang off their parent_dir.
+    ancestor = models.ForeignKey(Directory, on_delete=models.CASCADE, related_name='+')
+    descendant = models.ForeignKey(Directory, on_delete=models.CASCADE, related_name='+')
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        indexes = [models.Index(fields=['descendant', 'depth'])]
+
+    @staticmethod
+    def ancestor_rows(dir_id):
+        if dir_id is None:
+            return []
+        return list(DirectoryClosure.objects.filter(descendant_id=dir_id).values_list('ancestor_id', 'depth'))
+
+    @staticmethod
+    def link(dir):
+        rows = [DirectoryClosure(ancestor_id=dir.id, descendant_id=dir.id, depth=0)]
+        for ancestor_id, depth in DirectoryClosure.ancestor_rows(dir.parent_dir_id):
+            rows.append(DirectoryClosure(ancestor_id=ancestor_id, descendant_id=dir.id, depth=depth + 1))
+        DirectoryClosure.objects.bulk_create(rows)
+
+    @staticmethod
+    def relink(dir):
+        subtree = DirectoryClosure.objects.filter(ancestor_id=dir.id)
+        DirectoryClosure.objects.filter(
+            descendant_id__in=subtree.values('descendant_id')
+        ).exclude(
+            ancestor_id__in=subtree.values('descendant_id')
+        ).delete()
+
+        ancestors = DirectoryClosure.ancestor_rows(dir.parent_dir_id)
+        DirectoryClosure.objects.bulk_create([
+            DirectoryClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=depth + subdepth + 1)
+            for descendant_id, subdepth in subtree.values_list('descendant_id', 'depth')
+            for ancestor_id, depth in ancestors
+        ], batch_size=500)
+
 class File(Entity):
     name = models.CharField(max_length=50)
     description = models.CharField(max_length=255, blank=True, default='')
     creation_date = models.DateTimeField(default=timezone.now)
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     availability_flag = models.BooleanField(default=True)
+    # set when availability_flag is cleared; the purge command goes by it
+    deleted_at = models.DateTimeField(null=True, blank=True)
     parent_dir = models.ForeignKey('Directory', on_delete=models.CASCADE, null=True)
 
-    content = models.FileField(upload_to='users_files/', default='')
+    # stored by content hash, see BlobStorage
+    content = models.FileField(upload_to='users_files/', storage=BlobStorage(), default='')
+    # in bytes, taken from the upload so folder sizes never need stat()
+    size = models.BigIntegerField(default=0)
+    # of the content, computed on upload; '' and None where unknown
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    lines = models.BigIntegerField(null=True, blank=True)
+    # path of the parent directory, '/' in root
+    path = models.CharField(max_length=1024, default='', db_index=True)
+
+    objects = NodeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'id'], condition=Q(availability_flag=True), name='utils_file_live_owner_idx'),
+            models.Index(fields=['owner', 'parent_dir', 'id'], condition=Q(availability_flag=True), name='utils_file_live_parent_idx'),
+            models.Index(fields=['owner', 'name'], condition=Q(availability_flag=True), name='utils_file_live_name_idx'),
+            models.Index(fields=['owner', 'path', 'id'], condition=Q(availability_flag=True), name='utils_file_live_path_idx'),
+            models.Index(fields=['deleted_at'], condition=Q(availability_flag=False), name='utils_file_dead_idx'),
+        ]
 
     def validate(self):
         if self.name == '':
@@ -38,4 +258,235 @@ class File(Entity):
         if self.owner == None:
             raise ValidationError({'error': "Missing owner"})
         if self.content == '':
-            raise ValidationError({'error': "Missing file"})
\ No newline at end of file
+            raise ValidationError({'error': "Missing file"})
+
+    def save(self, *args, **kwargs):
+        # One transaction, as for Directory: a move changes the aggregates on
+        # both paths.
+        with transaction.atomic():
+            stamp_deletion(self)
+            old_path = None
+            # a new row pointing at a stored blob takes its own reference; uploads
+            # take theirs in BlobStorage
+            shared = None
+            if self._state.adding:
+                if self.content and not self.content._committed:
+                    # a fresh upload; usually hashed while it was received
+                    digest = upload_digest(self.content.file)
+                    self.size, self.sha256, self.lines = digest.size, digest.hexdigest(), digest.lines
+                else:
+                    shared = blob_digest(self.content.name)
+                    if shared and not self.sha256:
+                        self.sha256 = shared
+            else:
+                old_path = File.objects.filter(id=self.id).values_list('path', flat=True).first()
+
+            # the stored path; the parent in memory may be stale
+            self.path = Directory.objects.filter(id=self.parent_dir_id).values_list('path', flat=True).get() if self.parent_dir_id else '/'
+            if old_path is not None and old_path != self.path:
+                shift_aggregates(old_path, self, -1)
+            if self._state.adding and self.owner_id is not None:
+                # before the upload is stored, so a refused one leaves nothing
+                StorageUsage.charge(self.owner, self.size)
+            super().save(*args, **kwargs)
+            if shared:
+                Blob.acquire(shared, self.size)
+            if old_path != self.path:
+                shift_aggregates(self.path, self, 1)
+            TreeChange.record(self, 'modify' if old_path is not None else 'create')
+            TreeState.bump(self.owner_id)
+
+    @property
+    def depth(self):
+        return self.path.count('/') - 1
+
+    def soft_delete(self):
+        shift_aggregates(self.path, self, -1)
+        count = File.objects.live().filter(id=self.id).update(availability_flag=False, deleted_at=timezone.now())
+        if count:
+            TreeChange.record(self, 'delete')
+            TreeState.bump(self.owner_id)
+        return count
+
+    def ancestors(self):
+        return Directory.objects.filter(id__in=self.path.split('/')[1:-1]).order_by('path')
+
+class Blob(models.Model):
+    # One stored file of BlobStorage. refs counts the File rows pointing at it,
+    # dead ones included, so the purge knows when the file can go.
+    digest = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField(default=0)
+    refs = models.IntegerField(default=0)
+    # how the file is compressed at rest, a key of storage.SUFFIXES
+    encoding = models.CharField(max_length=4, blank=True, default='')
+
+    @staticmethod
+    def acquire(digest, size, count=1):
+        if not Blob.objects.filter(digest=digest).update(refs=F('refs') + count):
+            blob, created = Blob.objects.get_or_create(digest=digest, defaults={'size': size, 'refs': count})
+            if not created:
+                Blob.objects.filter(digest=digest).update(refs=F('refs') + count)
+
+class TreeState(models.Model):
+    # Bumped on every change to the owner's tree; caches key on the version.
+    owner = models.OneToOneField(User, on_delete=models.CASCADE)
+    version = models.PositiveBigIntegerField(default=0)
+
+    @staticmethod
+    def current(owner_id):
+        return TreeState.objects.filter(owner_id=owner_id).values_list('version', flat=True).first() or 0
+
+    @staticmethod
+    def bump(owner_id):
+        if not TreeState.objects.filter(owner_id=owner_id).update(version=F('version') + 1):
+            state, created = TreeState.objects.get_or_create(owner_id=owner_id, defaults={'version': 1})
+            if not created:
+                TreeState.objects.filter(owner_id=owner_id).update(version=F('version') + 1)
+
+class QuotaExceeded(Exception):
+    pass
+
+class StorageUsage(models.Model):
+    # What the owner's files take up: every File row not yet purged, soft-deleted
+    # ones included, at its full size whether or not its blob is shared. Kept by
+    # charge() on upload and release() in the purge; the reconcileusage command
+    # repairs drift.
+    owner = models.OneToOneField(User, on_delete=models.CASCADE)
+    bytes = models.BigIntegerField(default=0)
+    files = models.BigIntegerField(default=0)
+
+    @staticmethod
+    def quota(owner):
+        # (bytes, files) the owner may store; None is no limit
+        return (
+            settings.STORAGE_QUOTA_BYTES_BY_USER.get(owner.get_username(), settings.STORAGE_QUOTA_BYTES),
+            settings.STORAGE_QUOTA_FILES_BY_USER.get(owner.get_username(), settings.STORAGE_QUOTA_FILES),
+        )
+
+    @staticmethod
+    def room(owner):
+        # (bytes, files) the owner has left; None where there is no limit
+        used = StorageUsage.objects.filter(owner_id=owner.id).values_list('bytes', 'files').first() or (0, 0)
+        return tuple(None if limit is None else limit - used for limit, used in zip(StorageUsage.quota(owner), used))
+
+    @staticmethod
+    def check_room(owner, bytes, files=1):
+        # Raises QuotaExceeded if that much would not fit now; charge() has the
+        # final say.
+        room_bytes, room_files = StorageUsage.room(owner)
+        if (room_bytes is not None and bytes > room_bytes) or (room_files is not None and files > room_files):
+            raise QuotaExceeded("Storage quota exceeded")
+
+    @staticmethod
+    def charge(owner, bytes, files=1):
+        # Adds to the owner's usage, raising QuotaExceeded instead if it would
+        # go over the quota. The check is part of the update, so concurrent
+        # uploads cannot both get under it.
+        max_bytes, max_files = StorageUsage.quota(owner)
+        usage = StorageUsage.objects.filter(owner_id=owner.id)
+        if max_bytes is not None:
+            usage = usage.filter(bytes__lte=max_bytes - bytes)
+        if max_files is not None:
+            usage = usage.filter(files__lte=max_files - files)
+        if usage.update(bytes=F('bytes') + bytes, files=F('files') + files):
+            return
+        row, created = StorageUsage.objects.get_or_create(owner_id=owner.id)
+        if not created:
+            raise QuotaExceeded("Storage quota exceeded")
+        StorageUsage.charge(owner, bytes, files)
+
+    @staticmethod
+    def release(owner_id, bytes, files=1):
+        StorageUsage.objects.filter(owner_id=owner_id).update(bytes=F('bytes') - bytes, files=F('files') - files)
+
+class TreeChange(models.Model):
+    # Append-only feed of changes to an owner's tree; the id is the sync cursor.
+    # Deleting a directory is one 'delete' of that directory: everything below
+    # it goes with it. Saving a node that is not live also counts as a delete.
+    OPS = [('create', 'create'), ('modify', 'modify'), ('delete', 'delete')]
+
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    op = models.CharField(max_length=6, choices=OPS)
+    # 'd' or 'f', as in the DOM ids and delete values
+    kind = models.CharField(max_length=1)
+    node_id = models.BigIntegerField()
+    parent_id = models.BigIntegerField(null=True)
+    name = models.CharField(max_length=50, blank=True, default='')
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['owner', 'id'], name='utils_change_owner_idx')]
+
+    @staticmethod
+    def record(node, op):
+        if op != 'create' and not node.availability_flag:
+            op = 'delete'
+        return TreeChange.objects.create(
+            owner_id=node.owner_id,
+            op=op,
+            kind='f' if isinstance(node, File) else 'd',
+            node_id=node.id,
+            parent_id=node.parent_dir_id,
+            name='' if op == 'delete' else node.name,
+        )
+
+    @staticmethod
+    def latest(owner_id):
+        return TreeChange.objects.filter(owner_id=owner_id).order_by('-id').values_list('id', flat=True).first() or 0
+
+class UploadSession(models.Model):
+    # A chunked upload in progress: chunks of chunk_size bytes (the last one may
+    # be shorter) are written at their offsets into a preallocated part file
+    # under UPLOAD_SESSION_DIR, which becomes the File's content on completion.
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    name = models.CharField(max_length=50)
+    description = models.CharField(max_length=255, blank=True, default='')
+    parent_dir = models.ForeignKey('Directory', on_delete=models.CASCADE, null=True)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    created = models.DateTimeField(default=timezone.now)
+    file = models.ForeignKey('File', on_delete=models.SET_NULL, null=True)
+
+    @property
+    def part_path(self):
+        return os.path.join(settings.UPLOAD_SESSION_DIR, '%d.part' % self.id)
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def missing(self):
+        received = set(self.chunks.values_list('index', flat=True))
+        return [index for index in range(self.chunk_count) if index not in received]
+
+class UploadChunk(models.Model):
+    # Received chunks; unique, so a repeated PUT of a chunk is a no-op.
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('session', 'index')
+
+class FileStage(models.Model):
+    # One post-upload stage of a file (see utils.pipeline) and its status. The
+    # pending rows are the queue, so a stage lost with its worker is picked up
+    # again by the runpipeline command.
+    STATUSES = [('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')]
+
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='stages')
+    # a key of settings.UPLOAD_STAGES
+    stage = models.CharField(max_length=32)
+    status = models.CharField(max_length=7, choices=STATUSES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    # what the stage derived, as JSON; the last error when it failed
+    result = models.TextField(blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    updated = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('file', 'stage')
+        indexes = [models.Index(fields=['status', 'id'], name='utils_stage_status_idx')]
@@ -0,0 +1,146 @@
+import codecs
+import json
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import FileStage
+
+# Work done on a file after its upload is stored, outside the request. Each
+# name in settings.UPLOAD_STAGES maps to a function taking the File and
+# returning something JSON-serializable, kept on the file's FileStage row.
+# enqueue() writes pending rows in the upload's transaction and hands them to
+# the executor once it commits:
+#   'thread' - a pool of PIPELINE_WORKERS threads in the web process, which
+#              also retries failed stages;
+#   'queue'  - nothing, the runpipeline command works the rows off;
+#   'inline' - right away in the committing thread, for tests.
+# Whatever a dead process left pending or running, runpipeline picks up.
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def stages():
+    return {name: import_string(path) for name, path in settings.UPLOAD_STAGES.items()}
+
+
+def enqueue(file_ids):
+    # Queues every stage for the files; run it in the transaction that
+    # creates them.
+    rows = [FileStage(file_id=id, stage=name) for id in file_ids for name in settings.UPLOAD_STAGES]
+    FileStage.objects.bulk_create(rows, batch_size=500, ignore_conflicts=True)
+    if rows:
+        transaction.on_commit(lambda: dispatch(file_ids))
+
+
+def dispatch(file_ids):
+    ids = list(FileStage.objects.filter(file_id__in=file_ids, status='pending').values_list('id', flat=True))
+    if settings.PIPELINE_EXECUTOR == 'inline':
+        for id in ids:
+            run(id)
+    elif settings.PIPELINE_EXECUTOR == 'thread':
+        for id in ids:
+            executor().submit(in_thread, id)
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.PIPELINE_WORKERS, thread_name_prefix='pipeline')
+        return _executor
+
+
+def in_thread(id):
+    # Pool threads keep no connection between tasks. A failed attempt left
+    # the stage pending; it is submitted again after a delay that doubles
+    # with every attempt.
+    try:
+        run(id)
+        attempts = FileStage.objects.filter(id=id, status='pending').values_list('attempts', flat=True).first()
+    finally:
+        connection.close()
+    if attempts:
+        retry = threading.Timer(settings.PIPELINE_RETRY_SECONDS * 2 ** (attempts - 1), executor().submit, (in_thread, id))
+        retry.daemon = True
+        retry.start()
+
+
+def run(id):
+    # Runs one pending stage, unless another worker claimed it first. A
+    # failure puts it back in the queue until PIPELINE_MAX_ATTEMPTS is used
+    # up. Returns whether it ran.
+    claimed = FileStage.objects.filter(id=id, status='pending').update(
+        status='running', attempts=F('attempts') + 1, updated=timezone.now()
+    )
+    if not claimed:
+        return False
+
+    task = FileStage.objects.select_related('file').get(id=id)
+    try:
+        result = json.dumps(stages()[task.stage](task.file))
+    except Exception:
+        status = 'failed' if task.attempts >= settings.PIPELINE_MAX_ATTEMPTS else 'pending'
+        FileStage.objects.filter(id=id).update(status=status, error=traceback.format_exc(limit=5), updated=timezone.now())
+    else:
+        FileStage.objects.filter(id=id).update(status='done', result=result, error='', updated=timezone.now())
+    return True
+
+
+def requeue_stale():
+    # Stages left running by a worker that went away. Returns the count.
+    cutoff = timezone.now() - timedelta(seconds=settings.PIPELINE_STALE_SECONDS)
+    return FileStage.objects.filter(status='running', updated__lt=cutoff).update(status='pending')
+
+
+def drain(limit=None):
+    # Runs pending stages oldest first until none are left or limit ran.
+    # Returns how many ran here.
+    ran = 0
+    while limit is None or ran < limit:
+        close_old_connections()
+        id = FileStage.objects.filter(status='pending').order_by('id').values_list('id', flat=True).first()
+        if id is None:
+            break
+        ran += run(id)
+    return ran
+
+
+def detect_encoding(file):
+    # 'binary' for content with NUL bytes, else the first of ascii, utf-8 and
+    # latin-1 that decodes all of it.
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    ascii = True
+    with file.content.open('rb') as content:
+        for piece in iter(lambda: content.read(64 * 1024), b''):
+            if b'\0' in piece:
+                return {'encoding' : 'binary'}
+            ascii = ascii and piece.isascii()
+            try:
+                decoder.decode(piece)
+            except UnicodeDecodeError:
+                return {'encoding' : 'latin-1'}
+    try:
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return {'encoding' : 'latin-1'}
+    return {'encoding' : 'ascii' if ascii else 'utf-8'}
+
+
+def build_preview(file):
+    # The first PIPELINE_PREVIEW_LINES lines as text, for listings and search,
+    # out of at most PIPELINE_PREVIEW_BYTES read from the start of the file.
+    with file.content.open('rb') as content:
+        head = content.read(settings.PIPELINE_PREVIEW_BYTES)
+    if b'\0' in head:
+        return {'preview' : None}
+    lines = head.decode('utf-8', errors='replace').splitlines()
+    return {'preview' : '\n'.join(lines[:settings.PIPELINE_PREVIEW_LINES])}
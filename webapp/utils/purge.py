@@ -0,0 +1,107 @@
+import time
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+
+from .models import Blob, Directory, File, StorageUsage, UploadSession
+from .storage import blob_digest
+from .uploads import discard
+
+
+def expired(model, cutoff):
+    return model.objects.filter(availability_flag=False, deleted_at__lt=cutoff)
+
+
+def purge_files(cutoff, batch_size):
+    # Hard-deletes one batch of expired files, releasing their blobs and their
+    # owners' storage usage; a blob goes when its last reference does. Its
+    # file is removed before the transaction commits, so an upload of the same
+    # bytes waits for it and then stores them again. Names from before
+    # deduplication are deleted once no row points at them. Returns (rows,
+    # bytes).
+    storage = File.content.field.storage
+
+    with transaction.atomic():
+        rows = list(expired(File, cutoff).order_by('id').values_list('id', 'content', 'owner_id', 'size')[:batch_size])
+        File.objects.filter(id__in=[id for id, content, owner_id, size in rows]).delete()
+
+        usage = {}
+        for id, content, owner_id, size in rows:
+            bytes, files = usage.get(owner_id, (0, 0))
+            usage[owner_id] = (bytes + size, files + 1)
+        for owner_id, (bytes, files) in usage.items():
+            StorageUsage.release(owner_id, bytes, files)
+
+        released = Counter(content for id, content, owner_id, size in rows if blob_digest(content))
+        for name, count in released.items():
+            Blob.objects.filter(digest=blob_digest(name)).update(refs=F('refs') - count)
+        digests = {blob_digest(name): name for name in released}
+        dead = list(Blob.objects.filter(digest__in=digests, refs__lte=0).values_list('digest', 'size'))
+        Blob.objects.filter(digest__in=[digest for digest, size in dead]).delete()
+
+        bytes = 0
+        for digest, size in dead:
+            try:
+                storage.delete_blob(digests[digest])
+            except OSError:
+                continue
+            bytes += size
+
+    names = {content for id, content, owner_id, size in rows if content and not blob_digest(content)}
+    names -= set(File.objects.filter(content__in=names).values_list('content', flat=True))
+
+    for name in names:
+        try:
+            size = storage.size(name)
+            storage.delete(name)
+        except OSError:
+            continue
+        bytes += size
+
+    return len(rows), bytes
+
+
+def purge_dirs(cutoff, batch_size):
+    # Hard-deletes one batch of expired directories that have nothing left
+    # below them, so a subtree goes leaves first and no cascade has to load it.
+    leaves = expired(Directory, cutoff).filter(
+        ~Exists(Directory.objects.filter(parent_dir=OuterRef('pk'))),
+        ~Exists(File.objects.filter(parent_dir=OuterRef('pk'))),
+    )
+    with transaction.atomic():
+        ids = list(leaves.order_by('id').values_list('id', flat=True)[:batch_size])
+        Directory.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def purge(cutoff, batch_size=500, sleep=0.0, max_batches=None, progress=None):
+    # Removes nodes soft-deleted before cutoff in committed batches, sleeping
+    # between them. Stopping at any point loses nothing: a later run picks up
+    # what is left. Returns {'dirs', 'files', 'bytes', 'batches'}.
+    report = {'dirs' : 0, 'files' : 0, 'bytes' : 0, 'batches' : 0}
+
+    while max_batches is None or report['batches'] < max_batches:
+        files, bytes = purge_files(cutoff, batch_size)
+        dirs = 0 if files else purge_dirs(cutoff, batch_size)
+        if not files and not dirs:
+            break
+
+        report['files'] += files
+        report['dirs'] += dirs
+        report['bytes'] += bytes
+        report['batches'] += 1
+        if progress:
+            progress(report)
+        time.sleep(sleep)
+
+    return report
+
+
+def purge_uploads(cutoff):
+    # Drops upload sessions started before cutoff with their part files;
+    # completed ones have nothing left to resume. Returns the count.
+    sessions = list(UploadSession.objects.filter(created__lt=cutoff))
+    for session in sessions:
+        discard(session)
+    return len(sessions)
@@ -1,45 +1,539 @@
-var activeId = "#-1";
-$(activeId).css("color", "red");
+var activeId = "#d-1";
+
+function select(node) {
+    $(activeId).removeClass("selected");
+    $(node).addClass("selected");
+    activeId = "#" + $(node).attr("id");
+
+    $(".textField").empty();
+}
+
+function listed(span) {
+    return $("<ul></ul>").append($("<pre></pre>").append(span));
+}
+
+function listedDir(dir) {
+    var span = $('<span class="preformatted preformatted-hover dir-listed" data-lazy="true"></span>');
+    span.attr("id", "d" + dir.id).attr("data-id", dir.id).text(dir.name + "/");
+    return $("<ul></ul>").append($("<li></li>").append($("<pre></pre>").append(span)));
+}
+
+function listedFile(file) {
+    var span = $('<span class="preformatted preformatted-hover file-listed"></span>');
+    span.attr("id", "f" + file.id).attr("data-id", file.id).attr("data-url", file.url).text(file.name);
+    return listed(span);
+}
+
+function listedMore(parentId, cursor) {
+    var span = $('<span class="preformatted preformatted-hover more-listed">more...</span>');
+    span.attr("data-parent", parentId).attr("data-after", cursor);
+    return listed(span);
+}
+
+function fetchChildren(parentId, after, callback) {
+    var url = parentId == -1 ? "/api/dirs/root/children/" : "/api/dirs/" + parentId + "/children/";
+
+    $.getJSON(url, after ? {after: after} : {}, callback);
+}
+
+function loadChildren(parentId, after, target) {
+    fetchChildren(parentId, after, function(page) {
+        page.directories.forEach(function(dir) {
+            target.append(listedDir(dir));
+        });
+        page.files.forEach(function(file) {
+            target.append(listedFile(file));
+        });
+        if (page.next) {
+            target.append(listedMore(parentId, page.next));
+        }
+    });
+}
+
+// Virtual tree: the compact model (see tree_json) is kept in memory and only
+// the rows inside the scrolled window of .fileSelector are in the DOM. rows
+// holds the visible nodes in display order; expanding or collapsing a
+// directory splices its visible subtree in or out.
+
+var ROW_HEIGHT = 20;
+var OVERSCAN = 20;
+
+var tree = null;
+var renderPending = false;
+
+function treeNode(kind, id, name, parent) {
+    var node = {
+        key: kind + id, kind: kind, id: id, name: name, parent: parent,
+        children: [], depth: parent ? parent.depth + 1 : -1,
+        expanded: false, lazy: false, url: null, after: null
+    };
+    if (parent) {
+        parent.children.push(node);
+    }
+    if (kind != "m") {
+        tree.nodes[node.key] = node;
+    }
+    return node;
+}
+
+function addMore(parent, cursor) {
+    treeNode("m", parent.id, "more...", parent).after = cursor;
+}
+
+function buildTree(model) {
+    tree = {nodes: {}, rows: [], cursor: model.cursor};
+    tree.root = treeNode("d", -1, "root", null);
+    tree.root.expanded = true;
+
+    model.directories.forEach(function(dir) {
+        var node = treeNode("d", dir[0], dir[2], tree.nodes["d" + (dir[1] === null ? -1 : dir[1])]);
+        node.lazy = dir[3];
+        node.expanded = !dir[3];
+    });
+    model.files.forEach(function(file) {
+        treeNode("f", file[0], file[2], tree.nodes["d" + (file[1] === null ? -1 : file[1])]).url = file[3];
+    });
+    if (model.more) {
+        addMore(tree.root, model.more);
+    }
+
+    tree.rows = visibleBelow(tree.root);
+}
+
+function visibleBelow(node) {
+    var rows = [];
+    var stack = node.children.slice().reverse();
+
+    while (stack.length) {
+        var child = stack.pop();
+        rows.push(child);
+        if (child.expanded) {
+            for (var i = child.children.length - 1; i >= 0; i--) {
+                stack.push(child.children[i]);
+            }
+        }
+    }
+    return rows;
+}
+
+function isVisible(node) {
+    for (var parent = node.parent; parent; parent = parent.parent) {
+        if (!parent.expanded) {
+            return false;
+        }
+    }
+    return true;
+}
+
+function expand(node) {
+    node.expanded = true;
+    if (!isVisible(node)) {
+        return;
+    }
+    var index = node == tree.root ? -1 : tree.rows.indexOf(node);
+    tree.rows = tree.rows.slice(0, index + 1).concat(visibleBelow(node), tree.rows.slice(index + 1));
+}
+
+function collapse(node) {
+    if (isVisible(node)) {
+        tree.rows.splice(tree.rows.indexOf(node) + 1, visibleBelow(node).length);
+    }
+    node.expanded = false;
+}
+
+function loadPage(node, after) {
+    fetchChildren(node.id, after, function(page) {
+        // take the old visible rows out before the children change
+        var expanded = node.expanded;
+        if (expanded) {
+            collapse(node);
+        }
+
+        // nodes the change feed already added are skipped
+        page.directories.forEach(function(dir) {
+            if (!tree.nodes["d" + dir.id]) {
+                treeNode("d", dir.id, dir.name, node).lazy = true;
+            }
+        });
+        page.files.forEach(function(file) {
+            if (!tree.nodes["f" + file.id]) {
+                treeNode("f", file.id, file.name, node).url = file.url;
+            }
+        });
+        if (page.next) {
+            addMore(node, page.next);
+        }
+
+        if (expanded) {
+            expand(node);
+        }
+        scheduleRender();
+    });
+}
+
+function toggle(node) {
+    if (node == tree.root) {
+        return;
+    }
+    if (node.lazy) {
+        node.lazy = false;
+        expand(node);
+        loadPage(node, null);
+    } else if (node.expanded) {
+        collapse(node);
+    } else {
+        expand(node);
+    }
+    scheduleRender();
+}
+
+function loadMore(parent, after) {
+    var index = parent.children.findIndex(function(child) {
+        return child.kind == "m" && child.after == after;
+    });
+    if (index == -1) {
+        return;
+    }
+    if (parent.expanded) {
+        collapse(parent);
+        parent.children.splice(index, 1);
+        expand(parent);
+    } else {
+        parent.children.splice(index, 1);
+    }
+    loadPage(parent, after);
+}
+
+// Change feed: apply what happened since the model's cursor. Changes are
+// idempotent, so replaying ones the model already has is harmless.
+
+function detach(node) {
+    node.parent.children.splice(node.parent.children.indexOf(node), 1);
+    node.parent = null;
+}
+
+function attach(node, parent) {
+    // directories first, then files, then the 'more...' row
+    var index = parent.children.length;
+    while (index > 0 && (parent.children[index - 1].kind == "m" || (node.kind == "d" && parent.children[index - 1].kind == "f"))) {
+        index--;
+    }
+    parent.children.splice(index, 0, node);
+    node.parent = parent;
+
+    var stack = [[node, parent.depth + 1]];
+    while (stack.length) {
+        var item = stack.pop();
+        item[0].depth = item[1];
+        item[0].children.forEach(function(child) {
+            stack.push([child, item[1] + 1]);
+        });
+    }
+}
+
+function forget(node) {
+    var stack = [node];
+    while (stack.length) {
+        var item = stack.pop();
+        delete tree.nodes[item.key];
+        item.children.forEach(function(child) {
+            stack.push(child);
+        });
+    }
+}
+
+function applyChange(change) {
+    var node = tree.nodes[change.kind + change.id];
+    var parent = tree.nodes["d" + (change.parent === null ? -1 : change.parent)];
+
+    // deleted, or moved below a directory whose children are not loaded
+    if (change.op == "delete" || !parent || parent.lazy) {
+        if (node) {
+            detach(node);
+            forget(node);
+        }
+        return;
+    }
+
+    if (!node) {
+        node = treeNode(change.kind, change.id, change.name, null);
+        node.expanded = true;
+    } else if (node.parent != parent) {
+        detach(node);
+    }
+    node.name = change.name;
+    if (change.url) {
+        node.url = change.url;
+    }
+    if (!node.parent) {
+        attach(node, parent);
+    }
+}
+
+function syncTree() {
+    $.getJSON("/api/tree/changes/", {since: tree.cursor}, function(page) {
+        page.changes.forEach(applyChange);
+        tree.cursor = page.cursor;
+
+        if (page.changes.length) {
+            tree.rows = visibleBelow(tree.root);
+            scheduleRender();
+        }
+        if (page.more) {
+            syncTree();
+        }
+    });
+}
+
+function escapeHtml(text) {
+    return String(text).replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;").replace(/"/g, "&quot;");
+}
+
+function rowHtml(node) {
+    var indent = ' style="padding-left: ' + (node.depth * 10 + 10) + 'px"';
+
+    if (node.kind == "m") {
+        return '<div class="tree-row"' + indent + '><span class="preformatted preformatted-hover more-listed" data-parent="'
+            + node.id + '" data-after="' + escapeHtml(node.after) + '">more...</span></div>';
+    }
+
+    var classes = "preformatted preformatted-hover " + (node.kind == "d" ? "dir-listed" : "file-listed");
+    if ("#" + node.key == activeId) {
+        classes += " selected";
+    }
+    return '<div class="tree-row"' + indent + '><span id="' + node.key + '" data-id="' + node.id + '" class="' + classes + '"'
+        + (node.url ? ' data-url="' + escapeHtml(node.url) + '"' : '') + '>'
+        + escapeHtml(node.kind == "d" ? node.name + "/" : node.name) + '</span></div>';
+}
+
+function renderTree() {
+    renderPending = false;
+
+    var selector = $(".fileSelector")[0];
+    var viewport = $(".tree-viewport");
+    var top = selector.scrollTop - viewport[0].offsetTop;
+    var first = Math.max(0, Math.floor(top / ROW_HEIGHT) - OVERSCAN);
+    var last = Math.min(tree.rows.length, Math.ceil((top + selector.clientHeight) / ROW_HEIGHT) + OVERSCAN);
+
+    var html = [];
+    for (var i = first; i < last; i++) {
+        html.push(rowHtml(tree.rows[i]));
+    }
+
+    viewport.css("height", tree.rows.length * ROW_HEIGHT);
+    $(".tree-rows").css("top", first * ROW_HEIGHT).html(html.join(""));
+}
+
+function scheduleRender() {
+    if (!renderPending) {
+        renderPending = true;
+        window.requestAnimationFrame(renderTree);
+    }
+}
+
+// Chunked uploads: files above CHUNKED_UPLOAD_ABOVE go through /api/uploads/
+// in chunks, PARALLEL_CHUNKS at a time, each retried a few times. The session
+// id is kept in localStorage so submitting the same file again resumes it.
+
+var CHUNKED_UPLOAD_ABOVE = 8 * 1024 * 1024;
+var PARALLEL_CHUNKS = 4;
+var CHUNK_RETRIES = 3;
+
+function csrfToken() {
+    return $("[name=csrfmiddlewaretoken]").first().val();
+}
+
+function uploadKey(file) {
+    return "upload:" + file.name + ":" + file.size + ":" + file.lastModified;
+}
+
+function uploadStatus(text) {
+    $("#focus .upload-status").remove();
+    $("#focus").append($('<p class="message upload-status"></p>').text(text));
+}
+
+function startUpload(form, file, callback) {
+    var saved = localStorage.getItem(uploadKey(file));
+    var start = function() {
+        $.ajax({
+            url: "/api/uploads/", method: "POST", contentType: "application/json",
+            headers: {"X-CSRFToken": csrfToken()},
+            data: JSON.stringify({
+                name: form.find("[name=file_name]").val(),
+                description: form.find("[name=file_desc]").val(),
+                parent: parseInt(form.find("[name=dest_for_file]").val()),
+                filename: file.name,
+                size: file.size
+            })
+        }).done(function(session) {
+            localStorage.setItem(uploadKey(file), session.id);
+            callback(session);
+        }).fail(function(xhr) {
+            uploadStatus("Upload failed: " + (xhr.responseJSON ? xhr.responseJSON.error : xhr.status));
+        });
+    };
+
+    if (saved) {
+        $.getJSON("/api/uploads/" + saved + "/").done(function(session) {
+            session.file === null ? callback(session) : start();
+        }).fail(start);
+    } else {
+        start();
+    }
+}
+
+function putChunk(session, file, offset, retries, done, fail) {
+    $.ajax({
+        url: "/api/uploads/" + session.id + "/chunks/" + offset + "/", method: "PUT",
+        headers: {"X-CSRFToken": csrfToken()},
+        contentType: "application/octet-stream", processData: false,
+        data: file.slice(offset, offset + session.chunk_size)
+    }).done(done).fail(function() {
+        retries > 0 ? putChunk(session, file, offset, retries - 1, done, fail) : fail();
+    });
+}
+
+function uploadChunks(session, file, done) {
+    var queue = session.missing.slice();
+    var total = queue.length;
+    var active = 0;
+    var failed = false;
+
+    var next = function() {
+        if (failed) {
+            return;
+        }
+        if (!queue.length && !active) {
+            done();
+            return;
+        }
+        while (active < PARALLEL_CHUNKS && queue.length) {
+            active++;
+            putChunk(session, file, queue.shift(), CHUNK_RETRIES, function() {
+                active--;
+                uploadStatus("Uploading... " + Math.floor(100 * (total - queue.length - active) / total) + "%");
+                next();
+            }, function() {
+                failed = true;
+                uploadStatus("Upload interrupted, submit the same file again to resume");
+            });
+        }
+    };
+    next();
+}
+
+function chunkedUpload(form, file) {
+    startUpload(form, file, function(session) {
+        uploadChunks(session, file, function() {
+            $.ajax({
+                url: "/api/uploads/" + session.id + "/complete/", method: "POST",
+                headers: {"X-CSRFToken": csrfToken()}
+            }).done(function() {
+                localStorage.removeItem(uploadKey(file));
+                window.location = "/";
+            }).fail(function() {
+                uploadStatus("Upload incomplete, submit the same file again to resume");
+            });
+        });
+    });
+}
+
+var pickerTimer = null;
+
+function fillPicker(picker) {
+    var target = $(picker.attr("data-target"));
+    var kind = picker.attr("data-kind");
+
+    $.getJSON("/api/nodes/search/", {q: picker.val(), kind: kind}, function(page) {
+        target.find("option").slice(1).remove();
+        page.results.forEach(function(node) {
+            var option = $("<option></option>");
+            option.attr("value", kind == "all" ? node.kind[0] + ":" + node.id : node.id);
+            option.text(node.kind == "dir" ? node.name + "/" : node.name);
+            target.append(option);
+        });
+    });
+}
+
+function showForm(template) {
+    $("#focus").empty().append($(template).html());
+    $("#focus .picker").each(function() {
+        fillPicker($(this));
+    });
+}
 
 $(document).ready(function(){
+    $(activeId).addClass("selected");
+
+    if ($("#tree-model").length) {
+        buildTree(JSON.parse($("#tree-model").text()));
+        renderTree();
+
+        $(".fileSelector").on("scroll", scheduleRender);
+        $(window).on("resize", scheduleRender);
+        $(window).on("focus", syncTree);
+    }
+
     $("#add-dir-btn").click(function(){
-        $("#focus").empty();
-        var block = '<form method="POST" action="/add-dir/" style="overflow-x:hidden" style="overflow-x:hidden">{% csrf_token %}<div class="center"><label id="for_name">Name:<input id="for_name" type="text" maxlength="50" name="dir_name" required></label></div><div class="center"><label id="for_desc">Description:<input id="for_desc" type="text" maxlength="255" name="dir_desc"></label></div><br><div><label id="for_dest">Choose directory to create new directory in:<select name="dest_for_dir" id="dest_for_dir" style="width: 80%;" required><option value="-1">root</option>{% for dir in directories %}{% if dir.owner == user and dir.availability_flag == True %}<option value="{{ dir.id }}">{{ dir.name }}/</option>{% endif %}{% endfor %}</select></label></div><div class="center"><input type="submit" value="Submit"></div></form>';
-        $("#focus").append(block);
+        showForm("#add-dir-form");
     });
-});
 
-$(document).ready(function(){
     $("#add-file-btn").click(function(){
-        $("#focus").empty();
-        var block = '<div><form method="POST" action="/add-file/" enctype="multipart/form-data" style="overflow-x:hidden">{% csrf_token %}<div class="center"><label id="for_name">Name:<input id="for_name" type="text" maxlength="50" name="file_name" required></label></div><div class="center"><label id="for_desc">Description:<input id="for_desc" type="text" maxlength="255" name="file_desc"></label></div><div class="center"><label id="for_file">File:<input id="for_file" type="file" name="file_file" required></label></div><label id="for_dest">Choose directory to create new directory in:<select name="dest_for_file" id="dest_for_file" style="width: 80%;" required><option value="-1">root</option>{% for dir in directories %}{% if dir.owner == user and dir.availability_flag == True %}<option value="{{ dir.id }}">{{ dir.name }}/</option>{% endif %}{% endfor %}</select></label><div class="center"><input type="submit" value="Submit"></div></form></div>';
-        $("#focus").append(block);
+        showForm("#add-file-form");
     });
-});
 
-$(document).ready(function(){
     $("#delete-btn").click(function(){
-        $("#focus").empty();
-        var block = '<form method="POST" action="/delete/">{% csrf_token %}<label id="for_file_or_dir">Choose file or directory:<br><select name="to_delete" id="to_delete" style="width: 80%;" required><option value="">Not chosen</option>{% for file in files %}{% if file.owner == user and file.availability_flag == True %}<option value="{{ file.id }}">{{ file.name }}</option>{% endif %}{% endfor %}{% for dir in directories %}{% if dir.owner == user and dir.availability_flag == True %}<option value="{{ dir.id }}">{{ dir.name }}/</option>{% endif %}{% endfor %}</select></label><br><input type="submit" value="Submit"></form>';
-        $("#focus").append(block);
+        showForm("#delete-form");
     });
-});
 
-$(document).ready(function(){
-    $(".dir-listed").click(function(){
-        $(activeId).css("color", "white");
-        $(this).css("color", "red");
-        activeId = "#" + $(this).attr("id");
+    $("#focus").on("submit", "form[action='/add-file/']", function(event){
+        var files = $(this).find("[name=file_file]")[0].files;
+        var file = files[0];
+        var extract = $(this).find("[name=extract]").is(":checked") && /\.(zip|tar\.gz|tgz)$/i.test(file ? file.name : "");
+
+        // archives to extract and several files go through the form as before
+        if (files.length == 1 && !extract && file.size > CHUNKED_UPLOAD_ABOVE) {
+            event.preventDefault();
+            chunkedUpload($(this), file);
+        }
+    });
+
+    $("#focus").on("input", ".picker", function(){
+        var picker = $(this);
 
-        $(".textField").empty();
+        clearTimeout(pickerTimer);
+        pickerTimer = setTimeout(function() {
+            fillPicker(picker);
+        }, 150);
     });
 
-    $(".file-listed").click(function(){
-        $(activeId).css("color", "white");
-        $(this).css("color", "red");
-        activeId = "#" + $(this).attr("id");
+    $(".fileSelector").on("click", ".dir-listed", function(){
+        select(this);
 
-        $(".textField").empty();
+        if (tree) {
+            toggle(tree.nodes["d" + $(this).attr("data-id")]);
+        } else if ($(this).attr("data-lazy") == "true") {
+            $(this).attr("data-lazy", "loaded");
+            loadChildren($(this).attr("data-id"), null, $(this).closest("li"));
+        }
+    });
+
+    $(".fileSelector").on("click", ".file-listed", function(){
+        select(this);
+        putInput($(this).attr("data-url"), "textField");
+    });
+
+    $(".fileSelector").on("click", ".more-listed", function(){
+        if (tree) {
+            loadMore(tree.nodes["d" + $(this).attr("data-parent")], $(this).attr("data-after"));
+            return;
+        }
+
+        var item = $(this).closest("ul");
+        var target = item.parent();
+
+        item.remove();
+        loadChildren($(this).attr("data-parent"), $(this).attr("data-after"), target);
     });
 });
 
@@ -48,6 +542,6 @@ function putInput(path, holdername) {
     if (path.length > 1 && holdername) {
         jQuery.get(path, function(txt) {
             $('.' + holdername).html("<pre class='preformatted'>" + txt + "</pre>");
-        });
+        }, "text");
     }
-}
\ No newline at end of file
+}
@@ -0,0 +1,311 @@
+import gzip
+import hashlib
+import lzma
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+DIGEST_NAME = re.compile(r'(?:^|/)([0-9a-f]{64})(?:\.gz|\.xz)?$')
+
+# Blob.encoding -> suffix of the stored file; the suffix is how the file is
+# read back without a query.
+SUFFIXES = {'': '', 'gzip': '.gz', 'xz': '.xz'}
+ENCODINGS = {suffix: encoding for encoding, suffix in SUFFIXES.items()}
+OPENERS = {'.gz': gzip.open, '.xz': lzma.open}
+
+# paths of the blob files placed inside undo_placements(), per thread
+_placements = threading.local()
+
+
+def blob_name(directory, digest):
+    # <upload_to>/ab/cd/<sha256>: two levels of 256 directories keep each one
+    # small however many blobs there are.
+    return '/'.join((directory, digest[:2], digest[2:4], digest))
+
+
+def blob_digest(name):
+    # The SHA-256 of a blob name, or None for names from before deduplication.
+    match = DIGEST_NAME.search(name or '')
+    return match.group(1) if match else None
+
+
+def blob_encoding(name):
+    return ENCODINGS.get(os.path.splitext(name)[1], '')
+
+
+def encode(raw, target, encoding):
+    with open(target, 'wb') as out:
+        if encoding == 'gzip':
+            # no name or time in the header, so equal blobs compress equally
+            compressed = gzip.GzipFile(filename='', mode='wb', fileobj=out, mtime=0)
+        else:
+            compressed = lzma.LZMAFile(out, 'wb')
+        with compressed:
+            shutil.copyfileobj(raw, compressed, 64 * 1024)
+
+
+def looks_like_text(path):
+    with open(path, 'rb') as source:
+        return b'\0' not in source.read(8192)
+
+
+class ContentDigest:
+    # SHA-256, size and line count of data fed in pieces, so they are known
+    # after one pass over an upload. A last line without '\n' counts too.
+    def __init__(self):
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.newlines = 0
+        self.last = b''
+
+    def update(self, piece):
+        if piece:
+            self.sha256.update(piece)
+            self.size += len(piece)
+            self.newlines += piece.count(b'\n')
+            self.last = piece[-1:]
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+    @property
+    def lines(self):
+        return self.newlines + (self.size > 0 and self.last != b'\n')
+
+
+def hash_file(path):
+    digest = ContentDigest()
+    with open(path, 'rb') as source:
+        for piece in iter(lambda: source.read(64 * 1024), b''):
+            digest.update(piece)
+    return digest
+
+
+def upload_digest(content):
+    # The ContentDigest of an upload: the one HashingUploadHandler computed
+    # while receiving it, else computed here once and kept on the file.
+    if getattr(content, 'digest', None) is None:
+        if hasattr(content, 'temporary_file_path'):
+            content.digest = hash_file(content.temporary_file_path())
+        else:
+            content.digest = ContentDigest()
+            for chunk in content.chunks():
+                content.digest.update(chunk)
+    return content.digest
+
+
+def link_or_copy(source, target):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+@contextmanager
+def undo_placements():
+    # Blob files placed while this runs are removed again if it raises. Wrap
+    # it around a transaction: its rollback drops their Blob rows, but not
+    # the files moved into place.
+    outer = getattr(_placements, 'paths', None)
+    _placements.paths = paths = []
+    try:
+        yield
+    except BaseException:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    else:
+        if outer is not None:
+            outer.extend(paths)
+    finally:
+        _placements.paths = outer
+
+
+@deconstructible
+class BlobStorage(FileSystemStorage):
+    # Content-addressed: an upload is stored as blob_name(upload_to, sha256), so
+    # identical uploads share one file. It is hashed once, or not at all when
+    # HashingUploadHandler did it already. Every save takes a reference on the
+    # Blob row; the purge drops the file when the last one is released.
+
+    def get_available_name(self, name, max_length=None):
+        # the name is decided by the content in _save, nothing to probe
+        return name
+
+    def _save(self, name, content):
+        directory = os.path.dirname(self.path(name))
+        os.makedirs(directory, exist_ok=True)
+        digest = upload_digest(content)
+
+        if hasattr(content, 'temporary_file_path'):
+            temp = content.temporary_file_path()
+        else:
+            fd, temp = tempfile.mkstemp(dir=directory, suffix='.part')
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in content.chunks():
+                    out.write(chunk)
+
+        name = blob_name(os.path.dirname(name), digest.hexdigest())
+        return self.store(name, temp, digest.hexdigest(), digest.size)
+
+    def store(self, name, temp, digest, size):
+        # Takes a reference on the blob and moves temp into place unless the
+        # blob is already there, compressed or not. The reference is taken
+        # first so a purge of the same blob either finished before or waits
+        # until this commits. Returns the name with the encoding's suffix.
+        from .models import Blob
+
+        with transaction.atomic():
+            Blob.acquire(digest, size)
+            encoding = Blob.objects.filter(digest=digest).values_list('encoding', flat=True).get()
+            if os.path.exists(self.path(name + SUFFIXES[encoding])):
+                os.remove(temp)
+                return name + SUFFIXES[encoding]
+
+            encoding = self.place(name, temp, size)
+            Blob.objects.filter(digest=digest).update(encoding=encoding)
+        return name + SUFFIXES[encoding]
+
+    def store_many(self, blobs):
+        # store() for a list of (name, temp, digest, size), with a few queries
+        # for all of them rather than a few for each. Returns the names.
+        from .models import Blob
+
+        counts = Counter(digest for name, temp, digest, size in blobs)
+        digests = list(counts)
+        with transaction.atomic():
+            encodings = {}
+            for start in range(0, len(digests), 500):
+                encodings.update(Blob.objects.filter(digest__in=digests[start:start + 500]).values_list('digest', 'encoding'))
+            existing = set(encodings)
+
+            by_count = {}
+            for digest in existing:
+                by_count.setdefault(counts[digest], []).append(digest)
+            for count, group in by_count.items():
+                for start in range(0, len(group), 500):
+                    Blob.objects.filter(digest__in=group[start:start + 500]).update(refs=F('refs') + count)
+
+            names = []
+            created = {}
+            for name, temp, digest, size in blobs:
+                if digest in encodings and os.path.exists(self.path(name + SUFFIXES[encodings[digest]])):
+                    os.remove(temp)
+                else:
+                    encodings[digest] = self.place(name, temp, size)
+                    if digest in existing:
+                        Blob.objects.filter(digest=digest).update(encoding=encodings[digest])
+                    else:
+                        created[digest] = Blob(digest=digest, size=size, refs=counts[digest], encoding=encodings[digest])
+                names.append(name + SUFFIXES[encodings[digest]])
+            Blob.objects.bulk_create(created.values(), batch_size=500)
+        return names
+
+    def place(self, name, temp, size):
+        # Moves temp to name, compressed when worthwhile; returns the encoding.
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        encoding, temp = self.compress(temp, size, os.path.dirname(path))
+        path += SUFFIXES[encoding]
+        file_move_safe(temp, path, allow_overwrite=True)
+        if getattr(_placements, 'paths', None) is not None:
+            _placements.paths.append(path)
+        if self.file_permissions_mode is not None:
+            os.chmod(path, self.file_permissions_mode)
+        return encoding
+
+    def compress(self, temp, size, directory, encoding='gzip'):
+        # Compresses text-like blobs that shrink by at least a tenth. Returns
+        # the encoding and the file to store, which replaces temp when it is
+        # compressed.
+        if not settings.BLOB_COMPRESS or size < settings.BLOB_COMPRESS_MIN_SIZE or not looks_like_text(temp):
+            return '', temp
+
+        fd, compressed = tempfile.mkstemp(dir=directory, suffix='.part')
+        os.close(fd)
+        with open(temp, 'rb') as raw:
+            encode(raw, compressed, encoding)
+        if os.path.getsize(compressed) > size * 0.9:
+            os.remove(compressed)
+            return '', temp
+        os.remove(temp)
+        return encoding, compressed
+
+    def _open(self, name, mode='rb'):
+        if blob_digest(name):
+            name = self.existing_blob(name) or name
+        opener = OPENERS.get(os.path.splitext(name)[1]) if blob_digest(name) else None
+        if opener is None:
+            return super()._open(name, mode)
+        file = File(opener(self.path(name), 'rb'), name)
+        file.size = self.size(name)
+        return file
+
+    def size(self, name):
+        # of the content, not of the compressed file
+        if blob_encoding(name) and blob_digest(name):
+            from .models import Blob
+            return Blob.objects.filter(digest=blob_digest(name)).values_list('size', flat=True).get()
+        return super().size(name)
+
+    def existing_blob(self, name):
+        # The name the blob is stored under now, which differs from name when
+        # it was compressed or sharded since; None if it is gone.
+        if self.exists(name):
+            return name
+        base = name[:len(name) - len(SUFFIXES[blob_encoding(name)])]
+        for suffix in SUFFIXES.values():
+            if self.exists(base + suffix):
+                return base + suffix
+        digest = blob_digest(name)
+        if digest and not base.endswith('/'.join((digest[:2], digest[2:4], digest))):
+            # a flat name from before shardblobs
+            return self.existing_blob(blob_name(os.path.dirname(base), digest))
+        return None
+
+    def delete_blob(self, name):
+        # removes the blob's file whatever its encoding
+        base = name[:len(name) - len(SUFFIXES[blob_encoding(name)])]
+        for suffix in SUFFIXES.values():
+            self.delete(base + suffix)
+
+    def relocate(self, old, new, digest=None, size=0, encoding=None):
+        # Points the File rows at name old to name new, taking references on
+        # blob digest for them when given and recording the new encoding when
+        # given. The new file is in place before any row points at it and the
+        # old one goes only after they all moved, so readers never miss. The
+        # owners' trees are bumped, as cached ones link the old name.
+        # Returns False if neither file exists.
+        from .models import Blob, File, TreeState
+
+        old_path, new_path = self.path(old), self.path(new)
+        found = os.path.exists(new_path) or os.path.exists(old_path)
+        with transaction.atomic():
+            rows = File.objects.filter(content=old)
+            owner_ids = set(rows.values_list('owner_id', flat=True))
+            if digest is not None:
+                Blob.acquire(digest, size, rows.count())
+            if not os.path.exists(new_path) and os.path.exists(old_path):
+                link_or_copy(old_path, new_path)
+            rows.update(content=new)
+            for owner_id in owner_ids:
+                TreeState.bump(owner_id)
+            if encoding is not None:
+                Blob.objects.filter(digest=blob_digest(new)).update(encoding=encoding)
+        if os.path.exists(old_path):
+            os.remove(old_path)
+        return found
@@ -0,0 +1,195 @@
+import heapq
+from operator import itemgetter
+
+from django.conf import settings
+from django.utils.http import urlencode
+
+from .models import Directory, File, path_parent
+from .storage import blob_digest
+
+
+class DirNode:
+    __slots__ = ('id', 'name', 'subdirs', 'files', 'lazy')
+
+    def __init__(self, id, name, lazy=False):
+        self.id = id
+        self.name = name
+        self.subdirs = []
+        self.files = []
+        self.lazy = lazy
+
+
+class FileNode:
+    __slots__ = ('id', 'name', 'content')
+
+    def __init__(self, id, name, content):
+        self.id = id
+        self.name = name
+        self.content = content
+
+    @property
+    def url(self):
+        # blobs are named by their content, so the name to download as goes along
+        url = File.content.field.storage.url(self.content)
+        if blob_digest(self.content):
+            url += '?' + urlencode({'name' : self.name})
+        return url
+
+
+def build_tree(dir_rows, file_rows, lazy=False):
+    # dir_rows are (id, parent_id, name) and file_rows (id, parent_id, name, content)
+    # tuples, e.g. from values_list(). Every row is visited a constant number of
+    # times; nodes whose parent is missing from dir_rows are left out of the tree.
+    # With lazy=True the directories are marked as having unloaded children.
+    root = DirNode(-1, 'root')
+    nodes = {None: root}
+    links = []
+
+    for id, parent_id, name in dir_rows:
+        node = DirNode(id, name, lazy)
+        nodes[id] = node
+        links.append((parent_id, node))
+
+    for parent_id, node in links:
+        parent = nodes.get(parent_id)
+        if parent is not None:
+            parent.subdirs.append(node)
+
+    for id, parent_id, name, content in file_rows:
+        parent = nodes.get(parent_id)
+        if parent is not None:
+            parent.files.append(FileNode(id, name, content))
+
+    return root
+
+
+def walk(root):
+    # Pre-order ('dir', node) ... ('end', node) events with ('file', node) for the
+    # files of each directory, below the given root. Uses an explicit stack so
+    # deep trees cannot hit the recursion limit.
+    stack = [(root, False)]
+
+    while stack:
+        node, visited = stack.pop()
+
+        if visited:
+            for file in node.files:
+                yield 'file', file
+            if node is not root:
+                yield 'end', node
+            continue
+
+        if node is not root:
+            yield 'dir', node
+        stack.append((node, True))
+        for subdir in reversed(node.subdirs):
+            stack.append((subdir, False))
+
+
+def parse_cursor(after):
+    # Keyset cursor over one directory's children: directories come first in id
+    # order ('d<id>'), then files ('f<id>'). Raises ValueError on garbage.
+    if not after:
+        return 'd', 0
+    kind, id = after[0], int(after[1:])
+    if kind not in 'df' or id < 0:
+        raise ValueError(after)
+    return kind, id
+
+
+def load_children(owner, parent_id, after=None, limit=100, dir_fields=(), file_fields=()):
+    # One page of live children of parent_id (None for root) as build_tree rows,
+    # plus the cursor of the next page or None. Rows carry the extra fields
+    # after the usual ones.
+    kind, last_id = parse_cursor(after)
+    dir_rows = []
+    file_rows = []
+
+    if kind == 'd':
+        dir_rows = list(Directory.objects.live().filter(
+            owner=owner, parent_dir_id=parent_id, id__gt=last_id
+        ).order_by('id').values_list('id', 'parent_dir_id', 'name', *dir_fields)[:limit + 1])
+        if len(dir_rows) > limit:
+            return dir_rows[:limit], [], 'd%d' % dir_rows[limit - 1][0]
+        last_id = 0
+
+    file_rows = list(File.objects.live().filter(
+        owner=owner, parent_dir_id=parent_id, id__gt=last_id
+    ).order_by('id').values_list('id', 'parent_dir_id', 'name', 'content', *file_fields)[:limit - len(dir_rows) + 1])
+    if len(file_rows) > limit - len(dir_rows):
+        file_rows = file_rows[:limit - len(dir_rows)]
+        return dir_rows, file_rows, 'f%d' % (file_rows[-1][0] if file_rows else 0)
+
+    return dir_rows, file_rows, None
+
+
+def load_tree(owner):
+    # The owner's live tree as walk() events, or only the first page of the root
+    # level when there are more than TREE_EAGER_NODES live nodes. Returns the
+    # events and the cursor of the next root page, if any.
+    limit = settings.TREE_EAGER_NODES
+    dir_rows = list(Directory.objects.live().filter(owner=owner).order_by('id').values_list('id', 'parent_dir_id', 'name')[:limit + 1])
+    file_rows = list(File.objects.live().filter(owner=owner).order_by('id').values_list('id', 'parent_dir_id', 'name', 'content')[:limit + 1])
+    lazy = len(dir_rows) + len(file_rows) > limit
+    more = None
+
+    if lazy:
+        dir_rows, file_rows, more = load_children(owner, None, limit=settings.TREE_PAGE_SIZE)
+
+    return list(walk(build_tree(dir_rows, file_rows, lazy))), more
+
+
+def stream_tree(owner, chunk_size=2000):
+    # walk() events for the owner's whole live tree, generated while the rows are
+    # fetched chunk by chunk in path order. Only the open directories are kept,
+    # so memory depends on the tree's depth, not its size. Unlike walk(), a
+    # directory's files come right after it, before its subdirectories, and
+    # siblings are ordered by the text of their ids (10 before 9): that is the
+    # order the path indexes give without sorting.
+    dirs = Directory.objects.live().filter(owner=owner).order_by('path').values_list(
+        'path', 'id', 'name'
+    ).iterator(chunk_size)
+    files = File.objects.live().filter(owner=owner).order_by('path', 'id').values_list(
+        'path', 'id', 'name', 'content'
+    ).iterator(chunk_size)
+    rows = heapq.merge(
+        ((path, 0, path_parent(path), DirNode(id, name)) for path, id, name in dirs),
+        ((path, 1, path, FileNode(id, name, content)) for path, id, name, content in files),
+        key=itemgetter(0, 1),
+    )
+
+    open_dirs = []
+    for path, kind, parent_path, node in rows:
+        while open_dirs and not parent_path.startswith(open_dirs[-1][0]):
+            yield 'end', open_dirs.pop()[1]
+        if (open_dirs[-1][0] if open_dirs else '/') != parent_path:
+            # below a directory that is not live, like build_tree()'s orphans
+            continue
+
+        if isinstance(node, DirNode):
+            yield 'dir', node
+            open_dirs.append((path, node))
+        else:
+            yield 'file', node
+
+    while open_dirs:
+        yield 'end', open_dirs.pop()[1]
+
+
+def tree_json(tree, more):
+    # Compact form of walk() events: [id, parent id, name, lazy] directories and
+    # [id, parent id, name, url] files, parents before children.
+    directories = []
+    files = []
+    parents = [None]
+
+    for event, node in tree:
+        if event == 'dir':
+            directories.append([node.id, parents[-1], node.name, node.lazy])
+            parents.append(node.id)
+        elif event == 'file':
+            files.append([node.id, parents[-1], node.name, node.url])
+        else:
+            parents.pop()
+
+    return {'directories' : directories, 'files' : files, 'more' : more}
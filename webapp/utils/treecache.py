@@ -0,0 +1,101 @@
+import functools
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.staticfiles import finders
+from django.core.cache import cache
+from django.template.loader import get_template, render_to_string
+
+from .models import TreeChange, TreeState
+from .tree import load_tree, tree_json
+
+logger = logging.getLogger(__name__)
+
+STATS_KEYS = ('tree-cache:hits', 'tree-cache:misses', 'tree-cache:render-us')
+
+
+TEMPLATES = ('utils/base.html', 'utils/tree.html')
+STATIC_FILES = ('utils/scripts.js', 'utils/style.css')
+
+
+def cached_tree(owner, version=None):
+    # Rendered tree fragment and its JSON form for the owner's current tree
+    # version. Every change bumps the version, so entries never go stale and
+    # are simply left to expire. Returns (entry, hit, milliseconds).
+    start = time.perf_counter()
+    if version is None:
+        version = TreeState.current(owner.id)
+    key = 'tree:%d:%d' % (owner.id, version)
+
+    entry = cache.get(key)
+    hit = entry is not None
+    if not hit:
+        # read before the tree, so replaying the feed from here can only repeat
+        # changes the tree already has
+        cursor = TreeChange.latest(owner.id)
+        tree, more = load_tree(owner)
+        entry = {
+            'version' : version,
+            'html' : render_to_string('utils/tree.html', {'tree' : tree, 'more' : more}),
+            'json' : dict(tree_json(tree, more), cursor=cursor),
+        }
+        cache.set(key, entry, settings.TREE_CACHE_TIMEOUT)
+
+    elapsed = (time.perf_counter() - start) * 1000
+    record(hit, elapsed)
+    logger.debug('tree %s for user %d v%d in %.1f ms', 'hit' if hit else 'miss', owner.id, version, elapsed)
+    return entry, hit, elapsed
+
+
+def record(hit, elapsed):
+    for key, value in zip(STATS_KEYS, (int(hit), int(not hit), 0 if hit else int(elapsed * 1000))):
+        if value:
+            cache.add(key, 0, None)
+            try:
+                cache.incr(key, value)
+            except ValueError:
+                cache.set(key, value, None)
+
+
+def stats():
+    hits, misses, render_us = (cache.get(key, 0) for key in STATS_KEYS)
+    return {
+        'hits' : hits,
+        'misses' : misses,
+        'hit_ratio' : hits / (hits + misses) if hits + misses else 0.0,
+        'avg_render_ms' : render_us / misses / 1000 if misses else 0.0,
+    }
+
+
+def server_timing(hit, elapsed):
+    return 'tree;desc="%s";dur=%.1f' % ('hit' if hit else 'miss', elapsed)
+
+
+@functools.lru_cache(maxsize=None)
+def assets_hash():
+    digest = hashlib.sha256()
+    for path in [get_template(name).origin.name for name in TEMPLATES] + [finders.find(name) for name in STATIC_FILES]:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def tree_etag(request, *args, **kwargs):
+    # Strong validator for pages and endpoints that only depend on the user's
+    # tree: one indexed version lookup, no tree queries. The version is kept on
+    # the request so the view does not look it up again. Pages carrying flash
+    # messages or a rotated CSRF token must not match an older copy.
+    if not request.user.is_authenticated or len(messages.get_messages(request)):
+        return None
+
+    request.tree_version = TreeState.current(request.user.id)
+    return hashlib.sha256(('%d:%d:%s:%s:%s' % (
+        request.user.id,
+        request.tree_version,
+        assets_hash(),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        request.get_full_path(),
+    )).encode()).hexdigest()
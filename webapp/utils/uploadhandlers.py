@@ -0,0 +1,55 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+
+from .models import File
+from .storage import ContentDigest
+
+
+def upload_limit(user):
+    # Largest single upload the user may send, in bytes.
+    return settings.UPLOAD_MAX_SIZE_BY_USER.get(user.get_username(), settings.UPLOAD_MAX_SIZE)
+
+
+class HashedUploadedFile(TemporaryUploadedFile):
+    # Written next to the blobs, so storing it is a rename in one directory.
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        directory = File.content.field.storage.path(File.content.field.upload_to)
+        os.makedirs(directory, exist_ok=True)
+        file = tempfile.NamedTemporaryFile(suffix='.part', dir=directory)
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+        self.digest = ContentDigest()
+
+
+class HashingUploadHandler(FileUploadHandler):
+    # Streams every uploaded file to disk while computing its SHA-256, size
+    # and line count. An upload over the user's limit stops the request body
+    # from being read any further; the view sees request.upload_too_large.
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.limit = upload_limit(self.request.user)
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if self.content_length is not None and self.content_length > self.limit:
+            self.abort()
+        self.file = HashedUploadedFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.limit:
+            self.abort()
+        self.file.write(raw_data)
+        self.file.digest.update(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        return self.file
+
+    def abort(self):
+        self.request.upload_too_large = True
+        raise StopUpload(connection_reset=True)
+
@@ -0,0 +1,105 @@
+import os
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.db import transaction
+
+from .models import Directory, File, UploadChunk, UploadSession
+from .pipeline import enqueue
+from .storage import link_or_copy, undo_placements
+
+
+class PartFile(DjangoFile):
+    # FileSystemStorage moves files that have a temporary path instead of
+    # copying them, so storing a link to the part file is a rename.
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def start_session(owner, name, description, parent_dir, filename, size):
+    session = UploadSession.objects.create(
+        owner=owner, name=name, description=description, parent_dir=parent_dir,
+        filename=os.path.basename(filename) or name, size=size, chunk_size=settings.UPLOAD_CHUNK_SIZE,
+    )
+    os.makedirs(settings.UPLOAD_SESSION_DIR, exist_ok=True)
+    with open(session.part_path, 'wb') as part:
+        part.truncate(size)
+    return session
+
+
+def write_chunk(session, index, stream):
+    # Copies one chunk from stream to its place in the part file, 64 KiB at a
+    # time. Raises ValueError, leaving the chunk unreceived, if the stream
+    # does not hold exactly the chunk's length.
+    length = session.chunk_length(index)
+    written = 0
+
+    with open(session.part_path, 'r+b') as part:
+        part.seek(index * session.chunk_size)
+        while True:
+            piece = stream.read(min(64 * 1024, length - written + 1))
+            if not piece:
+                break
+            written += len(piece)
+            if written > length:
+                raise ValueError('chunk too long')
+            part.write(piece)
+
+    if written != length:
+        raise ValueError('chunk too short')
+    UploadChunk.objects.bulk_create([UploadChunk(session=session, index=index)], ignore_conflicts=True)
+
+
+def complete(session):
+    # Turns a fully received session into a File, once; later calls return
+    # the same File. Raises ValueError while chunks are missing,
+    # QuotaExceeded if the file no longer fits and Directory.DoesNotExist if
+    # its directory was deleted since the upload started. The blob store gets
+    # a link to the part file, which itself goes once the File commits; after
+    # a rollback the session can be completed again.
+    with undo_placements(), transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(id=session.id)
+        if session.file_id is not None:
+            return session.file
+        if session.missing():
+            raise ValueError('chunks missing')
+        parent_dir = None
+        if session.parent_dir_id is not None:
+            parent_dir = Directory.objects.live().get(id=session.parent_dir_id, owner=session.owner)
+
+        # saved like any upload: File.save hashes it, charges the quota and
+        # stores it, taking the one reference on its blob
+        file = File(
+            name=session.name, description=session.description, owner=session.owner,
+            parent_dir=parent_dir,
+        )
+        storage = File.content.field.storage
+        link = storage.path(os.path.join(os.path.dirname(File.content.field.upload_to), 'upload-%d.part' % session.id))
+        link_or_copy(session.part_path, link)
+        try:
+            with open(link, 'rb') as part:
+                file.content = PartFile(part, session.filename)
+                file.save()
+        finally:
+            # moved into place, or removed as the blob was there already
+            if os.path.exists(link):
+                os.remove(link)
+        enqueue([file.id])
+        transaction.on_commit(lambda: remove_part(session))
+
+        session.file = file
+        session.save(update_fields=['file'])
+        session.chunks.all().delete()
+        return file
+
+
+def remove_part(session):
+    try:
+        os.remove(session.part_path)
+    except FileNotFoundError:
+        pass
+
+
+def discard(session):
+    remove_part(session)
+    session.delete()
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
@@ -10,4 +11,28 @@ urlpatterns = [
     path('add-file/', views.add_file, name="add_file"),
 
     path('delete/', views.delete, name="delete"),
+
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', views.media, name="media"),
+
+    path('api/tree/', views.tree, name="tree"),
+
+    path('api/tree/changes/', views.changes, name="changes"),
+
+    path('api/nodes/search/', views.search, name="search"),
+
+    path('api/batch/', views.batch, name="batch"),
+
+    path('api/uploads/', views.start_upload, name="start_upload"),
+
+    path('api/uploads/<int:id>/', views.upload, name="upload"),
+
+    path('api/uploads/<int:id>/chunks/<int:offset>/', views.upload_chunk, name="upload_chunk"),
+
+    path('api/uploads/<int:id>/complete/', views.complete_upload, name="complete_upload"),
+
+    path('api/files/<int:id>/stages/', views.file_stages, name="file_stages"),
+
+    path('api/dirs/root/children/', views.children, name="root_children"),
+
+    path('api/dirs/<int:id>/children/', views.children, name="children"),
 ]
\ No newline at end of file
@@ -0,0 +1,29 @@
+from django.contrib.auth.models import User
+from django.db.models import Count, Sum
+
+from .models import File, StorageUsage
+
+
+def compute_usage():
+    # {owner id: (bytes, files)} from the File rows
+    rows = File.objects.values('owner_id').annotate(bytes=Sum('size'), files=Count('id'))
+    return {row['owner_id']: (row['bytes'] or 0, row['files']) for row in rows}
+
+
+def reconcile_usage(fix=True):
+    # Compares every user's stored usage with the computed one and returns the
+    # owner ids that differed, rewriting them unless fix is False. A missing
+    # row is zero usage.
+    expected = compute_usage()
+    stored = {owner_id: (bytes, files) for owner_id, bytes, files in StorageUsage.objects.values_list('owner_id', 'bytes', 'files')}
+    stale = [
+        owner_id for owner_id in User.objects.values_list('id', flat=True)
+        if stored.get(owner_id, (0, 0)) != expected.get(owner_id, (0, 0))
+    ]
+
+    if fix:
+        for owner_id in stale:
+            bytes, files = expected.get(owner_id, (0, 0))
+            StorageUsage.objects.update_or_create(owner_id=owner_id, defaults={'bytes': bytes, 'files': files})
+
+    return stale
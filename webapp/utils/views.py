@@ -1,25 +1,371 @@
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.template.loader import get_template, render_to_string
+from django.conf import settings
+from django.contrib import messages
+from django.db import transaction
 from .models import *
+from .tree import FileNode, load_children, stream_tree
+from .batch import BatchError, apply_ops
+from .archives import ArchiveError, Extraction, archive_stem
+from . import pipeline, uploads
+from .storage import blob_digest, blob_encoding, undo_placements
+from .uploadhandlers import upload_limit
+from .treecache import cached_tree, server_timing, tree_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.static import serve
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.shortcuts import redirect
+import json
+import mimetypes
 import re
 from django.utils.html import escape
 
 
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=tree_etag)
 def index(request, id=-1):
     if not request.user.is_authenticated:
-        dir_tree = ''
-        file_content = ''
         return render(request, 'utils/base.html')
 
-    dirs = Directory.objects.all().filter(parent_dir=None, owner=request.user)
+    if request.GET.get('stream'):
+        return StreamingHttpResponse(stream_page(request))
 
-    return render(request, 'utils/base.html', {
-        'files' : File.objects.all(),
-        'directories' : Directory.objects.all(),
-        'currentDir' : None,
+    entry, hit, elapsed = cached_tree(request.user, getattr(request, 'tree_version', None))
+
+    # The page carries the tree once: as the model the script draws from, or
+    # as plain HTML for browsers without scripts, which the noscript link asks for.
+    if request.GET.get('nojs'):
+        context = {'tree_html' : entry['html']}
+    else:
+        context = {'tree_model' : entry['json']}
+    response = render(request, 'utils/base.html', context)
+    response['Server-Timing'] = server_timing(hit, elapsed)
+    return response
+
+TREE_MARKER = '<!-- tree -->'
+
+def stream_page(request):
+    # The page shell up to the tree goes out before any tree row is read; the
+    # tree follows in TREE_STREAM_CHUNK sized pieces, rendered with the same
+    # template as the cached fragment.
+    head, tail = render_to_string('utils/base.html', {'tree_html' : TREE_MARKER}, request).split(TREE_MARKER, 1)
+    yield head
+
+    template = get_template('utils/tree.html')
+    events = []
+    for event in stream_tree(request.user, settings.TREE_STREAM_CHUNK):
+        events.append(event)
+        if len(events) == settings.TREE_STREAM_CHUNK:
+            yield template.render({'tree' : events})
+            events = []
+    yield template.render({'tree' : events})
+
+    yield tail
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=tree_etag)
+def tree(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Not logged in"}, status=403)
+
+    entry, hit, elapsed = cached_tree(request.user, getattr(request, 'tree_version', None))
+
+    response = JsonResponse(dict(entry['json'], version=entry['version']))
+    response['Server-Timing'] = server_timing(hit, elapsed)
+    return response
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=tree_etag)
+def changes(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Not logged in"}, status=403)
+
+    try:
+        since = int(request.GET.get('since', 0))
+        if since < 0:
+            raise ValueError(since)
+    except ValueError:
+        return JsonResponse({'error': "Bad cursor"}, status=400)
+
+    rows = list(TreeChange.objects.filter(owner=request.user, id__gt=since).order_by('id').values_list(
+        'id', 'op', 'kind', 'node_id', 'parent_id', 'name'
+    )[:settings.TREE_CHANGES_PAGE + 1])
+    more = len(rows) > settings.TREE_CHANGES_PAGE
+    rows = rows[:settings.TREE_CHANGES_PAGE]
+
+    contents = dict(File.objects.filter(
+        id__in=[node_id for id, op, kind, node_id, parent_id, name in rows if kind == 'f' and op != 'delete']
+    ).values_list('id', 'content'))
+
+    results = []
+    for id, op, kind, node_id, parent_id, name in rows:
+        change = {'cursor' : id, 'op' : op, 'kind' : kind, 'id' : node_id, 'parent' : parent_id, 'name' : name}
+        # files and directories number their ids separately
+        if kind == 'f' and node_id in contents:
+            change['url'] = FileNode(node_id, name, contents[node_id]).url
+        results.append(change)
+
+    return JsonResponse({
+        'changes' : results,
+        'cursor' : rows[-1][0] if rows else since,
+        'more' : more,
+    })
+
+FILE_METADATA = ('size', 'sha256', 'lines')
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=tree_etag)
+def children(request, id=-1):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Not logged in"}, status=403)
+
+    parent_id = None
+    if id != -1:
+        if not Directory.objects.live().filter(id=id, owner=request.user).exists():
+            return JsonResponse({'error': "No such directory"}, status=404)
+        parent_id = id
+
+    try:
+        limit = min(max(int(request.GET.get('limit', settings.TREE_PAGE_SIZE)), 1), settings.TREE_PAGE_SIZE)
+        dir_rows, file_rows, cursor = load_children(
+            request.user, parent_id, request.GET.get('after'), limit, Directory.AGGREGATES, FILE_METADATA
+        )
+    except ValueError:
+        return JsonResponse({'error': "Bad limit or cursor"}, status=400)
+
+    return JsonResponse({
+        'directories' : [
+            dict(zip(Directory.AGGREGATES, row[3:]), id=row[0], name=row[2]) for row in dir_rows
+        ],
+        'files' : [
+            dict(zip(FILE_METADATA, row[4:]), id=row[0], name=row[2], url=FileNode(row[0], row[2], row[3]).url) for row in file_rows
+        ],
+        'next' : cursor,
     })
 
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=tree_etag)
+def search(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Not logged in"}, status=403)
+
+    prefix = request.GET.get('q', '')
+    kind = request.GET.get('kind', 'all')
+    try:
+        limit = min(max(int(request.GET.get('limit', settings.PICKER_LIMIT)), 1), settings.PICKER_LIMIT)
+    except ValueError:
+        return JsonResponse({'error': "Bad limit"}, status=400)
+    if kind not in ('dir', 'file', 'all'):
+        return JsonResponse({'error': "Bad kind"}, status=400)
+
+    results = []
+    for model, model_kind in ((Directory, 'dir'), (File, 'file')):
+        if kind in (model_kind, 'all'):
+            rows = model.objects.live().filter(
+                owner=request.user, name__startswith=prefix
+            ).order_by('name', 'id').values_list('id', 'name')[:limit]
+            results += [{'id' : id, 'kind' : model_kind, 'name' : name} for id, name in rows]
+
+    results.sort(key=lambda node: (node['name'], node['kind'], node['id']))
+    return JsonResponse({'results' : results[:limit]})
+
+def batch(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Not logged in"}, status=403)
+    if request.method != 'POST':
+        return JsonResponse({'error': "POST only"}, status=405)
+
+    try:
+        ops = json.loads(request.body)['ops']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': "Expected {\"ops\": [...]}"}, status=400)
+    if not isinstance(ops, list) or len(ops) > settings.BATCH_MAX_OPS:
+        return JsonResponse({'error': "Expected at most %d operations" % settings.BATCH_MAX_OPS}, status=400)
+
+    try:
+        with transaction.atomic():
+            results = apply_ops(request.user, ops)
+    except BatchError as error:
+        results = [{'ok' : False, 'error' : "Rolled back"}] * error.index
+        results.append({'ok' : False, 'error' : error.message})
+        return JsonResponse({'error': "Operation %d failed: %s" % (error.index, error.message), 'results' : results}, status=400)
+
+    return JsonResponse({'results' : results, 'version' : TreeState.current(request.user.id)})
+
+def upload_status(session):
+    missing = session.missing() if session.file_id is None else []
+    return {
+        'id' : session.id,
+        'size' : session.size,
+        'chunk_size' : session.chunk_size,
+        'missing' : [index * session.chunk_size for index in missing],
+        'offset' : missing[0] * session.chunk_size if missing else session.size,
+        'file' : session.file_id,
+    }
+
+def start_upload(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Not logged in"}, status=403)
+    if request.method != 'POST':
+        return JsonResponse({'error': "POST only"}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        name, size, parent = data['name'], data['size'], data.get('parent')
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': "Expected name and size"}, status=400)
+    if not isinstance(name, str) or not 0 < len(name) <= 50:
+        return JsonResponse({'error': "Bad name"}, status=400)
+    if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+        return JsonResponse({'error': "Bad size"}, status=400)
+    if size > upload_limit(request.user):
+        return JsonResponse({'error': "File larger than %d bytes" % upload_limit(request.user)}, status=413)
+    try:
+        StorageUsage.check_room(request.user, size)
+    except QuotaExceeded as error:
+        return JsonResponse({'error': str(error)}, status=507)
+
+    parent_dir = None
+    if parent not in (None, -1):
+        parent_dir = Directory.objects.live().filter(id=parent, owner=request.user).first()
+        if parent_dir is None:
+            return JsonResponse({'error': "No such directory"}, status=404)
+
+    session = uploads.start_session(
+        request.user, name, str(data.get('description', ''))[:255], parent_dir, str(data.get('filename', name)), size
+    )
+    return JsonResponse(upload_status(session), status=201)
+
+def owned_session(request, id):
+    return UploadSession.objects.filter(id=id, owner=request.user).first()
+
+def upload(request, id):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Not logged in"}, status=403)
+    session = owned_session(request, id)
+    if session is None:
+        return JsonResponse({'error': "No such upload"}, status=404)
+
+    if request.method == 'DELETE':
+        uploads.discard(session)
+        return HttpResponse(status=204)
+    return JsonResponse(upload_status(session))
+
+def upload_chunk(request, id, offset):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Not logged in"}, status=403)
+    if request.method != 'PUT':
+        return JsonResponse({'error': "PUT only"}, status=405)
+    session = owned_session(request, id)
+    if session is None:
+        return JsonResponse({'error': "No such upload"}, status=404)
+    if session.file_id is not None:
+        return JsonResponse({'error': "Upload already complete"}, status=409)
+    if offset % session.chunk_size or offset >= max(session.size, 1):
+        return JsonResponse({'error': "Bad offset"}, status=400)
+
+    try:
+        uploads.write_chunk(session, offset // session.chunk_size, request)
+    except ValueError:
+        return JsonResponse({'error': "Chunk must be %d bytes" % session.chunk_length(offset // session.chunk_size)}, status=400)
+    return HttpResponse(status=204)
+
+def complete_upload(request, id):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Not logged in"}, status=403)
+    if request.method != 'POST':
+        return JsonResponse({'error': "POST only"}, status=405)
+    session = owned_session(request, id)
+    if session is None:
+        return JsonResponse({'error': "No such upload"}, status=404)
+
+    try:
+        file = uploads.complete(session)
+    except ValueError:
+        return JsonResponse(dict(upload_status(session), error="Chunks missing"), status=409)
+    except QuotaExceeded as error:
+        return JsonResponse(dict(upload_status(session), error=str(error)), status=507)
+    except Directory.DoesNotExist:
+        return JsonResponse({'error': "No such directory"}, status=404)
+    return JsonResponse({'file' : file.id, 'url' : FileNode(file.id, file.name, file.content.name).url})
+
+def file_stages(request, id):
+    # What the post-upload stages derived from a file so far. Clients poll
+    # this; stage progress is not a tree change, so the tree ETags ignore it.
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Not logged in"}, status=403)
+    if not File.objects.live().filter(id=id, owner=request.user).exists():
+        return JsonResponse({'error': "No such file"}, status=404)
+
+    return JsonResponse({'stages' : {
+        stage.stage : {
+            'status' : stage.status,
+            'attempts' : stage.attempts,
+            'result' : json.loads(stage.result) if stage.result else None,
+        } for stage in FileStage.objects.filter(file_id=id)
+    }})
+
+# types a browser shows without running anything in them; the rest are downloaded
+INLINE_TYPES = ('text/plain', 'image/png', 'image/jpeg', 'image/gif', 'application/pdf')
+
+def accepts_gzip(request):
+    # gzip, or else *, listed in Accept-Encoding with a q above zero
+    qualities = {}
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, *params = [part.strip() for part in coding.split(';')]
+        q = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        qualities[coding.lower()] = q
+    return qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0))) > 0
+
+def served_gzip(request, name):
+    return blob_encoding(name) == 'gzip' and accepts_gzip(request)
+
+def blob_etag(request, path):
+    # the gzip body differs from the plain one, so it gets its own tag
+    digest = blob_digest(path)
+    if digest is None:
+        return None
+    name = File.content.field.storage.existing_blob(path)
+    return digest + '-gzip' if name and served_gzip(request, name) else digest
+
+@condition(etag_func=blob_etag)
+def media(request, path):
+    # Uploaded files. A blob never changes, so clients may keep it for good;
+    # a gzip one goes out as stored to clients that accept gzip. It is
+    # downloaded under the name in ?name=, which FileNode.url adds.
+    if not blob_digest(path):
+        return serve(request, path, document_root=settings.MEDIA_ROOT)
+
+    storage = File.content.field.storage
+    name = storage.existing_blob(path)
+    if name is None:
+        raise Http404("No such file")
+
+    filename = request.GET.get('name') or blob_digest(name)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    attachment = content_type not in INLINE_TYPES
+    if served_gzip(request, name):
+        response = FileResponse(open(storage.path(name), 'rb'), as_attachment=attachment, filename=filename)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        file = storage.open(name)
+        response = FileResponse(file, as_attachment=attachment, filename=filename)
+        response['Content-Length'] = file.size
+    # set here, FileResponse guesses again from the stored file for text/html
+    response['Content-Type'] = content_type
+    response['X-Content-Type-Options'] = 'nosniff'
+    patch_vary_headers(response, ['Accept-Encoding'])
+    patch_cache_control(response, public=True, max_age=365 * 24 * 3600, immutable=True)
+    return response
+
 def add_dir(request, id=-1):
 
     if request.method == 'POST':
@@ -57,73 +403,83 @@ def add_file(request, id=-1):
     if request.method == 'POST':
         name = request.POST.get('file_name')
         desc = request.POST.get('file_desc')
-        f = request.FILES.get('file_file')
+        files = request.FILES.getlist('file_file')
+        if getattr(request, 'upload_too_large', False):
+            messages.error(request, "File larger than %d bytes" % upload_limit(request.user))
+            return redirect('/')
         user = request.user
+        if not user.is_authenticated:
+            return redirect('/')
         id = int(request.POST.get('dest_for_file'))
 
-        parent_set = Directory.objects.all().filter(id=id)
-
         if id == -1:
-            new_file = File(name=name, description=desc, owner=user, content=f)
-        elif parent_set.exists():
-            dir = parent_set[0]
-            if dir.availability_flag == False:
-                return redirect("/")
-
-            new_file = File(name=name, description=desc, owner=user, parent_dir=parent_set[0], content=f)
+            parent = None
         else:
+            # only into a live directory of the uploader's own
+            parent = Directory.objects.live().filter(id=id, owner=user).first()
+            if parent is None:
+                return redirect('/')
+
+        # one file takes the name from the form; several keep their own names.
+        # Archives become a directory with their contents when asked to.
+        # Everything derived from the content is left to the pipeline, which
+        # starts once the files are committed. Archives are unpacked before
+        # the transaction, which then only stores and inserts; blobs it placed
+        # are removed again if it rolls back.
+        extract = request.POST.get('extract')
+        extractions = []
+        try:
+            for f in files:
+                extractions.append(Extraction(user) if extract and archive_stem(f.name) else None)
+                if extractions[-1] is not None:
+                    extractions[-1].extract(f)
+
+            with undo_placements(), transaction.atomic():
+                new_ids = []
+                for f, extraction in zip(files, extractions):
+                    if extraction is None:
+                        new_file = File(name=name if len(files) == 1 else f.name[:50], description=desc, owner=user, parent_dir=parent, content=f)
+                        new_file.save()
+                        new_ids.append(new_file.id)
+                    else:
+                        new_dir = Directory(name=(name if len(files) == 1 else archive_stem(f.name))[:50], description=desc, owner=user, parent_dir=parent)
+                        new_dir.save()
+                        extraction.create(new_dir)
+                        new_ids.extend(extraction.file_ids)
+                pipeline.enqueue(new_ids)
+        except ArchiveError as error:
+            messages.error(request, str(error))
             return redirect('/')
-
-        new_file.save()
-
-        context = {
-            'id' : new_file.id
-        }
+        except QuotaExceeded as error:
+            messages.error(request, str(error))
+            return redirect('/')
+        finally:
+            for extraction in extractions:
+                if extraction is not None:
+                    extraction.discard()
 
         return redirect('/')
 
     else:
         return redirect('/')
 
-def delete_all(root_dir):
-    dirs = Directory.objects.all().filter(parent_dir=root_dir)
-
-    for dir in dirs:
-        dir.availability_flag = False
-        dir.save()
-
-        delete_all(dir)
-
-    files = File.objects.all().filter(parent_dir=root_dir)
-
-    for file in files:
-        file.availability_flag = False
-        file.save()
-
 def delete(request):
-    
-    if request.method == 'POST':
-        id = request.POST.get("to_delete")
-        
-        dir = Directory.objects.all().filter(id=id)
-
-        if dir.exists():
-            d = dir[0]
-            d.availability_flag = False
-            d.save()
 
-            delete_all(dir[0])
+    if request.method == 'POST' and request.user.is_authenticated:
+        # "d:<id>" or "f:<id>" from the picker. Files and directories number
+        # their ids separately, so a bare id could be either and is refused.
+        kind, sep, id = request.POST.get("to_delete", '').rpartition(':')
+        if kind not in ('d', 'f') or not id.isdigit():
+            return HttpResponseBadRequest("Expected d:<id> or f:<id>")
 
-            return redirect("/")
+        model = Directory if kind == 'd' else File
+        node = model.objects.live().filter(id=id, owner=request.user).first()
 
-        file = File.objects.all().filter(id=id)
-
-        if file.exists():
-            f = file[0]
-            f.availability_flag = False
-            f.save()
-            return redirect("/")
+        if node is not None:
+            with transaction.atomic():
+                count = node.soft_delete()
+            messages.info(request, "Deleted %d %s" % (count, "item" if count == 1 else "items"))
 
         return redirect("/")
     else:
-        return redirect('/')
\ No newline at end of file
+        return redirect('/')
@@ -132,4 +132,88 @@ LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'users_files/')
-MEDIA_URL = '/users_files/'
\ No newline at end of file
+MEDIA_URL = '/users_files/'
+
+# Trees with more live nodes than this are rendered one level at a time and
+# expanded through the children API, which serves pages of TREE_PAGE_SIZE.
+TREE_EAGER_NODES = 1000
+TREE_PAGE_SIZE = 200
+
+# Maintain utils.DirectoryClosure on every directory insert and move and answer
+# ancestry queries from it; otherwise they use recursive CTEs over parent_dir.
+TREE_CLOSURE_TABLE = False
+
+# Rendered trees are cached per user and tree version (see utils.treecache) in
+# the default cache; any backend works, e.g. locmem, file or database.
+TREE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Rows fetched per query chunk, and tree events per response chunk, when the
+# index page is streamed (/?stream=1) instead of rendered from the cache.
+TREE_STREAM_CHUNK = 2000
+
+# Most changes one /api/tree/changes/ response carries; clients ask again
+# while it reports more.
+TREE_CHANGES_PAGE = 500
+
+# manage.py purge hard-deletes nodes soft-deleted more than
+# PURGE_RETENTION_DAYS ago, PURGE_BATCH_SIZE rows per transaction with
+# PURGE_SLEEP seconds between transactions.
+PURGE_RETENTION_DAYS = 30
+PURGE_BATCH_SIZE = 500
+PURGE_SLEEP = 0.1
+
+# Chunked uploads (/api/uploads/): chunk size handed to clients, where the
+# part files are assembled, and how long an unfinished session is kept.
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+UPLOAD_SESSION_DIR = os.path.join(BASE_DIR, 'upload_sessions')
+UPLOAD_SESSION_HOURS = 24
+
+# Every uploaded file is streamed to disk next to the blobs and hashed on
+# the way (utils.uploadhandlers). UPLOAD_MAX_SIZE is the largest single file
+# in bytes, overridden per username in UPLOAD_MAX_SIZE_BY_USER.
+FILE_UPLOAD_HANDLERS = ['utils.uploadhandlers.HashingUploadHandler']
+UPLOAD_MAX_SIZE = 100 * 1024 * 1024
+UPLOAD_MAX_SIZE_BY_USER = {}
+
+# Text-like blobs of at least BLOB_COMPRESS_MIN_SIZE bytes are stored gzipped
+# when that saves a tenth or more; compressblobs moves cold ones to xz.
+BLOB_COMPRESS = True
+BLOB_COMPRESS_MIN_SIZE = 512
+
+# Most members, and most bytes once expanded, of one archive extracted by
+# add_file.
+ARCHIVE_MAX_ENTRIES = 10000
+ARCHIVE_MAX_SIZE = 1024 * 1024 * 1024
+
+# Most operations one /api/batch/ request may apply.
+BATCH_MAX_OPS = 1000
+
+# Most results a directory/file picker search returns.
+PICKER_LIMIT = 20
+
+# Per-user storage quota: bytes and number of files, counting soft-deleted
+# files until they are purged. None is no limit; the *_BY_USER dicts override
+# them per username.
+STORAGE_QUOTA_BYTES = 1024 * 1024 * 1024
+STORAGE_QUOTA_FILES = 50000
+STORAGE_QUOTA_BYTES_BY_USER = {}
+STORAGE_QUOTA_FILES_BY_USER = {}
+
+# Post-upload stages (utils.pipeline): name -> function of the File. They run
+# after the upload commits, on PIPELINE_EXECUTOR: 'thread' (a pool of
+# PIPELINE_WORKERS in the web process), 'queue' (only the runpipeline command)
+# or 'inline'. A failing stage is retried up to PIPELINE_MAX_ATTEMPTS times,
+# the first time after PIPELINE_RETRY_SECONDS and then twice as long each
+# time; one running longer than PIPELINE_STALE_SECONDS is taken as lost. The
+# preview stage reads at most PIPELINE_PREVIEW_BYTES.
+UPLOAD_STAGES = {
+    'encoding' : 'utils.pipeline.detect_encoding',
+    'preview' : 'utils.pipeline.build_preview',
+}
+PIPELINE_EXECUTOR = 'thread'
+PIPELINE_WORKERS = 2
+PIPELINE_MAX_ATTEMPTS = 3
+PIPELINE_RETRY_SECONDS = 30
+PIPELINE_STALE_SECONDS = 600
+PIPELINE_PREVIEW_LINES = 20
+PIPELINE_PREVIEW_BYTES = 8192